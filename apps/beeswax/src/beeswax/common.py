@@ -27,7 +27,7 @@ from beeswax import db_utils
 
 HIVE_IDENTIFER_REGEX = re.compile("^[a-zA-Z0-9]\w*$")
 
-DL_FORMATS = [ 'csv', 'xls' ]
+DL_FORMATS = [ 'csv', 'xls', 'tsv', 'csv_gz', 'tsv_gz', 'columnar' ]
 
 SELECTION_SOURCE = [ '', 'table', 'constant', ]
 
@@ -59,3 +59,22 @@ LOCAL_EXAMPLES_DATA_DIR = Config(
   key='local_examples_data_dir',
   default=os.path.join(os.path.dirname(__file__), "..", "..", "data"),
   help='The local filesystem path containing the beeswax examples')
+
+RESULT_CACHE_DIR = Config(
+  key='result_cache_dir',
+  default='',
+  help='Local directory where query results are spooled for paging and downloads. '
+       'Defaults to the system temporary directory.')
+
+RESULT_CACHE_MAX_SIZE = Config(
+  key='result_cache_max_size',
+  default=512 * 1024 * 1024,
+  type=int,
+  help='Maximum number of bytes of query results kept in the local result cache')
+
+META_CACHE_TTL = Config(
+  key='meta_cache_ttl',
+  default=60,
+  type=int,
+  help='Number of seconds that metastore metadata (tables, columns, partitions) '
+       'is cached for. Changes made through Hue are seen right away. 0 disables the cache.')
@@ -18,21 +18,18 @@
 # Handling of data export
 
 import logging
-import time
 
 from django.http import HttpResponse
 
 from beeswax import common
-from beeswax import db_utils
-from beeswaxd.ttypes import QueryHandle
+from beeswax import result_cache
 
-from desktop.lib.export_csvxls import CSVformatter, XLSformatter, TooBigToDownloadException
+from desktop.lib import export_csvxls
+from desktop.lib.export_csvxls import TooBigToDownloadException
 
 
 LOG = logging.getLogger(__name__)
 
-_DATA_WAIT_SLEEP = 0.1                  # Sleep 0.1 sec before checking for data availability
-
 
 def download(query_model, format):
   """
@@ -44,16 +41,10 @@ def download(query_model, format):
     LOG.error('Unknown download format "%s"' % (format,))
     return
 
-  if format == 'csv':
-    formatter = CSVformatter()
-    mimetype = 'application/csv'
-  elif format == 'xls':
-    formatter = XLSformatter()
-    mimetype = 'application/xls'
-
-  gen = data_generator(query_model, formatter)
+  make_formatter, mimetype, extension = export_csvxls.FORMATS[format]
+  gen = data_generator(query_model, make_formatter())
   resp = HttpResponse(gen, mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=query_result.%s' % (format,)
+  resp['Content-Disposition'] = 'attachment; filename=query_result.%s' % (extension,)
   return resp
 
 
@@ -63,54 +54,25 @@ def data_generator(query_model, formatter):
 
   Return a generator object for a csv. The first line is the column names.
 
-  This is similar to export_csvxls.generator, but has
-  one or two extra complexities.
+  Rows are read from the local result spool, which fetches them from the
+  Beeswax server only once, so concurrent downloads and views of the same
+  results do not interfere. Formatters that accept raw rows get them
+  without being split into cells.
   """
-  global _DATA_WAIT_SLEEP
-  is_first_row = True
-  next_row = 0
-  results = None
-  handle = QueryHandle(query_model.server_id, query_model.log_context)
+  raw = formatter.accepts_raw_rows
+  columns, rows = result_cache.iter_rows(query_model, raw=raw)
+  if raw:
+    format_row = lambda row: formatter.format_raw_row(row, 'utf-8')
+  else:
+    format_row = formatter.format_row
 
   yield formatter.init_doc()
-
-  while True:
-    # Make sure that we have the next batch of ready results
-    while results is None or not results.ready:
-      results = db_utils.db_client().fetch(handle, start_over=is_first_row)
-      if not results.ready:
-        time.sleep(_DATA_WAIT_SLEEP)
-
-    # Someone is reading the results concurrently. Abort.
-    # But unfortunately, this current generator will produce incomplete data.
-    if next_row != results.start_row:
-      msg = 'Error: Potentially incomplete results as an error occur during data retrieval.'
-      yield formatter.format_row([msg])
-      err = ('Detected another client retrieving results for %s. '
-             'Expect next row being %s and got %s. Aborting' %
-             (query_model.server_id, next_row, results.start_row))
-      LOG.error(err)
-      raise RuntimeError(err)
-
-    if is_first_row:
-      is_first_row = False
-      yield formatter.format_header(results.columns)
-    else:
-      for i, row in enumerate(results.data):
-        # TODO(bc): Hive seems to always return tab delimited row data.
-        # What if a cell has a tab?
-        row = row.split('\t')
-        try:
-          yield formatter.format_row(row)
-        except TooBigToDownloadException, ex:
-          LOG.error(ex)
-          # Exceeded limit. Stop.
-          results.has_more = False
-          break
-
-      if results.has_more:
-        next_row += len(results.data)
-        results = None
-      else:
-        yield formatter.fini_doc()
-        break
+  yield formatter.format_header(columns)
+  for row in rows:
+    try:
+      yield format_row(row)
+    except TooBigToDownloadException, ex:
+      LOG.error(ex)
+      # Exceeded limit. Stop.
+      break
+  yield formatter.fini_doc()
@@ -21,11 +21,12 @@ Utils for interacting with Beeswaxd/Hive
 
 import logging
 import thrift
-import time
 
 from beeswax import conf
+from beeswax import meta_cache
 from beeswax import models
 from beeswax.models import QueryHistory
+from beeswax.query_tracker import QueryTracker, FINISHED_STATES
 from beeswaxd import BeeswaxService
 
 from django.utils.encoding import smart_str, force_unicode
@@ -60,6 +61,8 @@ def execute_directly(user, query_msg, design=None, notify=False):
   query_history.save()
   LOG.debug("Made new QueryHistory id %s user %s query: %s..." %
             (query_history.id, user, query_history.query[:25]))
+  # Again once it is done; see query_done()
+  meta_cache.invalidate_for_query(query_history.query)
 
   # Now submit it
   try:
@@ -96,19 +99,16 @@ def wait_for_results(query_history, timeout_sec=30.0):
   Return the results when the query is completed, or None on timeout.
   May raise BeeswaxException.
   """
-  SLEEP_INTERVAL = 0.5
-  START_OVER = True
-
   handle = QueryHandle(id=query_history.server_id, log_context=query_history.log_context)
+  state = query_tracker.wait(handle, timeout_sec)
+  if state is not None and state not in FINISHED_STATES:
+    return None
+  query_done(query_history)
 
-  curr = time.time()
-  end = curr + timeout_sec
-  while curr <= end:
-    results = db_client().fetch(handle, START_OVER)
-    if results.ready:
-      return results
-    time.sleep(SLEEP_INTERVAL)
-    curr = time.time()
+  # Fetching a failed query raises its BeeswaxException.
+  results = db_client().fetch(handle, True)
+  if results.ready:
+    return results
   return None
 
 
@@ -123,6 +123,14 @@ def execute_and_wait(user, query_msg, timeout_sec=30.0):
   return result
 
 
+def query_done(query_history):
+  """
+  Called when a query has finished. Forgets the metadata it may have changed,
+  which may have been read again while it ran.
+  """
+  meta_cache.invalidate_for_query(query_history.query)
+
+
 def get_query_state(query_history):
   """
   get_query_state(query_history) --> state enum
@@ -130,6 +138,9 @@ def get_query_state(query_history):
   Find out the *server* state of this query, and translate it to the *client* state.
   Expects to find the server_id from the ``query_history``.
   Return None on error. (It catches all anticipated exceptions.)
+
+  The state comes from the query tracker, which asks the server only about
+  queries that it is not already tracking.
   """
   # First, we need the server handle
   ok, server_id = query_history.get_server_id()
@@ -138,19 +149,38 @@ def get_query_state(query_history):
       return None
     return models.QueryHistory.STATE[query_history.last_state]
 
-  # Now check the server state
   handle = QueryHandle(id=server_id, log_context=query_history.log_context)
+  return query_tracker.get_state(handle)
+
+
+def wait_for_query_state(query_history, timeout_sec):
+  """
+  wait_for_query_state(query_history, timeout_sec) --> state enum
+
+  Like get_query_state(), but waits up to timeout_sec for the query to finish.
+  """
+  ok, server_id = query_history.get_server_id()
+  if not server_id:
+    return get_query_state(query_history)
+  handle = QueryHandle(id=server_id, log_context=query_history.log_context)
+  return query_tracker.wait(handle, timeout_sec)
+
+
+def _get_server_state(handle):
+  """Asks the server for the state of a query. Return None on error."""
   try:
     server_state = db_client().get_state(handle)
     return models.QueryHistory.STATE_MAP[server_state]
   except QueryNotFoundException:
-    LOG.debug("Query id %s has expired" % (query_history.id,))
+    LOG.debug("Query id %s has expired" % (handle.id,))
     return models.QueryHistory.STATE.expired
   except thrift.transport.TTransport.TTransportException, ex:
     LOG.error("Failed to retrieve server state of submitted query id %s: %s" %
-              (query_history.id, ex))
+              (handle.id, ex))
     return None
 
+query_tracker = QueryTracker(_get_server_state)
+
 
 #
 # Note that thrift_util does client connection caching for us.
@@ -216,12 +246,18 @@ def db_client():
 
 
 def meta_client():
-  """Get the Thrift client to talk to the metastore"""
+  """
+  Get the Thrift client to talk to the metastore.
+
+  Tables, fields and partitions are read through the shared metadata
+  cache (see meta_cache), which changes made through this client invalidate.
+  """
 
   class UnicodeMetastoreClient(object):
     """Wrap the thrift client to take and return Unicode."""
     def __init__(self, client):
       self._client = client
+      self._cache = meta_cache.get_cache()
 
     def __getattr__(self, attr):
       if attr in self.__dict__:
@@ -256,21 +292,31 @@ def meta_client():
       db = self._client.get_database(*args, **kwargs)
       return _decode_struct_attr(db, 'description')
 
-    def get_fields(self, *args, **kwargs):
-      res = self._client.get_fields(*args, **kwargs)
-      for fschema in res:
-        _decode_struct_attr(fschema, 'comment')
-      return res
-
-    def get_table(self, *args, **kwargs):
-      res = self._client.get_table(*args, **kwargs)
-      self._decode_storage_descriptor(res.sd)
-      self._decode_map(res.parameters)
-      return res
+    def get_tables(self, db_name, pattern):
+      return self._cache.get('get_tables', db_name, None, (pattern,),
+                             lambda: self._client.get_tables(db_name, pattern))
+
+    def get_fields(self, db_name, table_name):
+      def fetch():
+        res = self._client.get_fields(db_name, table_name)
+        for fschema in res:
+          _decode_struct_attr(fschema, 'comment')
+        return res
+      return self._cache.get('get_fields', db_name, table_name, (), fetch)
+
+    def get_table(self, dbname, tbl_name):
+      def fetch():
+        res = self._client.get_table(dbname, tbl_name)
+        self._decode_storage_descriptor(res.sd)
+        self._decode_map(res.parameters)
+        return res
+      return self._cache.get('get_table', dbname, tbl_name, (), fetch)
 
     def alter_table(self, dbname, tbl_name, new_tbl):
       self._encode_storage_descriptor(new_tbl.sd)
       self._encode_map(new_tbl.parameters)
+      self._cache.invalidate(dbname, tbl_name)
+      self._cache.invalidate(dbname, new_tbl.tableName)
       return self._client.alter_table(dbname, tbl_name, new_tbl)
 
     def _encode_partition(self, part):
@@ -285,21 +331,32 @@ def meta_client():
 
     def add_partition(self, new_part):
       self._encode_partition(new_part)
+      self._cache.invalidate(new_part.dbName, new_part.tableName)
       part = self._client.add_partition(new_part)
       return self._decode_partition(part)
 
-    def get_partition(self, *args, **kwargs):
-      part = self._client.get_partition(*args, **kwargs)
-      return self._decode_partition(part)
-
-    def get_partitions(self, *args, **kwargs):
-      part_list = self._client.get_partitions(*args, **kwargs)
-      for part in part_list:
-        self._decode_partition(part)
-      return part_list
+    def get_partition(self, db_name, tbl_name, part_vals):
+      def fetch():
+        part = self._client.get_partition(db_name, tbl_name,
+                                          [ smart_str(val) for val in part_vals ])
+        return self._decode_partition(part)
+      return self._cache.get('get_partition', db_name, tbl_name, tuple(part_vals), fetch)
+
+    def get_partitions(self, db_name, tbl_name, max_parts):
+      def fetch():
+        part_list = self._client.get_partitions(db_name, tbl_name, max_parts)
+        for part in part_list:
+          self._decode_partition(part)
+        return part_list
+      return self._cache.get('get_partitions', db_name, tbl_name, (max_parts,), fetch)
+
+    def get_partition_names(self, *args, **kwargs):
+      names = self._client.get_partition_names(*args, **kwargs)
+      return [ force_unicode(name, errors='replace') for name in names ]
 
     def alter_partition(self, db_name, tbl_name, new_part):
       self._encode_partition(new_part)
+      self._cache.invalidate(db_name, tbl_name)
       return self._client.alter_partition(db_name, tbl_name, new_part)
 
   client = thrift_util.get_client(ThriftHiveMetastore.Client,
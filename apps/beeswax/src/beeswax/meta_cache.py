@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Caching of metastore metadata.
+#
+# Most Beeswax pages list the tables, or look up a table or its partitions,
+# each a metastore round trip plus the decoding of every storage descriptor.
+# The answers are shared here by all users for a little while.  DDL that
+# goes through Hue invalidates what it affects right away; changes made
+# from outside Hue show up once the entries expire.
+
+import re
+import threading
+import time
+
+from beeswax import conf
+from desktop.lib.lru_cache import LRUCache
+
+META_CACHE_SIZE = 10000
+
+# The statements that change metadata, and the tables they name
+_DDL_RE = re.compile(r'^\s*(?:create|drop|alter|load|insert\s+(?:overwrite|into)\s+table)\b', re.I)
+_DDL_TABLE_RE = re.compile(r'\b(?:table|view|rename\s+to)\s+'
+                           r'(?:if\s+(?:not\s+)?exists\s+)?`?(\w+)`?', re.I)
+
+
+class MetadataCache(object):
+  """
+  Caches metastore answers by (kind of call, database, table, arguments).
+
+  Every database, every table, and the list of tables of every database
+  have a version, which invalidate() bumps. An entry is only good for the version it was
+  fetched at, so that a fetch racing with an invalidation can't put stale
+  metadata back in.
+
+  Cached objects are shared by all callers; don't modify them.
+  """
+
+  def __init__(self, ttl, max_size=META_CACHE_SIZE, clock=time.time):
+    self._cache = LRUCache(max_size, ttl=ttl, clock=clock)
+    self._lock = threading.Lock()
+    self._versions = {}
+    self.hits = {}
+    self.misses = {}
+
+  def _version(self, db, table):
+    """Lock must be held."""
+    return (self._versions.get(db, 0), self._versions.get((db, table), 0))
+
+  def get(self, kind, db, table, args, fetch):
+    """
+    Returns the cached answer to the call, or calls fetch() for it.
+    table is None for calls about the database as a whole.
+    """
+    if table is not None:
+      table = table.lower()
+    key = (kind, db, table, args)
+    self._lock.acquire()
+    try:
+      version = self._version(db, table)
+    finally:
+      self._lock.release()
+
+    cached = self._cache.get(key)
+    if cached is not None and cached[0] == version:
+      self._count(self.hits, kind)
+      return cached[1]
+
+    self._count(self.misses, kind)
+    value = fetch()
+    self._lock.acquire()
+    try:
+      if self._version(db, table) == version:
+        self._cache.put(key, (version, value))
+    finally:
+      self._lock.release()
+    return value
+
+  def _count(self, counts, kind):
+    self._lock.acquire()
+    try:
+      counts[kind] = counts.get(kind, 0) + 1
+    finally:
+      self._lock.release()
+
+  def invalidate(self, db, table=None):
+    """
+    Forgets the metadata of the table, and the list of tables of its
+    database. Without a table, forgets everything about the database.
+    """
+    self._lock.acquire()
+    try:
+      if table is None:
+        keys = [ db ]
+      else:
+        keys = [ (db, None), (db, table.lower()) ]
+      for key in keys:
+        self._versions[key] = self._versions.get(key, 0) + 1
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._cache.clear()
+    self._lock.acquire()
+    try:
+      self._versions.clear()
+      self.hits.clear()
+      self.misses.clear()
+    finally:
+      self._lock.release()
+
+  def stats(self):
+    """Hit and miss counts, overall and by kind of call."""
+    self._lock.acquire()
+    try:
+      res = self._cache.stats()
+      res['hits_by_call'] = dict(self.hits)
+      res['misses_by_call'] = dict(self.misses)
+      return res
+    finally:
+      self._lock.release()
+
+
+def ddl_tables(hql):
+  """
+  Returns the names of the tables that the statements of hql change, with
+  None standing for "any table" when a changing statement names none we
+  can find. Returns an empty list if hql doesn't change metadata.
+  """
+  tables = []
+  # Semicolons inside string literals only make for extra invalidations
+  for statement in hql.split(';'):
+    if not _DDL_RE.match(statement):
+      continue
+    names = _DDL_TABLE_RE.findall(statement)
+    if not names:
+      names = [ None ]
+    for name in names:
+      if name not in tables:
+        tables.append(name)
+  return tables
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+  """Returns the shared MetadataCache."""
+  global _cache
+  _cache_lock.acquire()
+  try:
+    if _cache is None:
+      _cache = MetadataCache(conf.META_CACHE_TTL.get())
+    return _cache
+  finally:
+    _cache_lock.release()
+
+
+def invalidate_for_query(hql, db='default'):
+  """Invalidates whatever metadata the query may change."""
+  cache = get_cache()
+  for table in ddl_tables(hql):
+    cache.invalidate(db, table)
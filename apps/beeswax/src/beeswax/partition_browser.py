@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Browsing of the partitions of a table.
+#
+# Tables partitioned by date and hour easily have tens of thousands of
+# partitions, too many to fetch with their storage descriptors for every
+# page view.  Only the partition names ("ds=2010-01-01/hr=12") of a table
+# are fetched (and cached) as a whole; they are filtered and sorted here,
+# and the full partitions are looked up for the page being shown only.
+
+import re
+import urllib
+
+from desktop.lib.paginator import Paginator
+from desktop.lib.thrift_util import call_async
+
+from beeswax import db_utils
+from beeswax import meta_cache
+
+PARTITIONS_PAGE_SIZE = 50
+
+# At most this many partitions are looked up at once
+MAX_PARALLEL_FETCHES = 10
+
+# Filters are given as <partition key>__<operator>=<value>
+FILTER_OPERATORS = ('startswith', 'gte', 'lte')
+
+_NUMBER_RE = re.compile(r'^-?\d+$')
+
+
+def parse_partition_name(name):
+  """
+  Returns the values of a partition name like "ds=2010-01-01/hr=12".
+  Hive escapes '/', '=' and other special characters in values as %XX.
+  """
+  return [ urllib.unquote(part.split('=', 1)[-1]) for part in name.split('/') ]
+
+
+def _sort_key(value):
+  """Sorts hour=9 before hour=10."""
+  if _NUMBER_RE.match(value):
+    return (0, int(value), value)
+  return (1, 0, value)
+
+
+def get_partition_values(table):
+  """
+  Returns the values of every partition of the table, sorted.
+
+  The list is kept in the metadata cache, with the rest of the metadata of
+  the table, so it is invalidated along with it.
+  """
+  def fetch():
+    names = db_utils.meta_client().get_partition_names(table.dbName, table.tableName, -1)
+    values = [ parse_partition_name(name) for name in names ]
+    values.sort(key=lambda vals: [ _sort_key(val) for val in vals ])
+    return values
+  return meta_cache.get_cache().get('partition_values', table.dbName, table.tableName, (), fetch)
+
+
+def parse_filters(table, querydict):
+  """
+  Returns the filters in querydict, as (index of the partition key,
+  operator, value) tuples. Unknown keys and empty values are ignored.
+  """
+  key_names = [ key.name.lower() for key in table.partitionKeys ]
+  filters = []
+  for param, value in querydict.items():
+    if '__' not in param or not value:
+      continue
+    name, op = param.rsplit('__', 1)
+    if name.lower() in key_names and op in FILTER_OPERATORS:
+      filters.append((key_names.index(name.lower()), op, value))
+  return filters
+
+
+def _matches(values, filters):
+  for index, op, bound in filters:
+    value = values[index]
+    if op == 'startswith':
+      if not value.startswith(bound):
+        return False
+    elif op == 'gte':
+      if _sort_key(value) < _sort_key(bound):
+        return False
+    elif _sort_key(value) > _sort_key(bound):
+      return False
+  return True
+
+
+def filter_partition_values(values, filters):
+  if not filters:
+    return values
+  return [ vals for vals in values if _matches(vals, filters) ]
+
+
+def get_page(table, filters, pagenum, page_size=PARTITIONS_PAGE_SIZE):
+  """
+  Returns a page of the partitions of the table matching the filters.
+  Only the partitions on the page are fetched from the metastore, a few
+  at a time.
+  """
+  values = filter_partition_values(get_partition_values(table), filters)
+  paginator = Paginator(values, page_size)
+  page = paginator.page(min(max(pagenum, 1), paginator.num_pages))
+  client = db_utils.meta_client()
+  partitions = []
+  for start in range(0, len(page.object_list), MAX_PARALLEL_FETCHES):
+    batch = page.object_list[start:start + MAX_PARALLEL_FETCHES]
+    futures = [ call_async(client.get_partition, table.dbName, table.tableName, vals)
+                for vals in batch ]
+    partitions.extend([ future.result() for future in futures ])
+  page.object_list = partitions
+  return page
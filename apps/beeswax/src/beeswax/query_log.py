@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Buffering of query logs.
+#
+# The logs of long queries grow to megabytes. They are kept here per log
+# context, so that the Hadoop jobs they mention are parsed out only from the
+# lines added since last time, clients can ask for just the text past an
+# offset, and the logs of finished queries are not fetched again.  However
+# many clients watch a running query, its log is fetched from the server at
+# most every LOG_REFRESH_INTERVAL.
+
+import re
+import threading
+import time
+
+from beeswax import db_utils
+from desktop.lib.lru_cache import LRUCache
+
+HADOOP_JOBS_RE = re.compile("(http[^\s]*/jobdetails.jsp\?jobid=([a-z0-9_]*))")
+
+# Upper bound on the total number of characters of logs kept
+LOG_CACHE_SIZE = 64 * 1024 * 1024
+# Only the end of longer logs is kept, so that every log fits
+MAX_LOG_SIZE = LOG_CACHE_SIZE / 8
+
+# The log of a running query is fetched at most this often (seconds)
+LOG_REFRESH_INTERVAL = 3
+
+_logs = LRUCache(LOG_CACHE_SIZE, sizeof=len)
+_logs_lock = threading.Lock()
+
+
+def parse_hadoop_jobs(log, job_ids=None):
+  """
+  Returns the ids of the Hadoop jobs linked to from the log, in order of
+  appearance, appended to job_ids.
+
+  Ideally, Hive would tell us what jobs it has run directly
+  from the Thrift interface.  For now, we parse the logs
+  to look for URLs to those jobs.
+  """
+  if job_ids is None:
+    job_ids = []
+  for match in HADOOP_JOBS_RE.finditer(log):
+    full_job_url, job_id = match.groups()
+    # We ignore full_job_url for now, but it may
+    # come in handy if we support multiple MR clusters
+    # correctly.
+
+    # Ignore duplicates
+    if job_id in job_ids:
+      continue
+    job_ids.append(job_id)
+  return job_ids
+
+
+class QueryLog(object):
+  """
+  The log of one query as seen so far, and the Hadoop jobs it mentions.
+
+  Offsets are in characters of the whole log. Only its last MAX_LOG_SIZE
+  characters are kept in text, which starts at offset start.
+  """
+
+  def __init__(self):
+    self.text = u''
+    self.start = 0
+    self.hadoop_jobs = []
+    self.final = False
+    # When the log was last fetched from the server
+    self.fetched = None
+    # Everything before this offset has been parsed for jobs. It is always
+    # at the start of a line, so that no job URL is cut in half.
+    self._parsed = 0
+
+  def __len__(self):
+    return len(self.text)
+
+  def update(self, log, final=False):
+    """Takes the whole log as now returned by the server."""
+    if not log.startswith(self.text, self.start):
+      # Not a continuation of what we have; start over.
+      self.text = u''
+      self.start = 0
+      self.hadoop_jobs = []
+      self._parsed = 0
+    self.start = max(self.start, len(log) - MAX_LOG_SIZE)
+    self.text = log[self.start:]
+    if final:
+      end = len(log)
+    else:
+      end = log.rfind('\n', self._parsed) + 1
+    if end > self._parsed:
+      parse_hadoop_jobs(log[self._parsed:end], self.hadoop_jobs)
+      self._parsed = end
+    self.final = final
+
+  def read(self, offset=0):
+    """
+    read([offset]) -> (text, next_offset)
+
+    Returns the log text past offset, and the offset to read from next time.
+    Text before start is no longer kept; reading from there starts at start.
+    """
+    end = self.start + len(self.text)
+    offset = max(self.start, min(offset, end))
+    return self.text[offset - self.start:], end
+
+
+def get_query_log(log_context, finished=False):
+  """
+  Returns the QueryLog of the given log context, with the latest log from
+  the server, or the one fetched less than LOG_REFRESH_INTERVAL ago. Pass
+  finished=True if the query is done, so that its final log is fetched
+  once, and not again later.
+
+  May raise QueryNotFoundException.
+  """
+  now = time.time()
+  _logs_lock.acquire()
+  try:
+    query_log = _logs.get(log_context)
+    if query_log is None:
+      query_log = QueryLog()
+    elif query_log.final:
+      return query_log
+    elif not finished and now - query_log.fetched < LOG_REFRESH_INTERVAL:
+      return query_log
+    # Other clients use what we have meanwhile
+    query_log.fetched = now
+  finally:
+    _logs_lock.release()
+
+  log = db_utils.db_client().get_log(log_context)
+  _logs_lock.acquire()
+  try:
+    query_log.update(log, finished)
+    # Re-accounts its size
+    _logs.put(log_context, query_log)
+  finally:
+    _logs_lock.release()
+  return query_log
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Tracking of query states.
+#
+# Rather than every view (and every user watching a query) asking the
+# Beeswax server for the state of a query, one background thread polls each
+# outstanding query, backing off while its state does not change, and views
+# read or wait on the state it has last seen.
+
+import logging
+import threading
+import time
+
+from beeswax.models import QueryHistory
+from desktop.lib.lru_cache import LRUCache
+
+LOG = logging.getLogger(__name__)
+
+FINISHED_STATES = (QueryHistory.STATE.available,
+                   QueryHistory.STATE.failed,
+                   QueryHistory.STATE.expired)
+
+# Polling interval (seconds) of a running query. It doubles, up to the
+# maximum, for as long as the state stays the same.
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5.0
+
+# Finished states are remembered for a while, after which the server is
+# asked again, so that results expiring on the server are noticed.
+FINISHED_STATE_TTL = 60
+FINISHED_STATE_CACHE_SIZE = 10000
+
+
+class _TrackedQuery(object):
+  def __init__(self, handle, state, now):
+    self.handle = handle
+    self.state = state
+    self.interval = MIN_POLL_INTERVAL
+    self.next_poll = now + self.interval
+
+
+class QueryTracker(object):
+  """
+  Keeps the state of queries, as found by poll(handle), which returns a
+  QueryHistory.STATE, or None if the server could not be asked.
+
+  The polling thread is started when there is a running query to track, and
+  exits once there is none left.
+  """
+
+  def __init__(self, poll, clock=time.time):
+    self._poll = poll
+    self._clock = clock
+    self._cond = threading.Condition()
+    self._running = {}
+    self._finished = LRUCache(FINISHED_STATE_CACHE_SIZE, ttl=FINISHED_STATE_TTL, clock=clock)
+    self._thread = None
+
+  def _cached_state(self, key):
+    """Lock must be held."""
+    tracked = self._running.get(key)
+    if tracked is not None:
+      return tracked.state
+    return self._finished.get(key)
+
+  def _record(self, handle, state):
+    """Lock must be held."""
+    key = handle.id
+    now = self._clock()
+    tracked = self._running.get(key)
+    if state in FINISHED_STATES:
+      self._running.pop(key, None)
+      self._finished.put(key, state)
+    elif tracked is None:
+      self._running[key] = _TrackedQuery(handle, state, now)
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='beeswax-query-tracker')
+        self._thread.setDaemon(True)
+        self._thread.start()
+    else:
+      if state is not None and state != tracked.state:
+        tracked.interval = MIN_POLL_INTERVAL
+      else:
+        tracked.interval = min(tracked.interval * 2, MAX_POLL_INTERVAL)
+      if state is not None:
+        tracked.state = state
+      tracked.next_poll = now + tracked.interval
+    self._cond.notifyAll()
+
+  def get_state(self, handle):
+    """
+    Returns the last known state of the query, asking the server only if
+    the query is not tracked yet. Returns None if that failed.
+    """
+    self._cond.acquire()
+    try:
+      state = self._cached_state(handle.id)
+    finally:
+      self._cond.release()
+    if state is not None:
+      return state
+
+    state = self._poll(handle)
+    if state is not None:
+      self._cond.acquire()
+      try:
+        self._record(handle, state)
+      finally:
+        self._cond.release()
+    return state
+
+  def wait(self, handle, timeout):
+    """
+    Waits up to timeout seconds for the query to finish.
+    Returns its state at that point, or None if it could not be found out.
+    """
+    state = self.get_state(handle)
+    deadline = self._clock() + timeout
+    self._cond.acquire()
+    try:
+      while state is not None and state not in FINISHED_STATES:
+        remaining = deadline - self._clock()
+        if remaining <= 0:
+          return state
+        self._cond.wait(remaining)
+        state = self._cached_state(handle.id)
+        if state is None:
+          # The finished state was forgotten meanwhile.
+          break
+    finally:
+      self._cond.release()
+    if state is None:
+      state = self.get_state(handle)
+    return state
+
+  def poke(self, server_id):
+    """Has the query polled right away, e.g. because the server says it is done."""
+    self._cond.acquire()
+    try:
+      tracked = self._running.get(server_id)
+      if tracked is not None:
+        tracked.interval = MIN_POLL_INTERVAL
+        tracked.next_poll = self._clock()
+        self._cond.notifyAll()
+    finally:
+      self._cond.release()
+
+  def clear(self):
+    """Forgets every query. The polling thread exits soon after."""
+    self._cond.acquire()
+    try:
+      self._running.clear()
+      self._finished.clear()
+      self._cond.notifyAll()
+    finally:
+      self._cond.release()
+
+  def _run(self):
+    while True:
+      self._cond.acquire()
+      try:
+        if not self._running:
+          self._thread = None
+          return
+        now = self._clock()
+        due = [ t for t in self._running.itervalues() if t.next_poll <= now ]
+        if not due:
+          self._cond.wait(min([ t.next_poll for t in self._running.itervalues() ]) - now)
+          continue
+      finally:
+        self._cond.release()
+
+      for tracked in due:
+        try:
+          state = self._poll(tracked.handle)
+        except Exception, ex:
+          LOG.exception('Failed to poll the state of query %s' % (tracked.handle.id,))
+          state = None
+        self._cond.acquire()
+        try:
+          if self._running.get(tracked.handle.id) is tracked:
+            self._record(tracked.handle, state)
+        finally:
+          self._cond.release()
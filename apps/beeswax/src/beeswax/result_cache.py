@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Local spooling of query results.
+#
+# The Beeswax server keeps a single cursor per query, so every page jump
+# or download used to rewind and re-read the results from the server, and
+# two concurrent readers would corrupt each other's view.  Instead, results
+# are read from the server once, in order, into a spool on local disk, and
+# every reader is served from there.
+
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+from beeswax import conf
+from beeswax import db_utils
+from beeswaxd.ttypes import QueryHandle
+
+from desktop.lib.lru_cache import LRUCache
+
+LOG = logging.getLogger(__name__)
+
+_DATA_WAIT_TIMEOUT = 5.0                # Wait up to 5 sec for the query to finish between fetches
+
+# Rows in the data file are a 4-byte length followed by the utf-8 row.
+# The index file holds the 8-byte data file offset of every row.
+_LENGTH = '>I'
+_LENGTH_SIZE = struct.calcsize(_LENGTH)
+_OFFSET = '>Q'
+_OFFSET_SIZE = struct.calcsize(_OFFSET)
+
+# Number of rows read from a spool at a time when iterating over it
+ITER_BATCH_SIZE = 1000
+
+
+class ResultSpool(object):
+  """
+  The results of one query, fetched from the Beeswax server on demand and
+  kept on local disk with random access by row number.
+
+  Rows are fetched in server order, only as far as a reader has asked for.
+  The spool files are unlinked as soon as they are created, so their space
+  is given back as soon as the spool is closed or garbage collected, even if
+  the process dies.
+  """
+
+  def __init__(self, handle, directory=None):
+    self.handle = handle
+    self.columns = None
+    self.num_rows = 0
+    self.complete = False
+    self._started = False
+    self._lock = threading.Lock()
+    self._data = _unlinked_tempfile(directory)
+    self._index = _unlinked_tempfile(directory)
+    self._data_size = 0
+
+  @property
+  def size(self):
+    """Bytes taken on disk."""
+    return self._data_size + self.num_rows * _OFFSET_SIZE
+
+  def close(self):
+    self._data.close()
+    self._index.close()
+
+  def _fetch_batch(self):
+    """Spools the next batch of rows from the server. Lock must be held."""
+    while True:
+      results = db_utils.db_client().fetch(self.handle, start_over=not self._started)
+      if results.ready:
+        break
+      db_utils.query_tracker.wait(self.handle, _DATA_WAIT_TIMEOUT)
+
+    if results.start_row != self.num_rows:
+      # The server cursor was moved by someone else.
+      raise RuntimeError('Detected another client retrieving results for %s. '
+                         'Expected next row to be %s but got %s.' %
+                         (self.handle.id, self.num_rows, results.start_row))
+    self._started = True
+    self.columns = results.columns
+
+    self._data.seek(self._data_size)
+    self._index.seek(self.num_rows * _OFFSET_SIZE)
+    offsets = []
+    for row in results.data:
+      if isinstance(row, unicode):
+        row = row.encode('utf-8')
+      offsets.append(struct.pack(_OFFSET, self._data_size))
+      self._data.write(struct.pack(_LENGTH, len(row)))
+      self._data.write(row)
+      self._data_size += _LENGTH_SIZE + len(row)
+    self._index.write(''.join(offsets))
+    self.num_rows += len(results.data)
+    if not results.has_more:
+      self.complete = True
+
+  def ensure_rows(self, end):
+    """
+    Spools rows until there are at least end of them, or there are no more.
+    Returns whether the spool holds (or could hold) rows past end.
+    """
+    self._lock.acquire()
+    try:
+      if not self._started:
+        self._fetch_batch()
+      while self.num_rows < end and not self.complete:
+        batch_start = self.num_rows
+        self._fetch_batch()
+        if self.num_rows == batch_start:
+          # The server reported more rows but returned none; don't spin.
+          LOG.warn('Empty batch of results for %s at row %s' % (self.handle.id, batch_start))
+          break
+      return self.num_rows > end or not self.complete
+    finally:
+      self._lock.release()
+
+  def fetch_rows(self, start, count, raw=False):
+    """
+    fetch_rows(start, count [,raw]) -> (rows, has_more)
+
+    Returns up to count rows starting at row start, each split into its
+    columns, and whether there are rows after them. If raw is set, rows
+    are returned as is: tab separated utf-8 byte strings.
+    """
+    has_more = self.ensure_rows(start + count)
+    self._lock.acquire()
+    try:
+      end = min(start + count, self.num_rows)
+      if start >= end:
+        return [], has_more
+      self._index.seek(start * _OFFSET_SIZE)
+      offset = struct.unpack(_OFFSET, self._index.read(_OFFSET_SIZE))[0]
+      self._data.seek(offset)
+      read = self._data.read
+      rows = []
+      for i in xrange(end - start):
+        length = struct.unpack(_LENGTH, read(_LENGTH_SIZE))[0]
+        rows.append(read(length))
+      if not raw:
+        # TODO(bc): Hive seems to always return tab delimited row data.
+        # What if a cell has a tab?
+        rows = [ row.decode('utf-8').split('\t') for row in rows ]
+      return rows, has_more
+    finally:
+      self._lock.release()
+
+  def iter_rows(self, start=0, raw=False):
+    """Generates every row from start on, spooling them as needed."""
+    while True:
+      rows, has_more = self.fetch_rows(start, ITER_BATCH_SIZE, raw)
+      for row in rows:
+        yield row
+      start += len(rows)
+      if not has_more:
+        break
+
+
+def _unlinked_tempfile(directory):
+  fd, path = tempfile.mkstemp(prefix='hue-results-', dir=directory)
+  os.unlink(path)
+  return os.fdopen(fd, 'w+b')
+
+
+_spools = None
+_spools_lock = threading.Lock()
+
+
+def _get_spools():
+  global _spools
+  _spools_lock.acquire()
+  try:
+    if _spools is None:
+      max_size = conf.RESULT_CACHE_MAX_SIZE.get()
+      # A spool bigger than the whole cache is still kept while it is the
+      # most recently used; it just pushes everything else out.
+      _spools = LRUCache(max_size, sizeof=lambda spool: min(spool.size, max_size))
+    return _spools
+  finally:
+    _spools_lock.release()
+
+
+def get_spool(query_history):
+  """
+  Returns the ResultSpool of the given QueryHistory, creating it if needed.
+
+  Spools are kept in a least-recently-used cache bounded by their size on
+  disk. Readers still holding an evicted spool keep working from it.
+  """
+  spools = _get_spools()
+  key = query_history.server_id
+  _spools_lock.acquire()
+  try:
+    spool = spools.get(key)
+    if spool is None:
+      handle = QueryHandle(id=query_history.server_id, log_context=query_history.log_context)
+      spool = ResultSpool(handle, conf.RESULT_CACHE_DIR.get() or None)
+      spools.put(key, spool)
+    return spool
+  finally:
+    _spools_lock.release()
+
+
+def fetch_rows(query_history, start, count):
+  """
+  fetch_rows(query_history, start, count) -> (columns, rows, has_more)
+
+  Returns a page of the results of the query, spooling them as needed.
+  """
+  spool = get_spool(query_history)
+  rows, has_more = spool.fetch_rows(start, count)
+  _touch(query_history.server_id, spool)
+  return spool.columns, rows, has_more
+
+
+def _touch(key, spool):
+  """Re-accounts the size of a spool that may have grown."""
+  spools = _get_spools()
+  _spools_lock.acquire()
+  try:
+    if spools.get(key) is spool:
+      spools.put(key, spool)
+  finally:
+    _spools_lock.release()
+
+
+def iter_rows(query_history, raw=False):
+  """
+  iter_rows(query_history [,raw]) -> (columns, row generator)
+
+  Returns the column names and a generator over every row of the results.
+  If raw is set, rows are tab separated utf-8 byte strings.
+  """
+  spool = get_spool(query_history)
+  spool.ensure_rows(0)
+  def gen():
+    for row in spool.iter_rows(raw=raw):
+      yield row
+    _touch(query_history.server_id, spool)
+  return spool.columns, gen()
+
+
+def clear():
+  """Forgets every spool."""
+  _get_spools().clear()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Previews of table data.
+#
+# Showing the first rows of a table used to run "SELECT * FROM table"
+# through the Beeswax server on every visit of the table page.  For plain
+# delimited text tables, the rows are instead read straight from the files
+# under the table location, split with the table's SerDe delimiters, and
+# cached until the table definition changes.
+
+import logging
+import stat as statconsts
+import threading
+
+from beeswax import db_utils
+from desktop.lib.lru_cache import LRUCache
+
+LOG = logging.getLogger(__name__)
+
+PREVIEW_ROWS = 20
+
+# Never read more than this many bytes of table data for one preview
+PREVIEW_MAX_BYTES = 1024 * 1024
+
+# Previews are keyed by the table's transient_lastDdlTime, which Hive bumps
+# whenever it changes the table (including LOAD DATA).  Data written to the
+# table location behind Hive's back, or new partitions, are caught up with
+# once the preview expires.
+PREVIEW_CACHE_SIZE = 500
+PREVIEW_CACHE_TTL = 10 * 60
+
+TEXT_INPUT_FORMATS = ('org.apache.hadoop.mapred.TextInputFormat',)
+TEXT_SERDES = ('org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe',
+               'org.apache.hadoop.hive.serde2.MetadataTypedColumnsetSerDe')
+
+# Files under a table location that hold no data, or not as text
+_HIDDEN_PREFIXES = ('_', '.')
+_COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.deflate', '.lzo', '.snappy')
+
+DEFAULT_FIELD_DELIM = '\x01'
+DEFAULT_LINE_DELIM = '\n'
+NULL_SEQUENCE = '\\N'
+
+
+def _delimiter(value, default):
+  """
+  Hive takes a delimiter given as a number as the byte of that value
+  ('9' is a tab), and otherwise uses its first character.
+  """
+  if not value:
+    return default
+  try:
+    return chr(int(value))
+  except ValueError:
+    return value[0]
+
+
+def get_delimiters(serde_info):
+  """
+  get_delimiters(serde_info) -> (field delimiter, line delimiter)
+
+  As LazySimpleSerDe reads them from the SerDe parameters.
+  """
+  params = serde_info.parameters or {}
+  field_delim = _delimiter(params.get('field.delim'),
+                           _delimiter(params.get('serialization.format'), DEFAULT_FIELD_DELIM))
+  line_delim = _delimiter(params.get('line.delim'), DEFAULT_LINE_DELIM)
+  return field_delim, line_delim
+
+
+def can_preview(table):
+  """Whether the data of the table is delimited text we know how to split."""
+  sd = table.sd
+  if sd.compressed or sd.inputFormat not in TEXT_INPUT_FORMATS:
+    return False
+  return sd.serdeInfo is not None and sd.serdeInfo.serializationLib in TEXT_SERDES
+
+
+def _data_files(fs, path):
+  """The data files directly under path (or path itself), in name order."""
+  file_stat = fs.stats(path)
+  if not statconsts.S_ISDIR(file_stat['mode']):
+    return [ file_stat ]
+  files = []
+  for child in fs.listdir_stats(path):
+    name = fs.basename(child['path'])
+    if statconsts.S_ISDIR(child['mode']) or name[:1] in _HIDDEN_PREFIXES:
+      continue
+    files.append(child)
+  files.sort(key=lambda child: child['path'])
+  return files
+
+
+def read_rows(fs, location, serde_info, num_columns,
+              num_rows=PREVIEW_ROWS, max_bytes=PREVIEW_MAX_BYTES):
+  """
+  Returns up to num_rows rows from the text files at location, each a list
+  of num_columns unicode cells, as "SELECT *" would show them: missing
+  cells and \\N are NULL.
+
+  Returns None if the files look compressed, since only a query can make
+  sense of them.
+  """
+  field_delim, line_delim = get_delimiters(serde_info)
+  path = fs.urlsplit(location)[2]
+  rows = []
+  for file_stat in _data_files(fs, path):
+    if len(rows) >= num_rows or max_bytes <= 0:
+      break
+    for suffix in _COMPRESSED_SUFFIXES:
+      if file_stat['path'].endswith(suffix):
+        return None
+    length = min(file_stat['size'], max_bytes)
+    if not length:
+      continue
+    f = fs.open(file_stat['path'])
+    try:
+      data = f.read(length)
+    finally:
+      f.close()
+    max_bytes -= len(data)
+
+    lines = data.split(line_delim)
+    if len(data) < file_stat['size'] or not lines[-1]:
+      # Either cut short, or the empty string after the last delimiter
+      lines.pop()
+    for line in lines[:num_rows - len(rows)]:
+      cells = line.split(field_delim)[:num_columns]
+      cells += [ NULL_SEQUENCE ] * (num_columns - len(cells))
+      rows.append([ _cell(cell) for cell in cells ])
+  return rows
+
+
+def _cell(cell):
+  if cell == NULL_SEQUENCE:
+    return u'NULL'
+  return cell.decode('utf-8', 'replace')
+
+
+_previews = LRUCache(PREVIEW_CACHE_SIZE, ttl=PREVIEW_CACHE_TTL)
+_previews_lock = threading.Lock()
+
+
+def get_preview(fs, table, num_rows=PREVIEW_ROWS):
+  """
+  Returns the first rows of the table, reading them from HDFS as the user
+  of fs, or None if the table can't be previewed that way, or reading
+  failed (say, the user may not read the table location).
+
+  Partitioned tables are previewed from their first partition.
+  """
+  if not can_preview(table):
+    return None
+
+  ddl_time = (table.parameters or {}).get('transient_lastDdlTime')
+  key = (fs.user, table.dbName, table.tableName)
+  _previews_lock.acquire()
+  try:
+    cached = _previews.get(key)
+  finally:
+    _previews_lock.release()
+  if cached is not None and cached[0] == ddl_time and cached[1] >= num_rows:
+    return cached[2][:num_rows]
+
+  location = table.sd.location
+  if table.partitionKeys:
+    partitions = db_utils.meta_client().get_partitions(table.dbName, table.tableName, 1)
+    if not partitions:
+      return []
+    location = partitions[0].sd.location
+
+  try:
+    rows = read_rows(fs, location, table.sd.serdeInfo, len(table.sd.cols), num_rows)
+  except Exception:
+    LOG.exception("Failed to read the rows of table '%s' from %s" % (table.tableName, location))
+    return None
+  if rows is not None:
+    _previews_lock.acquire()
+    try:
+      _previews.put(key, (ddl_time, num_rows, rows))
+    finally:
+      _previews_lock.release()
+  return rows
+
+
+def clear():
+  """Forgets every preview."""
+  _previews.clear()
@@ -14,12 +14,36 @@
 ## See the License for the specific language governing permissions and
 ## limitations under the License.
 <%namespace name="wrappers" file="header_footer.mako" />
+<%namespace name="comps" file="beeswax_components.mako" />
 <%! from urllib import quote %>
 <%! from filebrowser.views import location_to_url %>
 ${wrappers.head("Beeswax Table Partitions: " + table.tableName, section='tables')}
 
 <h2>Partitions</h2>
 
+<form method="get" action="" class="bw-partition_filters">
+  <table>
+  <tr>
+    <th></th>
+    <th>Starts with</th>
+    <th>From</th>
+    <th>To</th>
+  </tr>
+  % for field in table.partitionKeys:
+  <tr>
+    <td>${field.name}</td>
+    % for op in ('startswith', 'gte', 'lte'):
+      <% param = '%s__%s' % (field.name, op) %>
+      <td><input type="text" name="${param}" value="${filter_params.get(param, '')}"/></td>
+    % endfor
+  </tr>
+  % endfor
+  </table>
+  <input type="submit" value="Filter"/>
+</form>
+
+${comps.pagination(page)}
+
 <table>
 <tr>
   % for field in table.partitionKeys:
@@ -27,8 +51,8 @@ ${wrappers.head("Beeswax Table Partitions: " + table.tableName, section='tables'
   % endfor
   <th></th>## Extra column for command links.
 </tr>
-% if len(partitions) > 0:
-  % for partition in partitions:
+% if len(page.object_list) > 0:
+  % for partition in page.object_list:
   <tr>
     % for key in partition.values:
     <td>${key}</td>
@@ -44,7 +68,11 @@ ${wrappers.head("Beeswax Table Partitions: " + table.tableName, section='tables'
   </tr>
   % endfor
 % else:
+  % if filter_params:
+  <tr><td>No partitions match.</td></tr>
+  % else:
   <tr><td>Table has no partitions.</td></tr>
+  % endif
 % endif
 </table>
 ${wrappers.foot()}
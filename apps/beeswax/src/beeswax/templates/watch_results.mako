@@ -30,6 +30,10 @@ ${wrappers.head("Beeswax: Query Results", section='query')}
               <ul>
                 <li><a target="_blank" href="${download_urls["csv"]}" class="bw-download_csv">Download as CSV</a>
                 <li><a target="_blank" href="${download_urls["xls"]}" class="bw-download_xls">Download as XLS</a>
+                <li><a target="_blank" href="${download_urls["tsv"]}" class="bw-download_tsv">Download as TSV</a>
+                <li><a target="_blank" href="${download_urls["csv_gz"]}" class="bw-download_gz">Download as CSV (gzip)</a>
+                <li><a target="_blank" href="${download_urls["tsv_gz"]}" class="bw-download_gz">Download as TSV (gzip)</a>
+                <li><a target="_blank" href="${download_urls["columnar"]}" class="bw-download_columnar">Download as columnar binary</a>
                 <li data-filters="CollapsingElements"><a class="bw-save collapser jframe_ignore" href="${url('beeswax.views.save_results', query.id)}">Save</a>
                   <div class="collapsible ccs-hidden bw-save_query_results" style="display:none" data-filters="Accordion"> 
                     <form action="${url('beeswax.views.save_results', query.id) }" method="POST">
@@ -111,9 +115,6 @@ ${wrappers.head("Beeswax: Query Results", section='query')}
                   <a href="${ url('beeswax.views.view_results', query.id, 0) }" title="Back to first row" class="bw-firstBlock">[top]</a>
                 % endif
               </div>
-              % if expected_first_row != start_row:
-                <div class="bw-result_warning">Warning:</i> Page offset may have incremented since last view.</div>
-              % endif
               <table data-filters="HtmlTable" cellpadding="0" cellspacing="0">
                 <thead>
                   <tr>
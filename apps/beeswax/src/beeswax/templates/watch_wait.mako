@@ -17,7 +17,7 @@
 <%namespace name="util" file="util.mako" />
 ${wrappers.head("Beeswax: Waiting for query...", section='query')}
 
-<meta http-equiv="refresh" content="3;${url('beeswax.views.watch_query', query.id)}?${fwd_params}" />
+<meta http-equiv="refresh" content="1;${url('beeswax.views.watch_query', query.id)}?${fwd_params}" />
 
 <div class="view partial_refresh" id="watch_wait">
   <div class="resizable" data-filters="SplitView">
@@ -30,6 +30,10 @@ ${wrappers.head("Beeswax: Waiting for query...", section='query')}
           <ul>
             <li><a target="_blank" href="${download_urls["csv"]}" class="bw-download_csv">Download as CSV</a>
             <li><a target="_blank" href="${download_urls["xls"]}" class="bw-download_xls">Download as XLS</a>
+            <li><a target="_blank" href="${download_urls["tsv"]}" class="bw-download_tsv">Download as TSV</a>
+            <li><a target="_blank" href="${download_urls["csv_gz"]}" class="bw-download_gz">Download as CSV (gzip)</a>
+            <li><a target="_blank" href="${download_urls["tsv_gz"]}" class="bw-download_gz">Download as TSV (gzip)</a>
+            <li><a target="_blank" href="${download_urls["columnar"]}" class="bw-download_columnar">Download as columnar binary</a>
           </ul>
         </dd>
         % endif
@@ -64,7 +68,8 @@ ${wrappers.head("Beeswax: Waiting for query...", section='query')}
         <ul class="tab_sections ccs-clear">
           <li>
             <h3 class="ccs-hidden">Server Log</h3>
-            <pre data-partial-id="log">${log}</pre>
+            ## Filled in, and kept up to date, by the QueryLog behavior
+            <pre data-filters="QueryLog" data-log-url="${url('beeswax.views.watch_query_log', query.id)}" data-log-offset="0"></pre>
           </li>
           <li>
             <pre>${query.query}</pre>
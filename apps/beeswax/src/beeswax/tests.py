@@ -24,27 +24,42 @@ import logging
 import os
 import re
 import shutil
+import stat
 import tempfile
+import simplejson
 import threading
-from nose.tools import assert_true, assert_equal, assert_false
+from nose.tools import assert_true, assert_equal, assert_false, assert_raises
 from nose.plugins.skip import SkipTest
+from django.contrib.auth.models import User
 from django.utils.encoding import smart_str
 
 from desktop.lib.django_test_util import make_logged_in_client, assert_equal_mod_whitespace
 from desktop.lib.django_test_util import assert_similar_pages
 from desktop.lib.test_export_csvxls import xls2csv
 
+import beeswax.common
 import beeswax.create_table
+import beeswax.data_export
 import beeswax.db_utils
 import beeswax.forms
 import beeswax.hive_site
+import beeswax.meta_cache
 import beeswax.models
+import beeswax.partition_browser
+import beeswax.query_log
+import beeswax.query_tracker
 import beeswax.report
+import beeswax.result_cache
+import beeswax.table_preview
 import beeswax.views
 from beeswax.views import parse_results, collapse_whitespace
 from beeswax.test_base import make_query, wait_for_query_to_finish, verify_history
 from beeswax.test_base import BeeswaxSampleProvider
 from beeswaxd import BeeswaxService
+from beeswaxd.ttypes import QueryHandle, QueryState, Results
+from hive_metastore.ttypes import FieldSchema, Partition, SerDeInfo, StorageDescriptor, Table
+from hadoop.fs.exceptions import PermissionDeniedException
+from hadoop.fs.hadoopfs import HadoopFileSystem
 
 LOG = logging.getLogger(__name__)
 CSV_LINK_PAT = re.compile('/beeswax/download/\d+/csv')
@@ -109,6 +124,10 @@ class TestBeeswaxWithHadoop(BeeswaxSampleProvider):
     response = self.client.get("/beeswax/table/test_partitions/partitions")
     assert_true("baz_one" in response.content)
     assert_true("boom_two" in response.content)
+    response = self.client.get("/beeswax/table/test_partitions/partitions?baz__startswith=baz_o")
+    assert_true("boom_two" in response.content)
+    response = self.client.get("/beeswax/table/test_partitions/partitions?baz__gte=baz_p")
+    assert_true("No partitions match." in response.content)
     response = self.client.get("/beeswax/table/test/partitions")
     assert_true("is not partitioned." in response.content)
 
@@ -160,6 +179,8 @@ for x in sys.stdin:
     # And have detail
     response = self.client.get("/beeswax/table/test")
     assert_true("foo" in response.content)
+    # Sample rows come straight from HDFS
+    assert_true(len(response.context["top_rows"]) > 0)
 
     # Remember the number of history items. Use a generic fragment 'test' to pass verification.
     history_cnt = verify_history(self.client, fragment='test')
@@ -197,7 +218,7 @@ for x in sys.stdin:
       SELECT * FROM test
     """
     response = _make_query(self.client, QUERY, name='select star', local=False)
-    assert_equal(2, len(response.context["download_urls"]))
+    assert_equal(len(beeswax.common.DL_FORMATS), len(response.context["download_urls"]))
     response = wait_for_query_to_finish(self.client, response)
     assert_equal(str(response.context['query_context'][0]), 'design')
     assert_true("<td>99</td>" in response.content)
@@ -867,6 +888,429 @@ def test_parse_results():
     [ x for x in parse_results(data) ])
 
 
+class FakeFetchClient(object):
+  """Serves canned results the way the Beeswax server does, one batch per fetch."""
+  def __init__(self, rows, batch_size):
+    self.rows = rows
+    self.batch_size = batch_size
+    self.next_row = 0
+    self.fetches = 0
+
+  def get_state(self, handle):
+    return QueryState.FINISHED
+
+  def fetch(self, handle, start_over):
+    self.fetches += 1
+    if self.fetches == 1:
+      return Results(ready=False)
+    if start_over:
+      self.next_row = 0
+    start = self.next_row
+    data = self.rows[start:start + self.batch_size]
+    self.next_row += len(data)
+    return Results(ready=True, columns=[u'a', u'b'], data=data, start_row=start,
+                   has_more=self.next_row < len(self.rows))
+
+
+def test_result_spool():
+  rows = [ u'%d\t\u00e9%d' % (i, i) for i in xrange(25) ]
+  fake = FakeFetchClient(rows, 10)
+  saved = beeswax.db_utils.db_client
+  beeswax.db_utils.db_client = lambda: fake
+  try:
+    spool = beeswax.result_cache.ResultSpool(QueryHandle(id='q', log_context='q'))
+    # Only what is asked for is fetched.
+    assert_equal(([[u'3', u'\u00e93'], [u'4', u'\u00e94']], True), spool.fetch_rows(3, 2))
+    assert_equal([u'a', u'b'], spool.columns)
+    assert_equal(10, spool.num_rows)
+    assert_equal(([[u'21', u'\u00e921']], True), spool.fetch_rows(21, 1))
+    assert_equal(([[u'24', u'\u00e924']], False), spool.fetch_rows(24, 10))
+    assert_true(spool.complete)
+    fetches = fake.fetches
+
+    # Going back and iterating is served from disk.
+    assert_equal(([[u'0', u'\u00e90']], True), spool.fetch_rows(0, 1))
+    assert_equal(([], False), spool.fetch_rows(30, 10))
+    assert_equal([ r.split('\t') for r in rows ], list(spool.iter_rows()))
+    assert_equal(fetches, fake.fetches)
+    spool.close()
+
+    # Someone else moving the server cursor is detected.
+    fake = FakeFetchClient(rows, 10)
+    spool = beeswax.result_cache.ResultSpool(QueryHandle(id='q', log_context='q'))
+    spool.fetch_rows(0, 1)
+    fake.next_row = 20
+    assert_raises(RuntimeError, spool.fetch_rows, 10, 1)
+    spool.close()
+  finally:
+    beeswax.db_utils.db_client = saved
+
+
+def test_data_export_formats():
+  rows = [ u'%d\t\u00e9' % (i,) for i in xrange(3) ]
+  fake = FakeFetchClient(rows, 2)
+  saved = beeswax.db_utils.db_client
+  beeswax.db_utils.db_client = lambda: fake
+  try:
+    query = beeswax.models.QueryHistory(server_id='export_formats', log_context='export_formats')
+    tsv = beeswax.data_export.download(query, 'tsv')
+    assert_equal("attachment; filename=query_result.tsv", tsv['Content-Disposition'])
+    tsv = tsv.content
+    assert_equal('a\tb\n0\t\xc3\xa9\n1\t\xc3\xa9\n2\t\xc3\xa9\n', tsv)
+    tsv_gz = beeswax.data_export.download(query, 'tsv_gz')
+    assert_equal(tsv, gzip.GzipFile(fileobj=cStringIO.StringIO(tsv_gz.content)).read())
+    assert_equal('"a","b"\r\n"0","\xc3\xa9"\r\n"1","\xc3\xa9"\r\n"2","\xc3\xa9"\r\n',
+                 beeswax.data_export.download(query, 'csv').content)
+  finally:
+    beeswax.db_utils.db_client = saved
+    beeswax.result_cache.clear()
+
+
+
+class FakePreviewFs(object):
+  """Serves files from a dict of path to contents, all under one directory."""
+  user = 'test'
+
+  def __init__(self, files):
+    self.files = files
+    self.opened = []
+
+  urlsplit = staticmethod(HadoopFileSystem.urlsplit)
+  basename = staticmethod(HadoopFileSystem.basename)
+
+  def stats(self, path):
+    if path in self.files:
+      return dict(path=path, size=len(self.files[path]), mode=stat.S_IFREG)
+    return dict(path=path, size=0, mode=stat.S_IFDIR)
+
+  def listdir_stats(self, path):
+    return [ self.stats(name) for name in self.files ]
+
+  def open(self, path):
+    self.opened.append(path)
+    return cStringIO.StringIO(self.files[path])
+
+
+def test_table_preview():
+  files = {
+    '/t/part-00001': 'c\x021\n',
+    '/t/part-00000': 'a\x02\\N\nb\n\xc3\xa9\x02x\x02extra\n',
+    '/t/_logs': 'not data',
+  }
+  fs = FakePreviewFs(files)
+  serde = SerDeInfo(serializationLib='org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe',
+                    parameters={ 'serialization.format': '2' })
+  sd = StorageDescriptor(location='hdfs://nn:8020/t', cols=[ FieldSchema('foo'), FieldSchema('bar') ],
+                         inputFormat='org.apache.hadoop.mapred.TextInputFormat',
+                         compressed=False, serdeInfo=serde)
+  table = Table(tableName='t', dbName='default', sd=sd, partitionKeys=[],
+                parameters={ 'transient_lastDdlTime': '1' })
+
+  assert_equal(('\x02', '\n'), beeswax.table_preview.get_delimiters(serde))
+  try:
+    expected = [ [u'a', u'NULL'], [u'b', u'NULL'], [u'\xe9', u'x'], [u'c', u'1'] ]
+    assert_equal(expected, beeswax.table_preview.get_preview(fs, table))
+    assert_equal(['/t/part-00000', '/t/part-00001'], fs.opened)
+
+    # Cached until the table changes
+    assert_equal(expected[:2], beeswax.table_preview.get_preview(fs, table, 2))
+    assert_equal(2, len(fs.opened))
+    table.parameters['transient_lastDdlTime'] = '2'
+    assert_equal(expected[:2], beeswax.table_preview.get_preview(fs, table, 2))
+    assert_equal(['/t/part-00000'], fs.opened[2:])
+
+    # Reads are bounded; the cut short row is dropped
+    assert_equal(expected[:2], beeswax.table_preview.read_rows(fs, sd.location, serde, 2, max_bytes=8))
+
+    # Anything but delimited text needs a query
+    sd.inputFormat = 'org.apache.hadoop.mapred.SequenceFileInputFormat'
+    assert_equal(None, beeswax.table_preview.get_preview(fs, table))
+  finally:
+    beeswax.table_preview.clear()
+
+
+class DeniedPreviewFs(FakePreviewFs):
+  def stats(self, path):
+    raise PermissionDeniedException("Permission denied: user=test, access=READ_EXECUTE")
+
+
+def test_table_preview_fallback():
+  """Tables whose data can't be read from HDFS are previewed with a query."""
+  fs = DeniedPreviewFs({ '/t/part-00000': 'a\n' })
+  serde = SerDeInfo(serializationLib='org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe',
+                    parameters={})
+  sd = StorageDescriptor(location='hdfs://nn:8020/t', cols=[ FieldSchema('foo', 'string') ],
+                         inputFormat='org.apache.hadoop.mapred.TextInputFormat',
+                         compressed=False, serdeInfo=serde)
+  table = Table(tableName='t', dbName='default', sd=sd, partitionKeys=[],
+                parameters={ 'transient_lastDdlTime': '1' })
+
+  class FakeMetaClient(object):
+    def get_table(self, db, name):
+      return table
+
+  class FakeRequest(object):
+    pass
+  request = FakeRequest()
+  request.fs = fs
+
+  rendered = []
+  queried = []
+  def fake_query_top_rows(request, name):
+    queried.append(name)
+    return [ [u'a'] ]
+
+  saved = (beeswax.db_utils.meta_client, beeswax.views._query_top_rows, beeswax.views.render,
+           beeswax.views.location_to_url)
+  beeswax.db_utils.meta_client = lambda: FakeMetaClient()
+  beeswax.views._query_top_rows = fake_query_top_rows
+  beeswax.views.render = lambda template, request, data: rendered.append(data)
+  beeswax.views.location_to_url = lambda request, location: None
+  try:
+    assert_equal(None, beeswax.table_preview.get_preview(fs, table))
+    assert_equal([], fs.opened)
+
+    beeswax.views.describe_table(request, 't')
+    assert_equal(['t'], queried)
+    assert_equal([ [u'a'] ], rendered[0]['top_rows'])
+  finally:
+    (beeswax.db_utils.meta_client, beeswax.views._query_top_rows, beeswax.views.render,
+     beeswax.views.location_to_url) = saved
+    beeswax.table_preview.clear()
+
+
+
+def test_meta_cache():
+  now = [ 0 ]
+  cache = beeswax.meta_cache.MetadataCache(ttl=60, clock=lambda: now[0])
+  fetches = []
+  def fetch(value):
+    def f():
+      fetches.append(value)
+      return value
+    return f
+
+  assert_equal(['a'], cache.get('get_tables', 'default', None, ('.*',), fetch(['a'])))
+  assert_equal(['a'], cache.get('get_tables', 'default', None, ('.*',), fetch(['b'])))
+  assert_equal('t1', cache.get('get_table', 'default', 'T', (), fetch('t1')))
+  assert_equal('t1', cache.get('get_table', 'default', 't', (), fetch('t2')))
+  assert_equal('u1', cache.get('get_table', 'default', 'u', (), fetch('u1')))
+  assert_equal([['a'], 't1', 'u1'], fetches)
+
+  # Invalidating a table also invalidates the table list, but no other table
+  cache.invalidate('default', 't')
+  assert_equal(['c'], cache.get('get_tables', 'default', None, ('.*',), fetch(['c'])))
+  assert_equal('t3', cache.get('get_table', 'default', 't', (), fetch('t3')))
+  assert_equal('u1', cache.get('get_table', 'default', 'u', (), fetch('u2')))
+
+  # The whole database
+  cache.invalidate('default')
+  assert_equal('u3', cache.get('get_table', 'default', 'u', (), fetch('u3')))
+
+  # A fetch racing with an invalidation isn't cached
+  cache.invalidate('default', 'u')
+  def racing():
+    cache.invalidate('default', 'u')
+    return 'u4'
+  assert_equal('u4', cache.get('get_table', 'default', 'u', (), racing))
+  assert_equal('u5', cache.get('get_table', 'default', 'u', (), fetch('u5')))
+
+  # Expiry
+  now[0] = 61
+  assert_equal('u6', cache.get('get_table', 'default', 'u', (), fetch('u6')))
+
+  stats = cache.stats()
+  assert_equal(dict(get_tables=1, get_table=2), stats['hits_by_call'])
+  assert_equal(dict(get_tables=2, get_table=7), stats['misses_by_call'])
+
+  ddl_tables = beeswax.meta_cache.ddl_tables
+  assert_equal([], ddl_tables('SELECT * FROM `create`'))
+  assert_equal([], ddl_tables('INSERT OVERWRITE DIRECTORY "/tmp/x" SELECT * FROM t'))
+  assert_equal(['t'], ddl_tables('DROP TABLE IF EXISTS `t`'))
+  assert_equal(['x'], ddl_tables('create table x as select * from y'))
+  assert_equal(['t', 'u'], ddl_tables('ALTER TABLE t RENAME TO u;\n  load data inpath "/a" into table t'))
+  assert_equal([None], ddl_tables('CREATE FUNCTION f AS "com.example.F"'))
+
+
+def test_meta_cache_stats():
+  c = make_logged_in_client(username="not_admin", is_superuser=False)
+  assert_true("superuser" in c.get("/beeswax/debug/meta_cache").content)
+  c = make_logged_in_client(username="admin", is_superuser=True)
+  stats = simplejson.loads(c.get("/beeswax/debug/meta_cache").content)
+  assert_true('hits_by_call' in stats)
+
+
+
+class FakePartitionsMetaClient(object):
+  def __init__(self, names):
+    self.names = names
+    self.fetched = []
+    self.threads = set()
+
+  def get_partition_names(self, db_name, tbl_name, max_parts):
+    return self.names
+
+  def get_partition(self, db_name, tbl_name, part_vals):
+    self.fetched.append(part_vals)
+    self.threads.add(threading.currentThread().getName())
+    return Partition(values=part_vals, dbName=db_name, tableName=tbl_name)
+
+
+def test_partition_browser():
+  names = [ 'ds=2010-01-0%d/hr=%d' % (day, hour) for day in (2, 1) for hour in (10, 9, 0) ]
+  names.append('ds=2010-01-03/hr=a%2Fb')
+  fake = FakePartitionsMetaClient(names)
+  saved = beeswax.db_utils.meta_client
+  beeswax.db_utils.meta_client = lambda: fake
+  browser = beeswax.partition_browser
+  table = Table(tableName='logs', dbName='default',
+                partitionKeys=[ FieldSchema('ds'), FieldSchema('hr') ])
+  try:
+    assert_equal(['2010-01-03', 'a/b'], browser.parse_partition_name('ds=2010-01-03/hr=a%2Fb'))
+
+    page = browser.get_page(table, [], 1, page_size=4)
+    assert_equal(7, page.total_count())
+    assert_equal([ ['2010-01-01', '0'], ['2010-01-01', '9'], ['2010-01-01', '10'], ['2010-01-02', '0'] ],
+                 [ part.values for part in page.object_list ])
+    # Only the partitions on the page are looked up, in parallel
+    assert_equal(4, len(fake.fetched))
+    assert_equal(set(['thrift call_async']), fake.threads)
+    page = browser.get_page(table, [], 2, page_size=4)
+    assert_equal(3, len(page.object_list))
+
+    filters = browser.parse_filters(table, dict(ds__startswith='2010-01-0', hr__gte='9',
+                                                hr__lte='10', bogus__gte='1', ds__lte=''))
+    page = browser.get_page(table, filters, 1)
+    assert_equal([ ['2010-01-01', '9'], ['2010-01-01', '10'], ['2010-01-02', '9'], ['2010-01-02', '10'] ],
+                 [ part.values for part in page.object_list ])
+
+    # Names are cached until the table changes
+    fake.names = []
+    assert_equal(7, browser.get_page(table, [], 1).total_count())
+    beeswax.meta_cache.get_cache().invalidate('default', 'logs')
+    page = browser.get_page(table, [], 5)
+    assert_equal(0, page.total_count())
+    assert_equal([], page.object_list)
+  finally:
+    beeswax.db_utils.meta_client = saved
+    beeswax.meta_cache.get_cache().clear()
+
+
+def test_query_tracker():
+  states = [ beeswax.models.QueryHistory.STATE.running,
+             beeswax.models.QueryHistory.STATE.running,
+             beeswax.models.QueryHistory.STATE.available ]
+  polls = []
+  def poll(handle):
+    polls.append(handle.id)
+    return states[min(len(polls), len(states)) - 1]
+
+  saved = beeswax.query_tracker.MIN_POLL_INTERVAL
+  beeswax.query_tracker.MIN_POLL_INTERVAL = 0.01
+  try:
+    tracker = beeswax.query_tracker.QueryTracker(poll)
+    handle = QueryHandle(id='q', log_context='q')
+    assert_equal(beeswax.models.QueryHistory.STATE.running, tracker.get_state(handle))
+    thread = tracker._thread
+    assert_true(thread.isAlive())
+    # Waiting does not poll the server by itself.
+    assert_equal(beeswax.models.QueryHistory.STATE.available, tracker.wait(handle, 10))
+    assert_equal(['q', 'q', 'q'], polls)
+    assert_equal(beeswax.models.QueryHistory.STATE.available, tracker.get_state(handle))
+    assert_equal(3, len(polls))
+    # Nothing left to track, so the polling thread goes away.
+    thread.join(10)
+    assert_false(thread.isAlive())
+  finally:
+    beeswax.query_tracker.MIN_POLL_INTERVAL = saved
+
+
+def test_query_log():
+  job_line = "Tracking URL = http://localhost:50030/jobdetails.jsp?jobid=job_201003191517_%04d\n"
+  log = beeswax.query_log.QueryLog()
+  log.update(u"start\n" + job_line % 1 + "Tracking URL = http://localhost:50030/jobdet")
+  assert_equal(["job_201003191517_0001"], log.hadoop_jobs)
+  text, offset = log.read()
+  assert_equal(log.text, text)
+
+  # The cut line is parsed once it is complete.
+  log.update(log.text + "ails.jsp?jobid=job_201003191517_0002\n" + job_line % 1)
+  assert_equal(["job_201003191517_0001", "job_201003191517_0002"], log.hadoop_jobs)
+  assert_equal(("ails.jsp?jobid=job_201003191517_0002\n" + job_line % 1, len(log)), log.read(offset))
+
+  # Lines without a newline yet are parsed when the query is done.
+  log.update(log.text + (job_line % 3).strip(), final=True)
+  assert_equal(3, len(log.hadoop_jobs))
+
+  # A log that is not a continuation starts over.
+  log.update(job_line % 4)
+  assert_equal(["job_201003191517_0004"], log.hadoop_jobs)
+
+  # Only the end of long logs is kept; offsets are still in the whole log.
+  saved = beeswax.query_log.MAX_LOG_SIZE
+  beeswax.query_log.MAX_LOG_SIZE = 10
+  try:
+    log = beeswax.query_log.QueryLog()
+    log.update(u"0123456789abcdef\n")
+    assert_equal(u"789abcdef\n", log.text)
+    assert_equal((u"789abcdef\n", 17), log.read(2))
+    assert_equal((u"ef\n", 17), log.read(14))
+    log.update(u"0123456789abcdef\nghi", final=True)
+    assert_equal((u"abcdef\nghi", 20), log.read())
+    assert_equal(10, len(log))
+  finally:
+    beeswax.query_log.MAX_LOG_SIZE = saved
+
+
+class FakeLogClient(object):
+  def __init__(self, log):
+    self.log = log
+    self.calls = 0
+
+  def get_state(self, handle):
+    return QueryState.RUNNING
+
+  def get_log(self, log_context):
+    self.calls += 1
+    return self.log
+
+
+def test_watch_query_log():
+  client = make_logged_in_client()
+  user = User.objects.get(username='test')
+  query = beeswax.models.QueryHistory.objects.create(owner=user, query='SELECT 1',
+      last_state=beeswax.models.QueryHistory.STATE.running.index,
+      server_id='watch_log', log_context='watch_log')
+  fake = FakeLogClient(u"line 1\n")
+  saved = beeswax.db_utils.db_client
+  beeswax.db_utils.db_client = lambda: fake
+  saved_interval = beeswax.query_log.LOG_REFRESH_INTERVAL
+  try:
+    response = simplejson.loads(client.get('/beeswax/watch/%d/log' % (query.id,)).content)
+    assert_equal(dict(log=u"line 1\n", offset=7, hadoop_jobs=[], finished=False), response)
+    assert_equal(1, fake.calls)
+    # The log was fetched just now
+    fake.log += u"line 2\n"
+    response = simplejson.loads(client.get('/beeswax/watch/%d/log?offset=7' % (query.id,)).content)
+    assert_equal(u"", response['log'])
+    assert_equal(7, response['offset'])
+    assert_equal(1, fake.calls)
+    beeswax.query_log.LOG_REFRESH_INTERVAL = 0
+    response = simplejson.loads(client.get('/beeswax/watch/%d/log?offset=7' % (query.id,)).content)
+    assert_equal(u"line 2\n", response['log'])
+    assert_equal(14, response['offset'])
+    # Bad offsets read from the start
+    response = simplejson.loads(client.get('/beeswax/watch/%d/log?offset=abc' % (query.id,)).content)
+    assert_equal(u"line 1\nline 2\n", response['log'])
+  finally:
+    beeswax.db_utils.db_client = saved
+    beeswax.query_log.LOG_REFRESH_INTERVAL = saved_interval
+    thread = beeswax.db_utils.query_tracker._thread
+    beeswax.db_utils.query_tracker.clear()
+    if thread is not None:
+      thread.join(10)
+
+
 def test_index_page():
   """Minimal test that index page renders."""
   c = make_logged_in_client()
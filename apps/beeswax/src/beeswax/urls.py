@@ -41,9 +41,11 @@ urlpatterns = patterns('beeswax',
   url(r'^report_gen$', 'views.edit_report'),
   url(r'^report_gen/(?P<design_id>\d+)$', 'views.edit_report'),
   url(r'^watch/(?P<id>\d+)$', 'views.watch_query'),
+  url(r'^watch/(?P<id>\d+)/log$', 'views.watch_query_log'),
   url(r'^results/(?P<id>\d+)/(?P<first_row>\d+)$', 'views.view_results'),
   url(r'^download/(?P<id>\d+)/(?P<format>\w+)$', 'views.download'),
   url(r'^configuration$', 'views.configuration'),
+  url(r'^debug/meta_cache$', 'views.meta_cache_stats'),
   url(r'^install_examples$', 'views.install_examples'),
   url(r'^save_results/(?P<id>\d+)$', 'views.save_results'),
   url(r'^query_cb/done/(?P<server_id>\S+)$', 'views.query_done_cb'),
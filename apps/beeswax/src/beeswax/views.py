@@ -29,7 +29,7 @@ from django.utils.encoding import force_unicode
 
 from desktop.lib import django_mako
 from desktop.lib.paginator import Paginator
-from desktop.lib.django_util import copy_query_dict, format_preserving_redirect, render
+from desktop.lib.django_util import copy_query_dict, format_preserving_redirect, render, render_json
 from desktop.lib.django_util import login_notrequired, get_desktop_uri_prefix
 from desktop.lib.django_util import render_injected, PopupWithJframe, PopupException
 
@@ -42,7 +42,13 @@ from beeswaxd.ttypes import QueryHandle, BeeswaxException, QueryNotFoundExceptio
 from beeswax import common
 from beeswax import data_export
 from beeswax import db_utils
+from beeswax import meta_cache
 from beeswax import models
+from beeswax import partition_browser
+from beeswax import query_log
+from beeswax import result_cache
+from beeswax import table_preview
+from beeswax.query_tracker import FINISHED_STATES
 
 from jobsub.parameterization import find_variables, substitute_variables
 
@@ -63,23 +69,30 @@ def show_tables(request):
   examples_installed = beeswax.models.MetaInstall.get().installed_example
   return render("show_tables.mako", request, dict(tables=tables, examples_installed=examples_installed))
 
+def _query_top_rows(request, table):
+  """The first rows of a table that can't be previewed from HDFS, via a query."""
+  hql = "SELECT * FROM `%s`" % (table,)
+  query_msg = make_beeswax_query(request, hql)
+  results = db_utils.execute_and_wait(request.user, query_msg, timeout_sec=5.0)
+  return results and list(parse_results(results.data)) or None
+
 def describe_table(request, table):
   table_obj = db_utils.meta_client().get_table("default", table)
   # Show the first few rows
-  hql = "SELECT * FROM `%s`" % (table,)
-  query_msg = make_beeswax_query(request, hql)
   try:
-    results = db_utils.execute_and_wait(request.user, query_msg, timeout_sec=5.0)
+    top_rows = table_preview.get_preview(request.fs, table_obj)
+    if top_rows is None:
+      top_rows = _query_top_rows(request, table)
   except:
     # Gracefully degrade if we're unable to load the results.
     logging.exception("Failed to read table '%s'" % table)
-    results = None
+    top_rows = None
   hdfs_link = location_to_url(request, table_obj.sd.location)
   load_form = beeswax.forms.LoadDataForm(table_obj)
   return render("describe_table.mako", request, dict(
       table=table_obj,
       table_name=table,
-      top_rows=results and list(parse_results(results.data)) or None,
+      top_rows=top_rows,
       hdfs_link=hdfs_link,
       load_form=load_form
   ))
@@ -403,7 +416,7 @@ def _run_parameterized_query(request, design_id, explain):
 def expand_exception(exc):
   """expand_exception(exc) -> (error msg, log message)"""
   try:
-    log = db_utils.db_client().get_log(exc.log_context)
+    log = query_log.get_query_log(exc.log_context, finished=True).text
   except:
     # Always show something, even if server has died on the job.
     log = "Could not retrieve log."
@@ -634,6 +647,8 @@ def query_done_cb(request, server_id):
 
   # Update the query status
   history.save_state(models.QueryHistory.STATE.available)
+  db_utils.query_tracker.poke(server_id)
+  db_utils.query_done(history)
 
   # Find out details about the query
   if not history.notify:
@@ -656,6 +671,10 @@ def query_done_cb(request, server_id):
   return res
 
 
+# How long (seconds) watch_query waits for the query to finish before
+# rendering the "still running" page, which refreshes itself.
+WATCH_QUERY_WAIT = 2.0
+
 def watch_query(request, id):
   """
   Wait for the query to finish and (by default) displays the results of query id.
@@ -687,8 +706,10 @@ def watch_query(request, id):
 
   # Retrieve models from database to get the server_id
   query_history = models.QueryHistory.objects.get(id=id)
-  server_id, state = _get_server_id_and_state(query_history)
+  server_id, state = _get_server_id_and_state(query_history, WATCH_QUERY_WAIT)
   query_history.save_state(state)
+  if state in FINISHED_STATES:
+    db_utils.query_done(query_history)
 
   # Query finished?
   if state == models.QueryHistory.STATE.expired:
@@ -701,7 +722,7 @@ def watch_query(request, id):
     return format_preserving_redirect(request, results_url, request.GET)
 
   # Still running
-  log = db_utils.db_client().get_log(server_id)
+  running_log = query_log.get_query_log(query_history.log_context)
   download_urls = {}
   for format in common.DL_FORMATS:
     download_urls[format] = urlresolvers.reverse(download, kwargs=dict(id=str(id), format=format))
@@ -713,12 +734,38 @@ def watch_query(request, id):
                       'query': query_history,
                       'fwd_params': request.GET.urlencode(),
                       'download_urls': download_urls,
-                      'log': log,
-                      'hadoop_jobs': _parse_out_hadoop_jobs(log),
+                      'hadoop_jobs': running_log.hadoop_jobs,
                       'query_context': context,
                     })
 
 
+def watch_query_log(request, id):
+  """
+  Returns, as JSON, the part of the log of query id past the ``offset``
+  GET parameter, the offset to ask for next time, the Hadoop jobs the log
+  mentions and whether the query has finished.
+  """
+  id = int(id)
+  try:
+    offset = max(int(request.GET.get('offset', 0)), 0)
+  except ValueError:
+    offset = 0
+  query_history = models.QueryHistory.objects.get(id=id)
+  state = db_utils.get_query_state(query_history)
+  if state is None:
+    raise PopupException("Failed to contact Beeswax Server to check query status")
+  finished = state in FINISHED_STATES
+
+  log_buffer = query_log.get_query_log(query_history.log_context, finished)
+  text, next_offset = log_buffer.read(offset)
+  return render_json({
+    'log': text,
+    'offset': next_offset,
+    'hadoop_jobs': log_buffer.hadoop_jobs,
+    'finished': finished,
+  })
+
+
 def make_query_context(type, info):
   """
   ``type`` is one of "table" and "design", and ``info`` is the table name or design id.
@@ -733,11 +780,12 @@ def make_query_context(type, info):
   return ''                                     # Empty string is safer than None
 
 
-def _get_server_id_and_state(query_history):
+def _get_server_id_and_state(query_history, wait_sec=0):
   """
-  _get_server_id_and_state(query_history) -> (server_id, state_enum)
+  _get_server_id_and_state(query_history [,wait_sec]) -> (server_id, state_enum)
 
   Front-end wrapper to handle exceptions. Expects the query to be submitted.
+  Waits up to wait_sec seconds for the query to finish.
   """
   ok, server_id = query_history.get_server_id()
   if not server_id:
@@ -745,7 +793,7 @@ def _get_server_id_and_state(query_history):
       raise PopupException("Query is still being submitted to the Beeswax Server")
     raise PopupException("Failed to retrieve query state from the Beeswax Server")
 
-  state = db_utils.get_query_state(query_history)
+  state = db_utils.wait_for_query_state(query_history, wait_sec)
   if state is None:
     raise PopupException("Failed to contact Beeswax Server to check query status")
   return (server_id, state)
@@ -767,25 +815,18 @@ def _parse_query_context(context):
   return pair
 
 
-HADOOP_JOBS_RE = re.compile("(http[^\s]*/jobdetails.jsp\?jobid=([a-z0-9_]*))")
 def _parse_out_hadoop_jobs(log):
   """
   Ideally, Hive would tell us what jobs it has run directly
   from the Thrift interface.  For now, we parse the logs
   to look for URLs to those jobs.
   """
-  ret = []
-  for match in HADOOP_JOBS_RE.finditer(log):
-    full_job_url, job_id = match.groups()
-    # We ignore full_job_url for now, but it may
-    # come in handy if we support multiple MR clusters
-    # correctly.
-
-    # Ignore duplicates
-    if job_id in ret:
-      continue
-    ret.append(job_id)
-  return ret
+  return query_log.parse_hadoop_jobs(log)
+
+
+# Number of result rows shown per page
+RESULTS_PAGE_SIZE = 100
+
 
 def view_results(request, id, first_row=0):
   """
@@ -794,29 +835,26 @@ def view_results(request, id, first_row=0):
   The query results MUST be ready.
   To display query results, one should always go through the watch_query view.
 
-  If ``first_row`` is 0, restarts (if necessary) the query read.  Otherwise, just
-  spits out a warning if first_row doesn't match the servers conception.
-  Multiple readers will produce a confusing interaction here, and that's known.
+  Shows RESULTS_PAGE_SIZE rows starting at ``first_row``. Results are read
+  from the local result spool, so any page can be viewed, by any number of
+  readers, without rewinding the query on the Beeswax server.
 
   It understands the ``context`` GET parameter. (See watch_query().)
   """
   # Coerce types; manage arguments
   id = int(id)
-  first_row = long(first_row)
-  start_over = (first_row == 0)
+  first_row = max(long(first_row), 0)
 
   # Retrieve models from database
   query_history = models.QueryHistory.objects.get(id=id)
-  handle = QueryHandle(id=query_history.server_id, log_context=query_history.log_context)
   context = _parse_query_context(request.GET.get('context'))
 
   # Retrieve query results
   try:
-    results = db_utils.db_client().fetch(handle, start_over)
-    assert results.ready, 'Trying to display result that is not yet ready. Query id %s' % (id,)
+    columns, results, has_more = result_cache.fetch_rows(query_history, first_row, RESULTS_PAGE_SIZE)
     # We display the "Download" button only when we know
     # that there are results:
-    downloadable = (first_row > 0 or len(results.data) > 0)
+    downloadable = (first_row > 0 or len(results) > 0)
     fetch_error = False
   except BeeswaxException, ex:
     fetch_error = True
@@ -834,7 +872,7 @@ def view_results(request, id, first_row=0):
       'can_save': False,
     })
 
-  log = db_utils.db_client().get_log(query_history.server_id)
+  final_log = query_log.get_query_log(query_history.log_context, finished=True)
   download_urls = {}
   if downloadable:
     for format in common.DL_FORMATS:
@@ -847,16 +885,14 @@ def view_results(request, id, first_row=0):
   return render('watch_results.mako', request, {
     'error': False,
     'query': query_history,
-    # Materialize, for easier testability.
-    'results': list(parse_results(results.data)),
-    'has_more': results.has_more,
-    'next_row': results.start_row + len(results.data),
-    'start_row': results.start_row,
-    'expected_first_row': first_row,
-    'columns': results.columns,
+    'results': results,
+    'has_more': has_more,
+    'next_row': first_row + len(results),
+    'start_row': first_row,
+    'columns': columns,
     'download_urls': download_urls,
-    'log': log,
-    'hadoop_jobs': _parse_out_hadoop_jobs(log),
+    'log': final_log.text,
+    'hadoop_jobs': final_log.hadoop_jobs,
     'query_context': context,
     'save_form': save_form,
     'can_save': query_history.owner == request.user,
@@ -1066,12 +1102,33 @@ def install_examples(request):
 
 
 def describe_partitions(request, table):
+  """
+  Lists the partitions of a table, a page at a time. It understands the
+  optional GET params:
+
+    page
+      The page number.
+
+    <partition key>__startswith, <partition key>__gte, <partition key>__lte
+      Only show partitions whose value for that key starts with, or is at
+      least or at most (numerically, if both are numbers), the given value.
+  """
   table_obj = db_utils.meta_client().get_table("default", table)
   if len(table_obj.partitionKeys) == 0:
     raise PopupException("Table '%s' is not partitioned." % table)
-  partitions = db_utils.meta_client().get_partitions("default", table, max_parts=-1)
+  filters = partition_browser.parse_filters(table_obj, request.GET)
+  try:
+    pagenum = int(request.GET.get('page', 1))
+  except ValueError:
+    pagenum = 1
+  page = partition_browser.get_page(table_obj, filters, pagenum)
+
+  # We need to pass the filters back to the template to generate links
+  keys_to_copy = [ '%s__%s' % (key.name, op) for key in table_obj.partitionKeys
+                                             for op in partition_browser.FILTER_OPERATORS ]
+  filter_params = copy_query_dict(request.GET, keys_to_copy)
   return render("describe_partitions.mako", request,
-                dict(table=table_obj, partitions=partitions, request=request))
+                dict(table=table_obj, page=page, filter_params=filter_params, request=request))
 
 
 def configuration(request):
@@ -1080,6 +1137,13 @@ def configuration(request):
   return render("configuration.mako", request, dict(config_values=config_values))
 
 
+def meta_cache_stats(request):
+  """Dumps out the hit and miss counts of the metastore metadata cache, as JSON."""
+  if not request.user.is_superuser:
+    raise PopupException("You must be a superuser.")
+  return render_json(meta_cache.get_cache().stats())
+
+
 def my_queries(request):
   """
   View a mix of history and saved queries.
@@ -17,7 +17,7 @@
 ---
 description: Beeswax (the Hive UI)
 provides: [CCS.Beeswax]
-requires: [ccs-shared/CCS.JBrowser, clientcide/TabSwapper, More/Form.Validator.Inline, ccs-shared/DynamicTextarea, ccs-shared/CCS.JFrame.Chooser]
+requires: [ccs-shared/CCS.JBrowser, Core/Request.JSON, clientcide/TabSwapper, More/Form.Validator.Inline, ccs-shared/DynamicTextarea, ccs-shared/CCS.JFrame.Chooser]
 script: CCS.Beeswax.js
 
 ...
@@ -147,6 +147,35 @@ ART.Sheet.define('splitview.bw-editor', {
                                         }
                                 });
                         });
+			this.jframe.addBehaviors({
+				//tails the log of a running query: asks data-log-url for the part of the log
+				//past data-log-offset every second, appends it, and stops once the query is finished
+				'QueryLog': function(element, methods) {
+					var offset = element.get('data', 'log-offset').toInt() || 0;
+					var timer;
+					var poll = function(){
+						request.send({data: {offset: offset}});
+					};
+					var request = new Request.JSON({
+						url: element.get('data', 'log-url'),
+						method: 'get',
+						noCache: true,
+						onSuccess: function(data){
+							if (data.log) element.appendText(data.log);
+							offset = data.offset;
+							if (!data.finished) timer = poll.delay(1000);
+						},
+						onFailure: function(){
+							timer = poll.delay(5000);
+						}
+					});
+					poll();
+					this.markForCleanup(element, function(){
+						$clear(timer);
+						request.cancel();
+					});
+				}
+			});
 			this.jframe.addFilters({
 				visible: function(container){
 					if(!container.get('html').contains('ccs-visible')) return;
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Sorted, filtered and paginated directory listings.
+#
+# Listing a directory with many entries is expensive both for the NameNode
+# and for us, so a listing is fetched once, kept in a compact form for a
+# short while, and every page/sort/filter of it is served from there.
+
+import posixpath
+from array import array
+
+from desktop.lib.lru_cache import LRUCache
+from hadoop.fs import normpath
+
+# How long (seconds) a listing is reused for further pages and sorts
+LISTING_CACHE_TTL = 30
+
+# Upper bound on the total number of directory entries cached
+LISTING_CACHE_SIZE = 200000
+
+# Fields of a listing row
+NAME, PATH, SIZE, MTIME, MODE, USER, GROUP = range(7)
+
+# Sort keys accepted from the user, mapped to row fields
+SORT_FIELDS = {
+  'name': NAME,
+  'size': SIZE,
+  'mtime': MTIME,
+  'user': USER,
+  'group': GROUP,
+}
+DEFAULT_SORT = 'name'
+
+_listing_cache = LRUCache(LISTING_CACHE_SIZE, ttl=LISTING_CACHE_TTL, sizeof=len)
+
+
+class DirListing(object):
+  """
+  The entries of one directory, as tuples rather than stats dictionaries.
+
+  Sort orders are computed on first use and kept as arrays of row indexes,
+  so flipping between sort keys and pages does not re-sort or copy rows.
+  Only the rows of the page asked for are turned back into stats.
+  """
+
+  def __init__(self, stats):
+    rows = []
+    for s in stats:
+      # Names are only used for sorting and filtering; make sure byte
+      # strings compare with unicode ones.
+      name = posixpath.basename(s['path'])
+      if not isinstance(name, unicode):
+        name = unicode(name, 'utf-8', 'replace')
+      rows.append((name, s['path'], s['size'],
+                   s['mtime'], s['mode'], s['user'], s['group']))
+    self.rows = rows
+    self._orders = {}
+
+  def __len__(self):
+    return len(self.rows)
+
+  def _order(self, sortby):
+    order = self._orders.get(sortby)
+    if order is None:
+      field = SORT_FIELDS[sortby]
+      rows = self.rows
+      if field == NAME:
+        keyfunc = lambda i: rows[i][NAME]
+      else:
+        # Break ties by name, so pages are stable.
+        keyfunc = lambda i: (rows[i][field], rows[i][NAME])
+      indexes = range(len(rows))
+      indexes.sort(key=keyfunc)
+      order = self._orders[sortby] = array('l', indexes)
+    return order
+
+  def select(self, sortby=DEFAULT_SORT, descending=False, name_filter=None):
+    """
+    Returns the indexes of the rows matching name_filter (a case-insensitive
+    substring of the entry name), in the requested order.
+    """
+    order = self._order(sortby)
+    if descending:
+      order = order[::-1]
+    if name_filter:
+      needle = name_filter.lower()
+      rows = self.rows
+      order = [ i for i in order if needle in rows[i][NAME].lower() ]
+    return order
+
+  def page(self, sortby=DEFAULT_SORT, descending=False, name_filter=None,
+           offset=0, count=None):
+    """
+    Returns (total, stats), where total is the number of matching entries
+    and stats holds up to count of them, starting at offset.
+    """
+    indexes = self.select(sortby, descending, name_filter)
+    if count is None:
+      selected = indexes[offset:]
+    else:
+      selected = indexes[offset:offset + count]
+    return len(indexes), [ self.to_stats(self.rows[i]) for i in selected ]
+
+  @staticmethod
+  def to_stats(row):
+    return {
+      'path': row[PATH],
+      'size': row[SIZE],
+      'mtime': row[MTIME],
+      'mode': row[MODE],
+      'user': row[USER],
+      'group': row[GROUP],
+    }
+
+
+def _cache_key(fs, username, path):
+  return (id(fs), username, normpath(path))
+
+
+def get_listing(fs, username, path, refresh=False):
+  """
+  Returns the DirListing of path, as seen by username.
+
+  A recently fetched listing is reused unless refresh is set.
+  """
+  key = _cache_key(fs, username, path)
+  if not refresh:
+    listing = _listing_cache.get(key)
+    if listing is not None:
+      return listing
+  listing = DirListing(fs.listdir_stats(path))
+  _listing_cache.put(key, listing)
+  return listing
+
+
+def invalidate_listings(*paths):
+  """
+  Forgets the cached listings of the given paths and of their parents,
+  for every user.
+  """
+  dirs = set()
+  for path in paths:
+    if path:
+      path = normpath(path)
+      dirs.add(path)
+      dirs.add(posixpath.dirname(path))
+  _listing_cache.remove_if(lambda key: key[2] in dirs)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal
+
+from filebrowser.lib import listing
+
+
+class FakeFs(object):
+  def __init__(self, stats):
+    self.stats = stats
+    self.calls = 0
+
+  def listdir_stats(self, path):
+    self.calls += 1
+    return [ dict(s, path=path + '/' + s['path']) for s in self.stats ]
+
+
+def _stat(name, size, mtime, user='hue'):
+  return dict(path=name, size=size, mtime=mtime, mode=0100644, user=user, group='supergroup')
+
+
+def _names(stats):
+  return [ s['path'].rsplit('/', 1)[1] for s in stats ]
+
+
+def test_sort_filter_and_page():
+  dir_listing = listing.DirListing(FakeFs([
+      _stat('c', 10, 3), _stat('a', 30, 2), _stat('B', 20, 1), _stat('ab', 20, 4)
+    ]).listdir_stats('/d'))
+
+  assert_equal(['B', 'a', 'ab', 'c'], _names(dir_listing.page()[1]))
+  assert_equal(['c', 'B', 'ab', 'a'], _names(dir_listing.page('size')[1]))
+  assert_equal(['ab', 'c', 'a', 'B'], _names(dir_listing.page('mtime', descending=True)[1]))
+
+  total, stats = dir_listing.page(name_filter='A')
+  assert_equal(2, total)
+  assert_equal(['a', 'ab'], _names(stats))
+
+  total, stats = dir_listing.page('size', offset=1, count=2)
+  assert_equal(4, total)
+  assert_equal(['B', 'ab'], _names(stats))
+  assert_equal(dict(path='/d/B', size=20, mtime=1, mode=0100644, user='hue', group='supergroup'),
+               stats[0])
+
+
+def test_listing_cache():
+  fs = FakeFs([ _stat('a', 1, 1) ])
+  listing.get_listing(fs, 'test', '/d', refresh=True)
+  listing.get_listing(fs, 'test', '/d/')
+  assert_equal(1, fs.calls)
+
+  # Different users may see different things.
+  listing.get_listing(fs, 'other', '/d')
+  assert_equal(2, fs.calls)
+
+  listing.get_listing(fs, 'test', '/d', refresh=True)
+  assert_equal(3, fs.calls)
+
+  # Changing an entry forgets the listing of its directory.
+  listing.invalidate_listings('/d/a')
+  listing.get_listing(fs, 'test', '/d')
+  listing.get_listing(fs, 'other', '/d')
+  assert_equal(5, fs.calls)
@@ -23,6 +23,13 @@ ${comps.header(path, current_request_path, cwd_set=cwd_set, show_upload=show_upl
 
   <div id="dirlist" class="view">
     <h1 class="ccs-hidden">${path|escape}</h1>
-    ${dir.list_table_browser(files, path_enc, current_request_path, cwd_set)}
+    <form class="fb-filter-form" data-filters="SubmitOnChange" method="get" action="">
+      <input type="hidden" name="sortby" value="${sortby}"/>
+      <input type="hidden" name="descending" value="${descending and 'true' or 'false'}"/>
+      <input type="hidden" name="file_filter" value="${file_filter}"/>
+      <input type="text" name="filter" value="${filter}" class="fb-filter" title="Show only names containing"/>
+    </form>
+    ${dir.list_table_browser(files, path_enc, current_request_path, cwd_set, page, sortby, descending, filter_params)}
+    ${dir.pagination(page, sortby, descending, filter_params)}
   </div>
 ${comps.footer()}
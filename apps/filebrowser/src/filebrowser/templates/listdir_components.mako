@@ -23,13 +23,27 @@ from desktop.lib.django_util import reverse_with_get
 <%def name="list_table_chooser(files, path, current_request_path)">
   ${_table(files, path, current_request_path, 'chooser')}
 </%def>
-<%def name="list_table_browser(files, path, current_request_path, cwd_set=True)">
-  ${_table(files, path, current_request_path, 'view', cwd_set)}
+<%def name="list_table_browser(files, path, current_request_path, cwd_set=True, page=None, sortby=None, descending=False, filter_params='')">
+  ${_table(files, path, current_request_path, 'view', cwd_set, page, sortby, descending, filter_params)}
 </%def>
-<%def name="_table(files, path, current_request_path, view, cwd_set=False)">
+<%def name="_sort_header(label, key, sortby, descending, filter_params, colspan=1)">
   <%
+    # Clicking the current sort key flips the order.
+    flip = (key == sortby and not descending) and 'true' or 'false'
+    if key == sortby:
+      cls = descending and 'fb-sorted-desc' or 'fb-sorted-asc'
+    else:
+      cls = ''
+  %>
+  <th colspan="${colspan}"><a class="fb-sort ${cls}" href="?sortby=${key}&descending=${flip}&${filter_params}">${label}</a></th>
+</%def>
+<%def name="_table(files, path, current_request_path, view, cwd_set=False, page=None, sortby=None, descending=False, filter_params='')">
+  <%
+  # Listings split over several pages are sorted by the server, for all
+  # pages at once.
+  server_sorted = page is not None and page.num_pages() > 1
   # Sortable takes a while for big lists; skip it in that case.
-  if len(files) < 100:
+  if len(files) < 100 and not server_sorted:
     optional_sortable = "sortable"
   else:
     optional_sortable = ""
@@ -43,16 +57,25 @@ from desktop.lib.django_util import reverse_with_get
   <table data-filters="HtmlTable" class="fb-file-list selectable ${optional_sortable}" cellpadding="0" cellspacing="0">
     <thead>
       <tr>
-        % if cwd_set:
-          <th>Name</th>
+        % if server_sorted:
+          ${_sort_header(cwd_set and 'Name' or 'Path', 'name', sortby, descending, filter_params)}
+          ${_sort_header('Size', 'size', sortby, descending, filter_params)}
+          ${_sort_header('User', 'user', sortby, descending, filter_params)}
+          ${_sort_header('Group', 'group', sortby, descending, filter_params)}
+          <th>Permissions</th>
+          ${_sort_header('Date', 'mtime', sortby, descending, filter_params, colspan=2)}
         % else:
-          <th>Path</th>
+          % if cwd_set:
+            <th>Name</th>
+          % else:
+            <th>Path</th>
+          % endif
+          <th>Size</th>
+          <th>User</th>
+          <th>Group</th>
+          <th>Permissions</th>
+          <th colspan="2">Date</th>
         % endif
-        <th>Size</th>
-        <th>User</th>
-        <th>Group</th>
-        <th>Permissions</th>
-        <th colspan="2">Date</th>
       </tr>
     </thead>
     <tbody>
@@ -135,3 +158,23 @@ from desktop.lib.django_util import reverse_with_get
     </tbody>
   </table>
 </%def>
+<%def name="pagination(page, sortby, descending, filter_params)">
+  <%
+    def pageref(num):
+      return "?pagenum=%d&sortby=%s&descending=%s&%s" % (num, sortby, descending and 'true' or 'false', filter_params)
+  %>
+  % if page.num_pages() > 1:
+    <div class="fb-pagination">
+      <div class="fb-pagination-count ccs-inline">
+        Showing ${page.start_index()} to ${page.end_index()} of ${page.total_count()} items
+      </div>
+      <div class="fb-pagination-controls ccs-inline">
+        <a title="First Page" class="fb-page-first" href="${pageref(1)}">First</a>
+        <a title="Previous Page" class="fb-page-previous" href="${pageref(page.previous_page_number())}">Previous</a>
+        <span class="fb-page">page ${page.number} of ${page.num_pages()}</span>
+        <a title="Next Page" class="fb-page-next" href="${pageref(page.next_page_number())}">Next</a>
+        <a title="Last Page" class="fb-page-last" href="${pageref(page.num_pages())}">Last</a>
+      </div>
+    </div>
+  % endif
+</%def>
@@ -39,9 +39,11 @@ from gzip import GzipFile
 
 from desktop.lib import i18n
 from desktop.lib.django_util import make_absolute, render_json
-from desktop.lib.django_util import PopupException, format_preserving_redirect
+from desktop.lib.django_util import PopupException, format_preserving_redirect, copy_query_dict
+from desktop.lib.paginator import Paginator
 from filebrowser.lib.rwx import filetype, rwx
 from filebrowser.lib import xxd
+from filebrowser.lib import listing
 from filebrowser.forms import RenameForm, UploadForm, MkDirForm, RmDirForm, RmTreeForm, \
     RemoveForm, ChmodForm, ChownForm, EditorForm
 from hadoop.fs import normpath
@@ -60,6 +62,13 @@ BYTES_PER_SENTENCE = 2
 # The maximum size the file editor will allow you to edit
 MAX_FILEEDITOR_SIZE = 256*1024
 
+# Entries shown per page of a directory listing
+DEFAULT_LISTDIR_PAGESIZE = 100
+MAX_LISTDIR_PAGESIZE = 1000
+
+# Request parameters that page through an already fetched listing
+LISTDIR_PAGING_PARAMS = ('pagenum', 'pagesize', 'sortby', 'descending', 'filter')
+
 logger = logging.getLogger(__name__)
 
 def _unquote_path(path):
@@ -68,6 +77,13 @@ def _unquote_path(path):
 
 def _file_reader(fh):
   """Generator that reads a file, chunk-by-chunk."""
+  if hasattr(fh, 'read_ahead'):
+    # HDFS files can fetch several chunks from the datanodes in parallel.
+    for chunk in fh.read_ahead():
+      yield chunk
+    fh.close()
+    return
+
   while True:
     chunk = fh.read(DOWNLOAD_CHUNK_SIZE)
     if chunk == '':
@@ -192,6 +208,7 @@ def save_file(request):
     _do_newfile_save(request.fs, path,
                      form.cleaned_data['contents'],
                      form.cleaned_data['encoding'])
+  listing.invalidate_listings(path)
 
   request.flash.put('Saved %s.' % os.path.basename(path))
   """ Changing path to reflect the request path of the JFrame that will actually be returned."""
@@ -295,7 +312,27 @@ def listdir(request, path):
     'show_upload': (request.REQUEST.get('show_upload') == 'false' and (False,) or (True,))[0]
   }
 
-  stats = request.fs.listdir_stats(path)
+  try:
+    pagenum = max(int(request.REQUEST.get('pagenum', 1)), 1)
+    pagesize = int(request.REQUEST.get('pagesize', DEFAULT_LISTDIR_PAGESIZE))
+  except ValueError:
+    raise PopupException("Bad page number or page size")
+  pagesize = min(max(pagesize, 1), MAX_LISTDIR_PAGESIZE)
+  sortby = request.REQUEST.get('sortby', listing.DEFAULT_SORT)
+  if sortby not in listing.SORT_FIELDS:
+    logger.warn('Bad parameter to listdir: sortby=%s' % (sortby,))
+    sortby = listing.DEFAULT_SORT
+  descending = request.REQUEST.get('descending') == 'true'
+  name_filter = request.REQUEST.get('filter', '')
+
+  # A plain visit fetches a fresh listing; paging, sorting and filtering
+  # requests reuse the one fetched by the visit.
+  refresh = not [ p for p in LISTDIR_PAGING_PARAMS if p in request.REQUEST ]
+  dir_listing = listing.get_listing(request.fs, request.user.username, path, refresh)
+  total, stats = dir_listing.page(sortby, descending, name_filter,
+                                  offset=pagesize * (pagenum - 1), count=pagesize)
+  paginator = Paginator(stats, pagesize, total=total)
+  page = paginator.page(pagenum)
 
   # Include parent dir, unless at filesystem root.
   if normpath(path) != posixpath.sep:
@@ -305,7 +342,16 @@ def listdir(request, path):
     parent_stat['path'] = posixpath.join(path, "..")
     stats.insert(0, parent_stat)
 
+  # Only the visible page is massaged and rendered.
   data['files'] = [_massage_stats(request, stat) for stat in stats]
+  data['page'] = page
+  data['pagesize'] = pagesize
+  data['sortby'] = sortby
+  data['descending'] = descending
+  data['filter'] = name_filter
+  # We need to pass the parameters back to the template to generate links
+  data['filter_params'] = copy_query_dict(
+        request.GET, ('file_filter', 'pagesize', 'filter')).urlencode()
   return render_with_toolbars('listdir.mako', request, data)
 
 def chooser(request, path):
@@ -537,6 +583,8 @@ def generic_op(form_class, request, op, parameter_names, piggyback=None, templat
     if form.is_valid():
       args = [ form.cleaned_data[p] for p in parameter_names ]
       op(*args)
+      listing.invalidate_listings(*[ form.cleaned_data[p] for p in parameter_names
+                                     if p.endswith('path') ])
       if next:
         logging.debug("Next: %s" % next)
         # Doesn't need to be quoted: quoting is done by HttpResponseRedirect.
@@ -646,12 +694,18 @@ def upload(request):
       if request.fs.isdir(dest):
         assert posixpath.sep not in file.name
         dest = posixpath.join(dest, file.name)
-      output = request.fs.open(dest, "w")
+      try:
+        output = request.fs.open(dest, "w")
+      except IOError, e:
+        if e.errno == errno.EAGAIN:
+          raise PopupException(e.strerror)
+        raise
       try:
         for chunk in file.chunks():
           output.write(chunk)
       finally:
         output.close()
+      listing.invalidate_listings(dest)
 
       dest_stats = request.fs.stats(dest)
       return render_with_toolbars('upload_done.mako', request, {
@@ -106,6 +106,49 @@ def test_listdir():
     cluster.shutdown()
 
 
+@attr('requires_hadoop')
+def test_listdir_paging():
+  cluster = mini_cluster.shared_cluster(conf=True)
+  try:
+    c = make_logged_in_client()
+    cluster.fs.setuser(cluster.superuser)
+
+    prefix = '/test-filebrowser-paging'
+    for i in range(5):
+      f = cluster.fs.open('%s/file-%d' % (prefix, i), 'w')
+      f.write('x' * i)
+      f.close()
+
+    def names(response):
+      return [ f['name'] for f in response.context['files'] ]
+
+    response = c.get('/filebrowser/view' + prefix, dict(pagesize=2))
+    # The parent directory is shown on every page.
+    assert_equal(['..', 'file-0', 'file-1'], names(response))
+    assert_equal(3, response.context['page'].num_pages())
+    assert_equal(5, response.context['page'].total_count())
+
+    response = c.get('/filebrowser/view' + prefix,
+                     dict(pagesize=2, pagenum=2, sortby='size', descending='true'))
+    assert_equal(['..', 'file-2', 'file-1'], names(response))
+
+    response = c.get('/filebrowser/view' + prefix, dict(filter='-4'))
+    assert_equal(['..', 'file-4'], names(response))
+
+    # Further pages come from the listing fetched by the first one, but
+    # changing the directory through the file browser drops it.
+    c.post('/filebrowser/remove', dict(path=prefix + '/file-4'))
+    response = c.get('/filebrowser/view' + prefix, dict(pagesize=2, pagenum=2))
+    assert_equal(['..', 'file-2', 'file-3'], names(response))
+    assert_equal(4, response.context['page'].total_count())
+  finally:
+    try:
+      cluster.fs.rmtree(prefix)
+    except:
+      pass      # Don't let cleanup errors mask earlier failures
+    cluster.shutdown()
+
+
 @attr('requires_hadoop')
 def test_view_gz():
   cluster = mini_cluster.shared_cluster(conf=True)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A store of job configurations.
+#
+# The configuration of a job is fixed when the job is submitted, but was
+# fetched as XML from the JobTracker and parsed again for every job page.
+# It is now parsed once into sorted keys and values, with the strings that
+# most jobs share (keys, and default values) stored once, and kept in an
+# LRU.  The kept configurations can be searched by the value of a key.
+
+import bisect
+import threading
+
+from desktop.lib.lru_cache import LRUCache
+from desktop.lib.thrift_util import call_async
+from hadoop import confparse
+from hadoop.api.common.ttypes import IOException
+
+# Number of job configurations kept
+CONF_STORE_SIZE = 2000
+
+# At most this many configurations are fetched at once by load_many()
+MAX_PARALLEL_FETCHES = 8
+
+# Shared strings are forgotten once there are this many of them
+MAX_SHARED_STRINGS = 200000
+
+# The comparisons that find() supports
+OPERATORS = ('eq', 'gt', 'gte', 'lt', 'lte')
+
+
+class JobConf(object):
+  """
+  The configuration of a job: its keys, sorted, and their values, as
+  tuples. Reads like a (read-only) dict.
+  """
+  __slots__ = ('_keys', '_values')
+
+  def __init__(self, items):
+    items.sort()
+    self._keys = tuple([ key for key, value in items ])
+    self._values = tuple([ value for key, value in items ])
+
+  def __len__(self):
+    return len(self._keys)
+
+  def _position(self, key):
+    pos = bisect.bisect_left(self._keys, key)
+    if pos < len(self._keys) and self._keys[pos] == key:
+      return pos
+    return None
+
+  def __contains__(self, key):
+    return self._position(key) is not None
+
+  def __getitem__(self, key):
+    pos = self._position(key)
+    if pos is None:
+      raise KeyError(key)
+    return self._values[pos]
+
+  def get(self, key, default=None):
+    pos = self._position(key)
+    if pos is None:
+      return default
+    return self._values[pos]
+
+  def keys(self):
+    return list(self._keys)
+
+  def items(self):
+    """The (key, value) pairs, sorted by key."""
+    return zip(self._keys, self._values)
+
+  def iteritems(self):
+    return iter(self.items())
+
+
+def _sort_key(value):
+  """Numbers sort (numerically) before other values."""
+  try:
+    number = float(value)
+  except (TypeError, ValueError):
+    return (1, value)
+  if number != number:
+    # NaN doesn't compare
+    return (1, value)
+  return (0, number)
+
+
+class ConfStore(object):
+  """
+  Job configurations, fetched as needed and kept, and an index of the
+  values of each key searched for among the kept ones.
+  """
+  def __init__(self, max_size=CONF_STORE_SIZE):
+    self._confs = LRUCache(max_size)
+    self._lock = threading.Lock()
+    self._strings = {}
+    # Bumped whenever a configuration is added, which may evict another
+    self._generation = 0
+    # key -> (generation, sort keys of the values, job keys), by sort key
+    self._indexes = {}
+
+  def _share(self, value):
+    """Lock must be held."""
+    if len(self._strings) >= MAX_SHARED_STRINGS:
+      self._strings.clear()
+    return self._strings.setdefault(value, value)
+
+  def parse(self, xml_data):
+    """Returns the JobConf of the job.xml contents."""
+    conf = confparse.ConfParse(xml_data)
+    self._lock.acquire()
+    try:
+      items = [ (self._share(key), self._share(value)) for key, value in conf.iteritems() ]
+    finally:
+      self._lock.release()
+    return JobConf(items)
+
+  def _put(self, key, jobconf):
+    self._confs.put(key, jobconf)
+    self._lock.acquire()
+    try:
+      self._generation += 1
+    finally:
+      self._lock.release()
+
+  def get(self, jt, job_id):
+    """The JobConf of the job. Raises if the JobTracker can't find it."""
+    key = (jt.host, jt.thrift_port, job_id)
+    jobconf = self._confs.get(key)
+    if jobconf is None:
+      jobconf = self.parse(jt.get_job_xml(jt.thriftjobid_from_string(job_id)))
+      self._put(key, jobconf)
+    return jobconf
+
+  def load_many(self, jt, job_ids):
+    """
+    Makes sure the configurations of the jobs are kept, fetching those that
+    aren't a few at a time, in parallel. Jobs whose configuration can't be
+    found are skipped.
+    """
+    missing = [ job_id for job_id in job_ids
+                if (jt.host, jt.thrift_port, job_id) not in self._confs ]
+    ctx = jt.thread_local.request_context
+    for start in range(0, len(missing), MAX_PARALLEL_FETCHES):
+      batch = missing[start:start + MAX_PARALLEL_FETCHES]
+      futures = [ call_async(jt.client.getJobConfXML, ctx, jt.thriftjobid_from_string(job_id))
+                  for job_id in batch ]
+      for job_id, future in zip(batch, futures):
+        try:
+          xml_data = future.result()
+        except IOException:
+          continue
+        self._put((jt.host, jt.thrift_port, job_id), self.parse(xml_data))
+
+  def _index(self, conf_key):
+    """The index of the values of conf_key in the kept configurations."""
+    self._lock.acquire()
+    try:
+      generation = self._generation
+      index = self._indexes.get(conf_key)
+    finally:
+      self._lock.release()
+    if index is not None and index[0] == generation:
+      return index[1], index[2]
+
+    entries = []
+    for key in self._confs.keys():
+      jobconf = self._confs.get(key)
+      if jobconf is None:
+        continue
+      value = jobconf.get(conf_key)
+      if value is not None:
+        entries.append((_sort_key(value), key))
+    entries.sort()
+    sort_keys = [ sort_key for sort_key, key in entries ]
+    job_keys = [ key for sort_key, key in entries ]
+    self._lock.acquire()
+    try:
+      self._indexes[conf_key] = (generation, sort_keys, job_keys)
+    finally:
+      self._lock.release()
+    return sort_keys, job_keys
+
+  def find(self, jt, conf_key, op, value):
+    """
+    Returns the ids of the jobs of the JobTracker, among those whose
+    configuration is kept, where conf_key compares to value as op says
+    ('gt' means "greater than value"). Numbers compare as numbers.
+    """
+    assert op in OPERATORS
+    sort_keys, job_keys = self._index(conf_key)
+    bound = _sort_key(value)
+    # Only compare values of the same kind (numbers, or other strings)
+    kind_start = bisect.bisect_left(sort_keys, (bound[0],))
+    kind_end = bisect.bisect_left(sort_keys, (bound[0] + 1,))
+    if op == 'eq':
+      lo, hi = bisect.bisect_left(sort_keys, bound), bisect.bisect_right(sort_keys, bound)
+    elif op == 'gt':
+      lo, hi = bisect.bisect_right(sort_keys, bound), kind_end
+    elif op == 'gte':
+      lo, hi = bisect.bisect_left(sort_keys, bound), kind_end
+    elif op == 'lt':
+      lo, hi = kind_start, bisect.bisect_left(sort_keys, bound)
+    else:
+      lo, hi = kind_start, bisect.bisect_right(sort_keys, bound)
+    return [ key[2] for key in job_keys[lo:hi] if key[:2] == (jt.host, jt.thrift_port) ]
+
+  def clear(self):
+    self._confs.clear()
+    self._lock.acquire()
+    try:
+      self._strings.clear()
+      self._indexes.clear()
+      self._generation += 1
+    finally:
+      self._lock.release()
+
+
+_store = ConfStore()
+
+
+def get_store():
+  """Returns the shared ConfStore."""
+  return _store
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A store of job counters.
+#
+# The counters of a job are fetched from the JobTracker as three lists of
+# counter groups (map, reduce and job totals), every counter carrying its
+# names.  The names are numbered once, in a catalog shared by all jobs, and
+# each job keeps its values in arrays indexed by those numbers.  Counters
+# of finished jobs never change, so they are kept until evicted; which also
+# makes comparing one counter across many runs cheap.
+
+import array
+import bisect
+import threading
+
+from desktop.lib.lru_cache import LRUCache
+from desktop.lib.thrift_util import call_async
+from hadoop.api.jobtracker.ttypes import JobNotFoundException, ThriftCounter, \
+    ThriftCounterGroup, ThriftGroupList
+
+# Number of finished jobs (or task attempts) whose counters are kept
+COUNTER_STORE_SIZE = 5000
+
+# At most this many counter fetches are in flight for one comparison
+MAX_PARALLEL_FETCHES = 8
+
+# The kinds of values a counter has. 'total' is the job-level value.
+KINDS = ('map', 'reduce', 'total')
+
+
+class CounterCatalog(object):
+  """
+  Numbers (group name, counter name) pairs, and holds their display names.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._ids = {}
+    # id -> (group name, group display name, counter name, counter display name)
+    self.names = []
+
+  def id(self, group, counter):
+    """The id of the counter of the group (Thrift structs), numbering it if new."""
+    key = (group.name, counter.name)
+    self._lock.acquire()
+    try:
+      cid = self._ids.get(key)
+      if cid is None:
+        cid = len(self.names)
+        self._ids[key] = cid
+        self.names.append((group.name, group.displayName, counter.name, counter.displayName))
+      return cid
+    finally:
+      self._lock.release()
+
+  def lookup(self, group_name, counter_name):
+    """The id of the counter, or None if no job had it."""
+    return self._ids.get((group_name, counter_name))
+
+
+class JobCounters(object):
+  """
+  The counters of a job: the ids of its counters, sorted, and for each of
+  them its map, reduce and total values, and a bitmask of those present.
+  Doubles hold counter values exactly up to 2**53.
+  """
+  __slots__ = ('ids', 'values', 'present')
+
+  def __init__(self, catalog, group_lists):
+    """group_lists are ThriftGroupLists, in the order of KINDS (or None)."""
+    entries = {}
+    for kind in range(len(group_lists)):
+      if group_lists[kind] is None:
+        continue
+      for group in group_lists[kind].groups:
+        for counter in group.counters.itervalues():
+          entry = entries.setdefault(catalog.id(group, counter), [0, 0, 0, 0])
+          entry[kind] = counter.value
+          entry[3] |= 1 << kind
+    ids = entries.keys()
+    ids.sort()
+    self.ids = array.array('i', ids)
+    self.values = array.array('d')
+    self.present = array.array('B')
+    for cid in ids:
+      entry = entries[cid]
+      self.values.extend(entry[:3])
+      self.present.append(entry[3])
+
+  @staticmethod
+  def from_rollups(catalog, rollups):
+    """From a ThriftJobCounterRollups."""
+    return JobCounters(catalog, (rollups.mapCounters, rollups.reduceCounters, rollups.jobCounters))
+
+  def _values(self, pos):
+    res = {}
+    for kind in range(len(KINDS)):
+      if self.present[pos] & (1 << kind):
+        res[KINDS[kind]] = long(self.values[3 * pos + kind])
+    return res
+
+  def get(self, cid):
+    """The values of the counter by kind, or None if the job doesn't have it."""
+    pos = bisect.bisect_left(self.ids, cid)
+    if pos == len(self.ids) or self.ids[pos] != cid:
+      return None
+    return self._values(pos)
+
+  def to_dict(self, catalog):
+    """
+    As Job.counters has them:
+      { group name: { 'name', 'displayName',
+                      'counters': { counter name: { 'name', 'displayName',
+                                                    'map', 'reduce', 'total' } } } }
+    with only the kinds of values the counter has.
+    """
+    res = {}
+    for pos in range(len(self.ids)):
+      group_name, group_display, name, display = catalog.names[self.ids[pos]]
+      group = res.get(group_name)
+      if group is None:
+        group = res[group_name] = { 'name': group_name, 'displayName': group_display, 'counters': {} }
+      counter = self._values(pos)
+      counter['name'] = name
+      counter['displayName'] = display
+      group['counters'][name] = counter
+    return res
+
+  def to_group_list(self, catalog, kind='total'):
+    """The values of one kind as a ThriftGroupList, like task attempts have them."""
+    index = list(KINDS).index(kind)
+    groups = {}
+    for pos in range(len(self.ids)):
+      if not self.present[pos] & (1 << index):
+        continue
+      group_name, group_display, name, display = catalog.names[self.ids[pos]]
+      group = groups.get(group_name)
+      if group is None:
+        group = groups[group_name] = ThriftCounterGroup(name=group_name, displayName=group_display,
+                                                        counters={})
+      group.counters[name] = ThriftCounter(name=name, displayName=display,
+                                           value=long(self.values[3 * pos + index]))
+    return ThriftGroupList(groups=groups.values())
+
+
+class CounterStore(object):
+  """
+  The counters of jobs and task attempts, fetched as needed. Those of
+  finished jobs and attempts are kept.
+  """
+  def __init__(self, max_size=COUNTER_STORE_SIZE):
+    self.catalog = CounterCatalog()
+    self._finished = LRUCache(max_size)
+
+  def _key(self, jt, id):
+    return (jt.host, jt.thrift_port, id)
+
+  def get(self, jt, job_id, finished):
+    """The JobCounters of the job, which is kept if finished."""
+    key = self._key(jt, job_id)
+    counters = self._finished.get(key)
+    if counters is None:
+      rollups = jt.get_job_counter_rollups(jt.thriftjobid_from_string(job_id))
+      counters = JobCounters.from_rollups(self.catalog, rollups)
+      if finished:
+        self._finished.put(key, counters)
+    return counters
+
+  def get_attempt(self, attempt_id):
+    """The kept JobCounters of the finished task attempt, or None."""
+    return self._finished.get(('attempt', attempt_id))
+
+  def put_attempt(self, attempt_id, group_list):
+    """Keeps the counters (a ThriftGroupList) of the finished task attempt."""
+    counters = JobCounters(self.catalog, (None, None, group_list))
+    self._finished.put(('attempt', attempt_id), counters)
+    return counters
+
+  def get_many(self, jt, jobs):
+    """
+    Returns the JobCounters of many jobs, given as (job id, finished) pairs,
+    as a dict by job id. Jobs the JobTracker doesn't know are left out.
+    The counters that aren't kept are fetched a few at a time, in parallel.
+    """
+    res = {}
+    missing = []
+    for job_id, finished in jobs:
+      counters = self._finished.get(self._key(jt, job_id))
+      if counters is None:
+        missing.append((job_id, finished))
+      else:
+        res[job_id] = counters
+
+    ctx = jt.thread_local.request_context
+    for start in range(0, len(missing), MAX_PARALLEL_FETCHES):
+      batch = missing[start:start + MAX_PARALLEL_FETCHES]
+      futures = [ call_async(jt.client.getJobCounterRollups, ctx, jt.thriftjobid_from_string(job_id))
+                  for job_id, finished in batch ]
+      for (job_id, finished), future in zip(batch, futures):
+        try:
+          counters = JobCounters.from_rollups(self.catalog, future.result())
+        except JobNotFoundException:
+          continue
+        if finished:
+          self._finished.put(self._key(jt, job_id), counters)
+        res[job_id] = counters
+    return res
+
+  def compare(self, jt, jobs, group_name, counter_name):
+    """
+    Returns the values (by kind) of one counter for each of the jobs, given
+    as (job id, finished) pairs: a list of (job id, values) pairs, in order,
+    with None values for the jobs without the counter.
+    """
+    counters = self.get_many(jt, jobs)
+    cid = self.catalog.lookup(group_name, counter_name)
+    res = []
+    for job_id, finished in jobs:
+      values = None
+      if cid is not None and job_id in counters:
+        values = counters[job_id].get(cid)
+      res.append((job_id, values))
+    return res
+
+  def clear(self):
+    self._finished.clear()
+
+
+_store = CounterStore()
+
+
+def get_store():
+  """Returns the shared CounterStore."""
+  return _store
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Kills of jobs, watched in the background.
+#
+# Killing a job used to hold a web server thread for up to 15 seconds,
+# fetching the whole job (tasks included) every half second until it
+# showed as killed.  Kills are now requested, and the request returns; one
+# thread per JobTracker then watches the list of running jobs until the
+# killed ones are gone from it.  The outcome of each kill is kept, for the
+# kill status view to show.
+
+import logging
+import threading
+import time
+
+from desktop.lib.lru_cache import LRUCache
+from desktop.lib.thrift_util import call_async
+from hadoop import job_tracker
+from hadoop.api.jobtracker.ttypes import JobNotFoundException
+
+from jobbrowser import snapshot
+
+LOG = logging.getLogger(__name__)
+
+# How often (seconds) the running jobs are checked while kills are pending,
+# and how long a killed job may take to stop running.
+POLL_INTERVAL = 1
+KILL_TIMEOUT = 60
+
+# At most this many kills are requested at once
+MAX_PARALLEL_KILLS = 8
+
+# The outcome of this many kills is kept, once known
+MAX_KEPT_KILLS = 1000
+
+# Kill states
+KILLING = 'killing'
+KILLED = 'killed'
+# The job was over (succeeded or failed) before it could be killed
+FINISHED = 'finished'
+# The JobTracker refused the kill, or the job kept running
+FAILED = 'failed'
+
+
+class KillStatus(object):
+  """Where the kill of a job is at."""
+  def __init__(self, job_id, requested, state=KILLING, message=None):
+    self.jobId = job_id
+    self.requested = requested
+    self.state = state
+    self.message = message
+
+  @property
+  def is_pending(self):
+    return self.state == KILLING
+
+  def to_dict(self):
+    return dict(jobId=self.jobId, state=self.state, message=self.message)
+
+
+class KillWatcher(object):
+  """
+  Kills jobs of one JobTracker, and watches them stop.
+
+  kill() returns once the JobTracker has the kills; a thread then checks
+  the running jobs every POLL_INTERVAL, and exits when no kill is pending.
+  Without background, the kills are checked by calling check().
+  """
+
+  def __init__(self, jt, clock=time.time, background=True):
+    self.jt = jt
+    self._clock = clock
+    self._background = background
+    # Guards everything below
+    self._cond = threading.Condition()
+    self._pending = {}
+    self._done = LRUCache(MAX_KEPT_KILLS)
+    self._thread = None
+
+  def kill(self, job_ids):
+    """
+    Has the JobTracker kill the jobs, as the current user, a few at a time.
+    Returns their KillStatus, in order.
+    """
+    ctx = self.jt.thread_local.request_context
+    statuses = []
+    for start in range(0, len(job_ids), MAX_PARALLEL_KILLS):
+      batch = job_ids[start:start + MAX_PARALLEL_KILLS]
+      futures = [ call_async(self.jt.client.killJob, ctx, self.jt.thriftjobid_from_string(job_id))
+                  for job_id in batch ]
+      for job_id, future in zip(batch, futures):
+        status = KillStatus(job_id, self._clock())
+        try:
+          future.result()
+        except Exception, e:
+          LOG.warn('Failed to kill job %s: %s' % (job_id, e))
+          status.state = FAILED
+          status.message = 'The JobTracker could not kill the job: %s' % (e,)
+        statuses.append(status)
+
+    self._cond.acquire()
+    try:
+      for status in statuses:
+        if status.is_pending:
+          self._pending[status.jobId] = status
+        else:
+          self._done.put(status.jobId, status)
+      if self._background and self._pending and self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='jobbrowser-kill-watcher')
+        self._thread.setDaemon(True)
+        self._thread.start()
+    finally:
+      self._cond.release()
+    return statuses
+
+  def check(self):
+    """
+    Settles the pending kills of the jobs that stopped running. The others
+    stay pending until KILL_TIMEOUT.
+    """
+    self._cond.acquire()
+    try:
+      pending = self._pending.values()
+    finally:
+      self._cond.release()
+    if not pending:
+      return
+
+    running = set([ job.jobID.asString for job in self.jt.running_jobs().jobs ])
+    now = self._clock()
+    stopped = [ status for status in pending if status.jobId not in running ]
+    if stopped:
+      # The job lists shouldn't show these as running anymore
+      jobs = snapshot.get_snapshot(self.jt)
+      jobs.refresh()
+      for status in stopped:
+        records = jobs.get_jobs(jobid_exact=status.jobId)
+        if records:
+          run_state = records[0].status
+        else:
+          # Jobs in PREP are in neither job list
+          run_state = self._get_run_state(status.jobId)
+        if run_state == 'KILLED':
+          status.state = KILLED
+        elif run_state is not None and run_state not in snapshot.RUNNING_STATES:
+          status.state = FINISHED
+          status.message = 'The job had %s before it could be killed.' % (run_state.lower(),)
+    for status in pending:
+      if status.is_pending and now - status.requested > KILL_TIMEOUT:
+        status.state = FAILED
+        status.message = 'The job did not appear as killed within %d seconds.' % (KILL_TIMEOUT,)
+
+    self._cond.acquire()
+    try:
+      for status in pending:
+        if not status.is_pending:
+          del self._pending[status.jobId]
+          self._done.put(status.jobId, status)
+    finally:
+      self._cond.release()
+
+  def _get_run_state(self, job_id):
+    """The run state of the job, or None if the JobTracker doesn't know it."""
+    try:
+      return self.jt.get_job(self.jt.thriftjobid_from_string(job_id)).status.runStateAsString
+    except JobNotFoundException:
+      return None
+
+  def _run(self):
+    # The JobTracker user is thread-local
+    self.jt.setuser(job_tracker.DEFAULT_USER)
+    while True:
+      self._cond.acquire()
+      try:
+        self._cond.wait(POLL_INTERVAL)
+        if not self._pending:
+          self._thread = None
+          return
+      finally:
+        self._cond.release()
+      try:
+        self.check()
+      except Exception:
+        LOG.exception('Failed to check the killed jobs of %s:%s' % (self.jt.host, self.jt.thrift_port))
+
+  def get_status(self, job_id):
+    """The KillStatus of the latest kill of the job, or None."""
+    self._cond.acquire()
+    try:
+      status = self._pending.get(job_id)
+    finally:
+      self._cond.release()
+    if status is None:
+      status = self._done.get(job_id)
+    return status
+
+  def pending(self):
+    """The ids of the jobs being killed."""
+    self._cond.acquire()
+    try:
+      return set(self._pending.keys())
+    finally:
+      self._cond.release()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(jt):
+  """Returns the KillWatcher of the JobTracker."""
+  key = (jt.host, jt.thrift_port)
+  _watchers_lock.acquire()
+  try:
+    watcher = _watchers.get(key)
+    if watcher is None:
+      watcher = KillWatcher(jt)
+      _watchers[key] = watcher
+    return watcher
+  finally:
+    _watchers_lock.release()
+
+
+def clear():
+  """Forgets every kill. For tests."""
+  _watchers_lock.acquire()
+  try:
+    _watchers.clear()
+  finally:
+    _watchers_lock.release()
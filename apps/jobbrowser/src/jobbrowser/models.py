@@ -15,21 +15,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from desktop.lib.lru_cache import LRUCache
 from desktop.lib.view_util import format_time_diff
 from hadoop import job_tracker
-from hadoop import confparse
 from urlparse import urlparse, urlunparse
 
 import datetime
 import logging
-import lxml.html
 import re
+import urllib
 import urllib2
 
 import hadoop.api.jobtracker.ttypes as ttypes
 
+from jobbrowser import conf_store, counter_store
+
 LOGGER = logging.getLogger(__name__)
 
+# The tasks of a job are fetched from the JobTracker this many at a time.
+# Job.latest_tasks() orders at most this many of them.
+TASK_BATCH_SIZE = 1000
+
+# Task attempt logs are read from the TaskTracker this many bytes at a time
+LOG_CHUNK_SIZE = 64 * 1024
+LOG_NAMES = ('stdout', 'stderr', 'syslog')
+# The log ranges of finished attempts are kept, up to this many bytes
+LOG_CACHE_SIZE = 32 * 1024 * 1024
+FINISHED_ATTEMPT_STATES = ('succeeded', 'failed', 'killed')
+_log_ranges = LRUCache(LOG_CACHE_SIZE, sizeof=len)
+
 class JobLinkage(object):
   """
   A thin representation of a job, without much of the details.
@@ -70,8 +84,10 @@ class Job(JobLinkage):
     """
       Returns a Job instance given a job tracker interface and an id. The job tracker interface is typically
       located in request.jt.
+
+      The job comes without its tasks, which are fetched as needed.
     """
-    thriftjob = jt.get_job(jt.thriftjobid_from_string(jobid))
+    thriftjob = _get_thriftjob(jt, jobid)
     if not thriftjob:
       raise Exception("could not find job with id %s" % jobid)
     return Job(jt, thriftjob)
@@ -88,15 +104,18 @@ class Job(JobLinkage):
     """
     Returns a Job instance given a job tracker interface and a thriftjob object returned from that
     job tracker interface.  The job tracker interface is typically located in request.jt
+
+    Tasks are only wrapped in Task objects when asked for. Those of a thriftjob
+    without tasks are fetched as needed.
     """
     JobLinkage.__init__(self, jt, thriftJob.jobID.asString)
     self.jt = jt
     self.job = thriftJob
-    self.tasks = []
+    self._tips = None
     if self.job.tasks is not None:
-      self.tasks = TaskList.from_thriftTaskList(self.job.tasks, jt)
-
-    self.task_map = dict( (task.taskId, task) for task in self.tasks )
+      self._tips = self.job.tasks.tasks
+    self._tasks = None
+    self._task_map = None
     self._counters = None
     self._conf_keys = None
     self._full_job_conf = None
@@ -105,31 +124,9 @@ class Job(JobLinkage):
   @property
   def counters(self):
     if self._counters is None:
-      rollups = self.jt.get_job_counter_rollups(self.job.jobID)
-      # We get back a structure with counter lists for maps, reduces, and total
-      # and we need to invert this
-
-      def aggregate_counters(ctrs_from_jt, key, target):
-        for group in ctrs_from_jt.groups:
-          if group.name not in target:
-            target[group.name] = {
-              'name': group.name,
-              'displayName': group.displayName,
-              'counters': {}
-              }
-          agg_counters = target[group.name]['counters']
-          for counter in group.counters.itervalues():
-            if counter.name not in agg_counters:
-              agg_counters[counter.name] = {
-                'name': counter.name,
-                'displayName': counter.displayName,
-                }
-            agg_counters[counter.name][key] = counter.value
-
-      self._counters = {}
-      aggregate_counters(rollups.mapCounters, "map", self._counters)
-      aggregate_counters(rollups.reduceCounters, "reduce", self._counters)
-      aggregate_counters(rollups.jobCounters, "total", self._counters)
+      store = counter_store.get_store()
+      job_counters = store.get(self.jt, self.jobId, self.status not in ('RUNNING', 'PREP'))
+      self._counters = job_counters.to_dict(store.catalog)
     return self._counters
 
   @property
@@ -192,11 +189,49 @@ class Job(JobLinkage):
   def kill(self):
     self.jt.kill_job(self.job.jobID)
 
+  @property
+  def tasks(self):
+    if self._tasks is None:
+      if self._tips is not None:
+        self._tasks = [ Task(tip, self.jt) for tip in self._tips ]
+      else:
+        self._tasks = self.filter_tasks()
+    return self._tasks
+
+  @property
+  def task_map(self):
+    if self._task_map is None:
+      self._task_map = dict( (task.taskId, task) for task in self.tasks )
+    return self._task_map
+
   def get_task(self, id):
-    try:
-      return self.task_map[id]
-    except:
-      return JobLinkage.get_task(self, id)
+    if self._task_map is not None or self._tips is not None:
+      task = self.task_map.get(id)
+      if task is not None:
+        return task
+    return JobLinkage.get_task(self, id)
+
+  def _select_tasks(self, task_types, task_states, task_text, count, offset):
+    return TaskList.select(self.jt, self.jobId, task_types, task_states, task_text, count, offset)
+
+  def latest_tasks(self, task_states, count, reverse=True):
+    """
+    Returns the count tasks in task_states that started executing last (or
+    first, unless reverse). The JobTracker does the filtering; of a job
+    with more than TASK_BATCH_SIZE such tasks, only the last (or first)
+    TASK_BATCH_SIZE, in the JobTracker's order, are looked at.
+    """
+    if self._tips is not None:
+      tasks = self.filter_tasks(task_states=task_states)
+    else:
+      task_list = self._select_tasks(None, task_states, None, TASK_BATCH_SIZE, 0)
+      tasks = task_list.tasks
+      if reverse and task_list.numTotalTasks > TASK_BATCH_SIZE:
+        tasks = self._select_tasks(None, task_states, None, TASK_BATCH_SIZE,
+                                   task_list.numTotalTasks - TASK_BATCH_SIZE).tasks
+    tasks = list(tasks)
+    tasks.sort(key=lambda task: task.execStartTimeMs, reverse=reverse)
+    return tasks[:count]
 
   def filter_tasks(self, task_types=None, task_states=None, task_text=None):
     """
@@ -207,23 +242,32 @@ class Job(JobLinkage):
     assert task_types is None or job_tracker.VALID_TASK_TYPES.issuperset(task_types)
     assert task_states is None or job_tracker.VALID_TASK_STATES.issuperset(task_states)
 
-    def is_good_match(t):
-      if task_types is not None:
-        if t.task.taskID.taskTypeAsString.lower() not in task_types:
-          return False
+    if self._tips is not None:
+      def is_good_match(t):
+        if task_types is not None:
+          if t.task.taskID.taskTypeAsString.lower() not in task_types:
+            return False
+
+        if task_states is not None:
+          if t.state.lower() not in task_states:
+            return False
 
-      if task_states is not None:
-        if t.state.lower() not in task_states:
-          return False
+        if task_text is not None:
+          tt_lower = task_text.lower()
+          if tt_lower not in t.state.lower() and tt_lower not in t.mostRecentState.lower() and tt_lower not in t.task.taskID.asString.lower():
+            return False
 
-      if task_text is not None:
-        tt_lower = task_text.lower()
-        if tt_lower not in t.state.lower() and tt_lower not in t.mostRecentState.lower() and tt_lower not in t.task.taskID.asString.lower():
-          return False
+        return True
 
-      return True
+      return [ t for t in self.tasks if is_good_match(t) ]
 
-    return [ t for t in self.tasks if is_good_match(t) ]
+    # Let the JobTracker do the filtering, a batch of tasks at a time
+    tasks = []
+    while True:
+      task_list = self._select_tasks(task_types, task_states, task_text, TASK_BATCH_SIZE, len(tasks))
+      tasks.extend(task_list.tasks)
+      if not task_list.tasks or len(tasks) >= task_list.numTotalTasks:
+        return tasks
 
   def _initialize_conf_keys(self):
     conf_keys = [
@@ -362,6 +406,7 @@ class TaskAttempt(object):
     assert task_attempt is not None
     self.task_attempt = task_attempt
     self.task = task
+    self._tracker = None
     self._init_attributes();
 
   def _init_attributes(self):
@@ -387,48 +432,98 @@ class TaskAttempt(object):
 
   def get_tracker(self):
     try:
-      tracker = Tracker.from_name(self.task.jt, self.taskTrackerId)
-      return tracker
+      return Tracker.from_name(self.task.jt, self.taskTrackerId)
     except ttypes.TaskTrackerNotFoundException, e:
       LOGGER.warn("Tracker %s not found: %s" % (self.taskTrackerId, e))
-      all_trackers = self.task.jt.all_task_trackers()
-      for t in all_trackers.trackers:
+      for t in self.task.jt.topology().trackers():
         LOGGER.debug("Available tracker: %s" % t.trackerName)
       raise ttypes.TaskTrackerNotFoundException(
                           "Cannot lookup TaskTracker '%s'" % (self.taskTrackerId,))
 
-  def get_task_log(self):
+  def _get_log_url(self, name, start, end):
+    if self._tracker is None:
+      self._tracker = self.get_tracker()
+    query = urllib.urlencode([ ('attemptid', self.attemptId), ('filter', name),
+                               ('start', start), ('end', end), ('plaintext', 'true') ])
+    return urlunparse(('http',
+                       '%s:%s' % (self._tracker.host, self._tracker.httpPort),
+                       'tasklog',
+                       None,
+                       query,
+                       None))
+
+  def get_task_log_range(self, name, start, end, cache=True):
     """
-    get_task_log(task_id) -> (stdout_text, stderr_text, syslog_text)
+    get_task_log_range(name, start, end) -> bytes
 
-    Retrieve the task log from the TaskTracker, at this url:
-      http://<tracker_host>:<port>/tasklog?taskid=<attempt_id>
-    Optional query string:
+    Retrieve bytes start to end (excluded) of the stdout, stderr or syslog
+    of the attempt from the TaskTracker, at this url:
+      http://<tracker_host>:<port>/tasklog?attemptid=<attempt_id>&plaintext=true
+    With this query string:
       &filter=<source>  : where <source> is 'syslog', 'stdout', or 'stderr'.
       &start=<offset>   : specify the start offset of the log section, when using a filter.
       &end=<offset>     : specify the end offset of the log section, when using a filter.
+    Negative offsets count from the end of the log, -1 being the end.
+
+    The logs of finished attempts don't change, and their ranges are kept.
     """
-    tracker = self.get_tracker()
-    url = urlunparse(('http',
-                      '%s:%s' % (tracker.host, tracker.httpPort),
-                      'tasklog',
-                      None,
-                      'attemptid=%s' % (self.attemptId,),
-                      None))
+    assert name in LOG_NAMES
+    cache = cache and self.state in FINISHED_ATTEMPT_STATES
+    key = (self.attemptId, name, start, end)
+    if cache:
+      data = _log_ranges.get(key)
+      if data is not None:
+        return data
+
+    url = self._get_log_url(name, start, end)
     LOGGER.info('Retrieving %s' % (url,))
     try:
-      data = urllib2.urlopen(url)
+      data = urllib2.urlopen(url).read()
     except urllib2.URLError:
       raise urllib2.URLError("Cannot retrieve logs from TaskTracker '%s'" % (self.taskTrackerId,))
+    if cache:
+      _log_ranges.put(key, data)
+    return data
 
-    et = lxml.html.parse(data)
-    log_sections = et.findall('body/pre')
-    if len(log_sections) != 3:
-      LOGGER.warn('Error parsing task attempt log for %s at "%s". Found %d (not 3) log sections' %
-                  (self.attemptId, url, len(log_sections)))
-      err = "Hue encountered an error while retrieving logs from '%s'" % (url,)
-      return (err, err, err)
-    return [ section.text for section in log_sections ]
+  def get_task_log_tail(self, name, chunks=1):
+    """
+    get_task_log_tail(name, chunks) -> (text, complete)
+
+    The end of the log, read LOG_CHUNK_SIZE bytes at a time from its end,
+    at most chunks times. complete is whether that is the whole log; if not,
+    the text starts at the first full line.
+    """
+    parts = []
+    complete = False
+    for i in range(chunks):
+      data = self.get_task_log_range(name, -(i + 1) * LOG_CHUNK_SIZE - 1, -i * LOG_CHUNK_SIZE - 1)
+      parts.insert(0, data)
+      if len(data) < LOG_CHUNK_SIZE:
+        complete = True
+        break
+    text = ''.join(parts)
+    if not complete:
+      text = text[text.find('\n') + 1:]
+    return text.decode('utf-8', 'replace'), complete
+
+  def iter_task_log(self, name):
+    """Yields the whole log, a chunk at a time from its start, for downloads."""
+    start = 0
+    while True:
+      data = self.get_task_log_range(name, start, start + LOG_CHUNK_SIZE, cache=False)
+      if data:
+        yield data
+      if len(data) < LOG_CHUNK_SIZE:
+        return
+      start += len(data)
+
+  def get_task_log(self):
+    """
+    get_task_log() -> [stdout_text, stderr_text, syslog_text]
+
+    The ends of the logs of the attempt, as get_task_log_tail() has them.
+    """
+    return [ self.get_task_log_tail(name)[0] for name in LOG_NAMES ]
 
 
 class Tracker(object):
@@ -441,7 +536,8 @@ class Tracker(object):
 
   @staticmethod
   def from_name(jt, trackername):
-    return Tracker(jt.task_tracker(trackername))
+    """Looks the tracker up in the cluster topology the JobTracker keeps."""
+    return Tracker(jt.find_task_tracker(trackername))
 
   def __init__(self, thrifttracker):
     self.tracker = thrifttracker
@@ -500,13 +596,33 @@ class Cluster(object):
 
 def get_jobconf(jt, jobid):
   """
-  Returns a dict representation of the jobconf for the job corresponding
-  to jobid. filter_keys is an optional list of configuration keys to filter on.
+  Returns a (read-only) dict-like representation of the jobconf for the job
+  corresponding to jobid, a conf_store.JobConf.
   """
-  jid = jt.thriftjobid_from_string(jobid)
   # This will throw if the the jobconf can't be found
-  xml_data = jt.get_job_xml(jid)
-  return confparse.ConfParse(xml_data)
+  return conf_store.get_store().get(jt, jobid)
+
+def _get_thriftjob(jt, jobid):
+  """
+  Returns the ThriftJobInProgress of the job, from the job snapshot when it
+  knows the job, and then without its tasks.
+  """
+  # The snapshot module needs this one
+  from jobbrowser import snapshot
+  jobs = snapshot.get_snapshot(jt)
+  thriftjob = jobs.get_thriftjob(jobid)
+  if thriftjob is None:
+    # The job may have started running since the last refresh
+    jobs.refresh()
+    thriftjob = jobs.get_thriftjob(jobid)
+  if thriftjob is not None:
+    return thriftjob
+
+  # Jobs being prepared are in no job list
+  thriftjob = jt.get_job(jt.thriftjobid_from_string(jobid))
+  if thriftjob:
+    thriftjob.tasks = None
+  return thriftjob
 
 def format_unixtime_ms(unixtime):
   """
@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A snapshot of the jobs known to a JobTracker.
+#
+# Listing every job retained by the JobTracker, and wrapping each in a Job,
+# used to be done for every job list view and every dock refresh.  Instead,
+# one background thread per JobTracker keeps compact records of its jobs,
+# indexed by user, state and queue.  Finished jobs don't change, so between
+# full refreshes only the running jobs are asked about, and the lists of
+# finished jobs once some stop running.
+
+import datetime
+import logging
+import threading
+import time
+
+from desktop.lib.view_util import format_time_diff
+from hadoop import job_tracker
+
+from jobbrowser.models import format_unixtime_ms
+
+LOG = logging.getLogger(__name__)
+
+# How often (seconds) the running jobs are refreshed, and how often all jobs
+# are, to find out about jobs the JobTracker has retired.
+REFRESH_INTERVAL = 5
+FULL_REFRESH_INTERVAL = 5 * 60
+
+# The refresh thread exits once no one has looked at the snapshot for this
+# long. A snapshot older than MAX_STALENESS is refreshed before being read.
+IDLE_TIMEOUT = 5 * 60
+MAX_STALENESS = 30
+
+RUNNING_STATES = ('RUNNING', 'PREP')
+
+# The job list "state" filter, to the job run states it shows
+STATE_FILTERS = {
+  'all': None,
+  'running': RUNNING_STATES,
+  'completed': ('SUCCEEDED',),
+  # Succeeded and completed are synonyms here.
+  'succeeded': ('SUCCEEDED',),
+  'failed': ('FAILED',),
+  'killed': ('KILLED',),
+}
+
+
+class JobRecord(object):
+  """
+  The attributes of a job that job lists show, with the same names as on
+  Job. Formatted times are computed when asked for.
+  """
+  __slots__ = ('jobId', 'jobName', 'user', 'queueName', 'status', 'priority',
+               'startTimeMs', 'launchTimeMs', 'finishTimeMs', 'desiredMaps', 'finishedMaps',
+               'desiredReduces', 'finishedReduces', 'mapProgress', 'reduceProgress')
+
+  def __init__(self, thriftjob):
+    self.jobId = thriftjob.jobID.asString
+    self.jobName = thriftjob.profile.name
+    self.user = thriftjob.profile.user
+    self.queueName = thriftjob.profile.queueName
+    self.status = thriftjob.status.runStateAsString
+    self.priority = thriftjob.priorityAsString
+    self.startTimeMs = thriftjob.startTime
+    self.launchTimeMs = thriftjob.launchTime
+    self.finishTimeMs = thriftjob.finishTime
+    self.desiredMaps = thriftjob.desiredMaps
+    self.finishedMaps = thriftjob.finishedMaps
+    self.desiredReduces = thriftjob.desiredReduces
+    self.finishedReduces = thriftjob.finishedReduces
+    self.mapProgress = thriftjob.status.mapProgress
+    self.reduceProgress = thriftjob.status.reduceProgress
+
+  def __getitem__(self, item):
+    """
+    For backwards-compatibility, resolve job["foo"] as job.foo
+    """
+    return getattr(self, item)
+
+  @property
+  def is_running(self):
+    return self.status in RUNNING_STATES
+
+  @property
+  def jobId_short(self):
+    return "_".join(self.jobId.split("_")[-2:])
+
+  @property
+  def maps_percent_complete(self):
+    return _percent(self.finishedMaps, self.desiredMaps)
+
+  @property
+  def reduces_percent_complete(self):
+    return _percent(self.finishedReduces, self.desiredReduces)
+
+  @property
+  def startTimeFormatted(self):
+    return format_unixtime_ms(self.startTimeMs)
+
+  @property
+  def launchTimeFormatted(self):
+    return format_unixtime_ms(self.launchTimeMs)
+
+  @property
+  def finishTimeFormatted(self):
+    return format_unixtime_ms(self.finishTimeMs)
+
+  def _start_finish(self):
+    if self.finishTimeMs == 0:
+      finish = datetime.datetime.now()
+    else:
+      finish = datetime.datetime.fromtimestamp(self.finishTimeMs / 1000)
+    return datetime.datetime.fromtimestamp(self.startTimeMs / 1000), finish
+
+  @property
+  def duration(self):
+    start, finish = self._start_finish()
+    return finish - start
+
+  @property
+  def durationFormatted(self):
+    start, finish = self._start_finish()
+    return format_time_diff(start, finish)
+
+
+def _percent(done, total):
+  if total == 0:
+    return 0
+  return int(round(float(done) / total * 100))
+
+
+class JobSnapshot(object):
+  """
+  The jobs of one JobTracker, as JobRecords.
+
+  Readers call get_jobs() and count_by_state(), which (re)start the refresh
+  thread as needed; it exits when the snapshot hasn't been read for a while.
+  Without background, the snapshot is only refreshed once it is stale.
+  """
+
+  def __init__(self, jt, clock=time.time, background=True):
+    self.jt = jt
+    self._clock = clock
+    self._background = background
+    # Guards everything below, and wakes up the refresh thread
+    self._cond = threading.Condition()
+    # Only one refresh at a time; taken before _cond
+    self._refresh_lock = threading.Lock()
+    self._jobs = {}
+    self._by_user = {}
+    self._by_state = {}
+    self._by_queue = {}
+    # The jobs as the JobTracker lists them, without their tasks
+    self._thriftjobs = {}
+    self._total_submissions = None
+    # Submissions in no job list as of the last refresh, and how many of
+    # those weren't in the finished job lists either: jobs being prepared
+    self._unseen = 0
+    self._preparing = 0
+    self.last_refresh = None
+    self.last_full_refresh = None
+    self._last_access = None
+    self._thread = None
+    self._stopped = False
+
+  #
+  # Indexes
+  #
+  def _add(self, record, thriftjob):
+    """Lock must be held."""
+    old = self._jobs.get(record.jobId)
+    if old is not None:
+      self._remove(old)
+    self._jobs[record.jobId] = record
+    self._thriftjobs[record.jobId] = thriftjob
+    for index, key in ((self._by_user, record.user),
+                       (self._by_state, record.status),
+                       (self._by_queue, record.queueName)):
+      index.setdefault(key, set()).add(record.jobId)
+
+  def _remove(self, record):
+    """Lock must be held."""
+    del self._jobs[record.jobId]
+    del self._thriftjobs[record.jobId]
+    for index, key in ((self._by_user, record.user),
+                       (self._by_state, record.status),
+                       (self._by_queue, record.queueName)):
+      ids = index[key]
+      ids.discard(record.jobId)
+      if not ids:
+        del index[key]
+
+  #
+  # Refreshing
+  #
+  def refresh(self, full=False):
+    """Brings the snapshot up to date with the JobTracker."""
+    self._refresh_lock.acquire()
+    try:
+      if full or self.last_full_refresh is None:
+        self._refresh_all()
+      else:
+        self._refresh_running()
+    finally:
+      self._refresh_lock.release()
+
+  def _refresh_all(self):
+    total_submissions = self.jt.cluster_status().totalSubmissions
+    jobs = self.jt.all_jobs().jobs
+    records = [ JobRecord(job) for job in jobs ]
+    now = self._clock()
+    self._cond.acquire()
+    try:
+      self._jobs = {}
+      self._thriftjobs = {}
+      self._by_user = {}
+      self._by_state = {}
+      self._by_queue = {}
+      for record, job in zip(records, jobs):
+        self._add(record, job)
+      self._total_submissions = total_submissions
+      self._unseen = self._preparing = 0
+      self.last_refresh = self.last_full_refresh = now
+    finally:
+      self._cond.release()
+
+  def _refresh_running(self):
+    total_submissions = self.jt.cluster_status().totalSubmissions
+    running_jobs = self.jt.running_jobs().jobs
+    running = [ JobRecord(job) for job in running_jobs ]
+
+    self._cond.acquire()
+    try:
+      new_jobs = len([ r for r in running if r.jobId not in self._jobs ])
+      running_ids = set([ r.jobId for r in running ])
+      finished_ids = [ job_id for state in RUNNING_STATES
+                       for job_id in self._by_state.get(state, ())
+                       if job_id not in running_ids ]
+      # The new running jobs account for the submissions since the last
+      # refresh first. Those still unseen since then either finished in
+      # between, or are being prepared; the jobs being prepared are in no
+      # job list, and are only looked for once.
+      unseen = max(0, self._unseen + total_submissions - self._total_submissions - new_jobs)
+      old_unseen = min(unseen, self._unseen)
+      preparing = min(self._preparing, old_unseen)
+      missed = old_unseen - preparing
+    finally:
+      self._cond.release()
+
+    finished_jobs = []
+    if finished_ids or missed:
+      finished_jobs, unsettled = self._get_finished(finished_ids, missed)
+      if unsettled:
+        # The JobTracker retired jobs that were running, or restarted
+        self._refresh_all()
+        return
+      found = len(finished_jobs) - len(finished_ids)
+      unseen = max(0, unseen - found)
+      preparing = min(unseen, preparing + max(0, missed - found))
+
+    self._cond.acquire()
+    try:
+      for record, job in zip(running, running_jobs):
+        self._add(record, job)
+      for job in finished_jobs:
+        self._add(JobRecord(job), job)
+      self._total_submissions = total_submissions
+      self._unseen = unseen
+      self._preparing = preparing
+      self.last_refresh = self._clock()
+    finally:
+      self._cond.release()
+
+  def _get_finished(self, finished_ids, missed):
+    """
+    Looks for the jobs that stopped running, and for the missed number of
+    finished jobs the snapshot doesn't know, in the (task-free) lists of
+    finished jobs. Returns the ThriftJobInProgresses found, and the ids of
+    the jobs that stopped running that are in none of the lists.
+    """
+    unsettled = set(finished_ids)
+    jobs = []
+    found = 0
+    for job_list in (self.jt.completed_jobs, self.jt.failed_jobs, self.jt.killed_jobs):
+      if not unsettled and found >= missed:
+        break
+      for job in job_list().jobs:
+        job_id = job.jobID.asString
+        if job_id in unsettled:
+          unsettled.remove(job_id)
+        elif missed and job_id not in self._jobs:
+          # Only refreshes change _jobs, one at a time
+          found += 1
+        else:
+          continue
+        jobs.append(job)
+    return jobs, unsettled
+
+  def _run(self):
+    # The JobTracker user is thread-local
+    self.jt.setuser(job_tracker.DEFAULT_USER)
+    while True:
+      self._cond.acquire()
+      try:
+        if not self._stopped:
+          self._cond.wait(REFRESH_INTERVAL)
+        now = self._clock()
+        if self._stopped or now - self._last_access > IDLE_TIMEOUT:
+          self._thread = None
+          return
+        full = now - self.last_full_refresh >= FULL_REFRESH_INTERVAL
+      finally:
+        self._cond.release()
+      try:
+        self.refresh(full)
+      except Exception:
+        LOG.exception('Failed to refresh the jobs of %s:%s' % (self.jt.host, self.jt.thrift_port))
+
+  def _touch(self):
+    """Notes a read; refreshes the snapshot first if it is too old."""
+    self._cond.acquire()
+    try:
+      now = self._clock()
+      self._last_access = now
+      self._stopped = False
+      stale = self.last_refresh is None or now - self.last_refresh > MAX_STALENESS
+    finally:
+      self._cond.release()
+    if stale:
+      self.refresh()
+    if not self._background:
+      return
+
+    self._cond.acquire()
+    try:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='jobbrowser-snapshot')
+        self._thread.setDaemon(True)
+        self._thread.start()
+    finally:
+      self._cond.release()
+
+  def stop(self):
+    """Has the refresh thread exit soon. Returns it, if there is one."""
+    self._cond.acquire()
+    try:
+      self._stopped = True
+      self._cond.notifyAll()
+      return self._thread
+    finally:
+      self._cond.release()
+
+  #
+  # Reading
+  #
+  def _matching_ids(self, index, fragment):
+    """Lock must be held. The ids of the jobs whose key contains fragment."""
+    ids = set()
+    for key, key_ids in index.iteritems():
+      if fragment in key:
+        ids.update(key_ids)
+    return ids
+
+  def get_jobs(self, state='all', user=None, pools=None, text=None,
+               jobid_exact=None, jobid_substr=None):
+    """
+    Returns the JobRecords of the jobs matching every given filter,
+    newest first. user and pools (queue names) are substring matches;
+    text is a case-insensitive one over the fields that job lists show.
+    """
+    self._touch()
+    if state is None:
+      state = 'all'
+    states = STATE_FILTERS[state]
+
+    self._cond.acquire()
+    try:
+      if jobid_exact:
+        ids = set()
+        if jobid_exact in self._jobs:
+          ids.add(jobid_exact)
+      else:
+        ids = None
+      if states is not None:
+        state_ids = set()
+        for s in states:
+          state_ids.update(self._by_state.get(s, ()))
+        ids = _intersect(ids, state_ids)
+      if user:
+        ids = _intersect(ids, self._matching_ids(self._by_user, user))
+      if pools:
+        ids = _intersect(ids, self._matching_ids(self._by_queue, pools))
+      if ids is None:
+        records = self._jobs.values()
+      else:
+        records = [ self._jobs[job_id] for job_id in ids ]
+    finally:
+      self._cond.release()
+
+    if jobid_substr:
+      records = [ r for r in records if jobid_substr in r.jobId ]
+    if text:
+      search = text.lower()
+      # These fields are chosen to match those displayed by the JT UI
+      records = [ r for r in records
+                  if search in r.user.lower() or search in r.jobName.lower() or
+                     search in r.jobId.lower() or search in r.queueName.lower() or
+                     search in r.priority.lower() ]
+    records.sort(key=lambda r: r.jobId, reverse=True)
+    return records
+
+  def get_thriftjob(self, job_id):
+    """
+    Returns the ThriftJobInProgress of the job, as of the last refresh and
+    without its tasks, or None if the snapshot doesn't know the job.
+    """
+    self._touch()
+    self._cond.acquire()
+    try:
+      return self._thriftjobs.get(job_id)
+    finally:
+      self._cond.release()
+
+  def count_by_state(self, user):
+    """
+    Returns the number of completed, running, failed and killed jobs of
+    the user, and all of them.
+    """
+    self._touch()
+    res = dict(completed=0, running=0, failed=0, killed=0, all=0)
+    self._cond.acquire()
+    try:
+      for job_id in self._by_user.get(user, ()):
+        status = self._jobs[job_id].status
+        if status in RUNNING_STATES:
+          res['running'] += 1
+        elif status == 'SUCCEEDED':
+          res['completed'] += 1
+        elif status in ('FAILED', 'KILLED'):
+          res[status.lower()] += 1
+    finally:
+      self._cond.release()
+    res['all'] = res['completed'] + res['running'] + res['failed'] + res['killed']
+    return res
+
+
+def _intersect(ids, other):
+  if ids is None:
+    return other
+  return ids.intersection(other)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(jt):
+  """Returns the JobSnapshot of the JobTracker that jt talks to."""
+  key = (jt.host, jt.thrift_port)
+  _snapshots_lock.acquire()
+  try:
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+      snapshot = JobSnapshot(jt)
+      _snapshots[key] = snapshot
+    return snapshot
+  finally:
+    _snapshots_lock.release()
+
+
+def clear():
+  """Forgets every snapshot, and waits for their refresh threads to exit."""
+  _snapshots_lock.acquire()
+  try:
+    snapshots = _snapshots.values()
+    _snapshots.clear()
+  finally:
+    _snapshots_lock.release()
+  for snapshot in snapshots:
+    thread = snapshot.stop()
+    if thread is not None:
+      thread.join()
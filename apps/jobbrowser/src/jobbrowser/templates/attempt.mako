@@ -103,35 +103,26 @@
           </li>
 
           <li class="jt-logs">
-            <%
-              log_stdout = logs[0]
-              log_stderr = logs[1]
-              log_syslog = logs[2]
-            %>
 <%def name="format_log(raw)">
 ## have to remove any indentation here or it breaks inside the pre tags
 % for line in raw.split('\n'):
 ${ line | h,trim }
 % endfor
 </%def>
-            <h2>stdout</h2>
-            % if not log_stdout:
+            % for log in logs:
+            <h2>${log['name']}</h2>
+            % if not log['text']:
 <pre>-- empty --</pre>
             % else:
-<pre>${format_log(log_stdout)}</pre>
-            % endif
-            <h2>stderr</h2>
-            % if not log_stderr:
-<pre>-- empty --</pre>
-            % else:
-<pre>${format_log(log_stderr)}</pre>
-            % endif
-            <h2>syslog</h2>
-            % if not log_syslog:
-<pre>-- empty --</pre>
-            % else:
-<pre>${format_log(log_syslog)}</pre>
+            <p class="jt-log-links">
+              % if not log['complete']:
+              <a href="?${log['more_params'] | h}" class="jt-log-more">Load more</a>
+              % endif
+              <a href="${url('jobbrowser.views.task_attempt_log', jobid=joblnk.jobId, taskid=taskid, attemptid=attempt.attemptId, name=log['name'])}" target="_blank" class="jt-log-download">Download</a>
+            </p>
+<pre>${format_log(log['text'])}</pre>
             % endif
+            % endfor
           </li>
         </ul>
       </div>
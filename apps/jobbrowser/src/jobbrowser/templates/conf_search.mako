@@ -0,0 +1,51 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%namespace name="comps" file="jobbrowser_components.mako" />
+<%
+  OPS = dict(eq='=', gt='>', gte='>=', lt='<', lte='<=')
+%>
+${comps.header("Configuration Search :: Job Browser")}
+  <h1>Jobs where ${key} ${OPS[op]} ${value}</h1>
+  <table data-filters="HtmlTable" class="selectable sortable" cellpadding="0" cellspacing="0">
+    <thead>
+      <tr>
+        <th>Name / Id</th>
+        <th>Status</th>
+        <th>User</th>
+        <th>Date</th>
+        <th>${key}</th>
+      </tr>
+    </thead>
+    <tbody>
+      % if not rows:
+        <tr>
+          <td colspan="5">There were no jobs that match your search criteria.</td>
+        </tr>
+      % endif
+      % for job, job_value in rows:
+      <tr>
+        <td>${job.jobName}
+          <div class="jt_jobid"><a href="${url('jobbrowser.views.single_job', jobid=job.jobId)}">${job.jobId}</a></div>
+        </td>
+        <td>${job.status.lower()}</td>
+        <td>${job.user}</td>
+        <td>${job.startTimeFormatted}</td>
+        <td>${job_value}</td>
+      </tr>
+      % endfor
+    </tbody>
+  </table>
+${comps.footer()}
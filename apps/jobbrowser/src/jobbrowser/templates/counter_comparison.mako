@@ -0,0 +1,66 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%
+  from jobbrowser.views import format_counter_name
+%>
+<%namespace name="comps" file="jobbrowser_components.mako" />
+${comps.header("Counter Comparison :: Job Browser")}
+  <h1>${format_counter_name(group)}: ${format_counter_name(counter)}</h1>
+  <table data-filters="HtmlTable" class="selectable sortable jt_counter_table" cellpadding="0" cellspacing="0">
+    <thead>
+      <tr>
+        <th>Name / Id</th>
+        <th>Status</th>
+        <th>User</th>
+        <th>Date</th>
+        <th class="jt_counter_maps_total">Maps Total</th>
+        <th class="jt_counter_reduces_total">Reduces Total</th>
+        <th class="jt_counter_total">Total</th>
+      </tr>
+    </thead>
+    <tbody>
+      % if not rows:
+        <tr>
+          <td colspan="7">There were no jobs to compare.</td>
+        </tr>
+      % endif
+      % for job_id, job, values in rows:
+      <tr>
+        <td>
+          % if job:
+            ${job.jobName}
+          % endif
+          <div class="jt_jobid"><a href="${url('jobbrowser.views.single_job', jobid=job_id)}">${job_id}</a></div>
+        </td>
+        % if job:
+          <td>${job.status.lower()}</td>
+          <td>${job.user}</td>
+          <td>${job.startTimeFormatted}</td>
+        % else:
+          <td colspan="3">retired</td>
+        % endif
+        % if values is None:
+          <td colspan="3">n/a</td>
+        % else:
+          <td class="jt_counter_maps_total">${values.get('map', '')}</td>
+          <td class="jt_counter_reduces_total">${values.get('reduce', '')}</td>
+          <td class="jt_counter_total">${values.get('total', '')}</td>
+        % endif
+      </tr>
+      % endfor
+    </tbody>
+  </table>
+${comps.footer()}
@@ -23,6 +23,9 @@
 %   if option == state:
       selected="true"
 %   endif
+</%def>
+<%def name="pageref(num)">
+  href="?page=${num}&${filter_params}"
 </%def>
 
     % if len(jobs) > 0 or filtered:
@@ -106,6 +109,18 @@
             % endfor
           </tbody>
         </table>
+        <div class="jtv-pagination">
+          <div class="jtv-pagination_count ccs-inline">
+            Showing ${page.start_index()} to ${page.end_index()} of ${page.total_count()} jobs
+          </div>
+          <div class="jtv_offset_controls">
+            <a title="First Page" class="jtv_offset_begin" ${pageref(1)}>First Page</a>
+            <a title="Previous Page" class="jtv_offset_previous" ${pageref(page.previous_page_number())}>Previous Page</a>
+            <div class="jtv_nav_pages">page <span class="jtv_page">${page.number} of ${page.num_pages()}</span></div>
+            <a title="Next Page" class="jtv_offset_next" ${pageref(page.next_page_number())}>Next Page</a>
+            <a title="Last Page" class="jtv_offset_end" ${pageref(page.num_pages())}>Last Page</a>
+          </div>
+        </div>
       % else:
         ${comps.header("Job Browser", toolbar=True)}
         <div class="jt-welcome">
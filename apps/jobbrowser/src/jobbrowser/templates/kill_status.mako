@@ -0,0 +1,43 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%namespace name="comps" file="jobbrowser_components.mako" />
+${comps.header("Killing Jobs :: Job Browser")}
+  % if pending:
+  <meta http-equiv="refresh" content="1;${url('jobbrowser.views.kill_status')}?${params | h}" />
+  <h1>Killing ${len(pending)} of ${len(statuses)} jobs...</h1>
+  % else:
+  <h1>Killed Jobs</h1>
+  % endif
+  <table data-filters="HtmlTable" class="selectable jt_kill_status_table" cellpadding="0" cellspacing="0">
+    <thead>
+      <tr>
+        <th>Id</th>
+        <th>Kill</th>
+        <th>Details</th>
+      </tr>
+    </thead>
+    <tbody>
+      % for status in statuses:
+      <tr>
+        <td><a href="${url('jobbrowser.views.single_job', jobid=status.jobId)}" class="frame_tip jt_view" title="View this job">${status.jobId}</a></td>
+        <td>${status.state or 'unknown'}</td>
+        <td>${status.message or '' | h}</td>
+      </tr>
+      % endfor
+    </tbody>
+  </table>
+  <a href="${url('jobbrowser.views.jobs')}">Back to the jobs</a>
+${comps.footer()}
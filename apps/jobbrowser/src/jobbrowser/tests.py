@@ -15,7 +15,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import cgi
+import StringIO
 import time
+import urlparse
 
 from nose.tools import assert_true, assert_false, assert_equal
 
@@ -25,7 +28,13 @@ from jobsub.models import JobDesign
 from jobsub.tests import parse_out_id, watch_till_complete
 from jobsub.views import in_process_jobsubd
 from jobsubd.ttypes import SubmissionHandle
-from jobbrowser import models, views
+from hadoop.api.jobtracker.ttypes import JobNotFoundException, ThriftClusterStatus, \
+    ThriftJobID, ThriftJobInProgress, ThriftJobList, ThriftJobProfile, ThriftJobState, \
+    ThriftJobStatus, ThriftTaskID, ThriftTaskInProgress, ThriftTaskInProgressList, \
+    ThriftCounter, ThriftCounterGroup, ThriftGroupList, ThriftJobCounterRollups, \
+    ThriftTaskAttemptID, ThriftTaskStatus
+from hadoop.api.common.ttypes import IOException
+from jobbrowser import conf_store, counter_store, kill_watcher, models, snapshot, views
 
 def test_dots_to_camel_case():
   assert_equal("fooBar", models.dots_to_camel_case("foo.bar"))
@@ -44,6 +53,500 @@ def test_format_counter_name():
   assert_equal("A Bbb Ccc", views.format_counter_name("A_BBB_CCC"))
 
 
+class FakeJobTracker(object):
+  """Just enough of a LiveJobTracker for a JobSnapshot."""
+  host = 'fakejt'
+  thrift_port = 9290
+
+  def __init__(self):
+    self.jobs = {}
+    self.tasks = {}
+    self.counters = {}
+    self.confs = {}
+    self.total_submissions = 0
+    self.calls = []
+    self.client = self
+    self.thread_local = self
+    self.request_context = None
+
+  def submit(self, job_id, user, queue, state='RUNNING'):
+    self.jobs[job_id] = (user, queue, state)
+    self.total_submissions += 1
+
+  def add_task(self, job_id, task_type, state, exec_start):
+    tasks = self.tasks.setdefault(job_id, [])
+    task_id = '%s_%s_%06d' % (job_id.replace('job', 'task'), task_type[0], len(tasks))
+    tip = ThriftTaskInProgress(
+      taskID=ThriftTaskID(jobID=ThriftJobID(asString=job_id), asString=task_id),
+      startTime=exec_start, execStartTime=exec_start, execFinishTime=0, progress=1.0,
+      failed=state == 'failed', complete=state == 'succeeded', mostRecentState='',
+      taskStatuses={}, taskDiagnosticData={}, counters=None)
+    tip.taskID.taskTypeAsString = task_type.upper()
+    tip.state = state
+    tasks.append(tip)
+    return task_id
+
+  def _thriftjob(self, job_id):
+    user, queue, state = self.jobs[job_id]
+    status = ThriftJobStatus(runState=getattr(ThriftJobState, state), mapProgress=0.0,
+                             reduceProgress=0.0)
+    status.runStateAsString = state
+    job = ThriftJobInProgress(
+      profile=ThriftJobProfile(user=user, name='job of ' + user, queueName=queue),
+      status=status, jobID=ThriftJobID(asString=job_id),
+      desiredMaps=2, finishedMaps=1, desiredReduces=0, finishedReduces=0,
+      startTime=1000, launchTime=2000, finishTime=0)
+    job.priorityAsString = 'NORMAL'
+    return job
+
+  def setuser(self, user):
+    pass
+
+  def cluster_status(self):
+    self.calls.append('cluster_status')
+    return ThriftClusterStatus(totalSubmissions=self.total_submissions)
+
+  def all_jobs(self):
+    # Like the JobTracker's, leaves out jobs being prepared
+    self.calls.append('all_jobs')
+    return ThriftJobList(jobs=[ self._thriftjob(job_id) for job_id in self.jobs
+                                if self.jobs[job_id][2] != 'PREP' ])
+
+  def _job_list(self, state):
+    return ThriftJobList(jobs=[ self._thriftjob(job_id) for job_id in self.jobs
+                                if self.jobs[job_id][2] == state ])
+
+  def running_jobs(self):
+    self.calls.append('running_jobs')
+    return self._job_list('RUNNING')
+
+  def completed_jobs(self):
+    self.calls.append('completed_jobs')
+    return self._job_list('SUCCEEDED')
+
+  def failed_jobs(self):
+    self.calls.append('failed_jobs')
+    return self._job_list('FAILED')
+
+  def killed_jobs(self):
+    self.calls.append('killed_jobs')
+    return self._job_list('KILLED')
+
+  def thriftjobid_from_string(self, job_id):
+    return ThriftJobID(asString=job_id)
+
+  def get_job(self, jobid):
+    self.calls.append('get_job')
+    if jobid.asString not in self.jobs:
+      raise JobNotFoundException()
+    job = self._thriftjob(jobid.asString)
+    job.tasks = ThriftTaskInProgressList(tasks=self.tasks.get(jobid.asString, []))
+    return job
+
+  def get_job_counter_rollups(self, jobid):
+    return self.getJobCounterRollups(None, jobid)
+
+  def getJobCounterRollups(self, ctx, jobid):
+    self.calls.append('getJobCounterRollups')
+    if jobid.asString not in self.counters:
+      raise JobNotFoundException()
+    return self.counters[jobid.asString]
+
+  def get_job_xml(self, jobid):
+    return self.getJobConfXML(None, jobid)
+
+  def getJobConfXML(self, ctx, jobid):
+    self.calls.append('getJobConfXML')
+    if jobid.asString not in self.confs:
+      raise IOException()
+    return '<configuration>%s</configuration>' % ''.join([
+      '<property><name>%s</name><value>%s</value></property>' % item
+      for item in self.confs[jobid.asString].iteritems() ])
+
+  def killJob(self, ctx, jobid):
+    self.calls.append('killJob')
+    if jobid.asString not in self.jobs:
+      raise JobNotFoundException()
+
+  def thrifttaskid_from_string(self, task_id):
+    return ThriftTaskID(asString=task_id)
+
+  def get_task(self, jobid, taskid):
+    self.calls.append('get_task')
+    for tip in self.tasks[jobid.asString]:
+      if tip.taskID.asString == taskid.asString:
+        return tip
+
+  def get_task_list(self, jobid, task_types, task_states, task_text, count, offset):
+    self.calls.append('get_task_list')
+    tips = [ tip for tip in self.tasks[jobid.asString]
+             if tip.taskID.taskTypeAsString.lower() in task_types and tip.state in task_states and
+                (not task_text or task_text.upper() in tip.taskID.asString.upper()) ]
+    return ThriftTaskInProgressList(tasks=tips[offset:offset + count], numTotalTasks=len(tips))
+
+
+def test_job_snapshot():
+  jt = FakeJobTracker()
+  jt.submit('job_201_0001', 'alice', 'default', 'SUCCEEDED')
+  jt.submit('job_201_0002', 'bob', 'research')
+  jt.submit('job_201_0003', 'alice', 'research', 'FAILED')
+  now = [ 1000 ]
+  snap = snapshot.JobSnapshot(jt, clock=lambda: now[0], background=False)
+
+  def ids(**kwargs):
+    return [ job.jobId for job in snap.get_jobs(**kwargs) ]
+
+  # The first read loads every job; newest first
+  assert_equal(['job_201_0003', 'job_201_0002', 'job_201_0001'], ids())
+  assert_equal(['cluster_status', 'all_jobs'], jt.calls)
+  assert_equal(['job_201_0002'], ids(state='running'))
+  assert_equal(['job_201_0001'], ids(state='completed'))
+  assert_equal(['job_201_0003', 'job_201_0001'], ids(user='ali'))
+  assert_equal(['job_201_0003'], ids(pools='res', state='failed'))
+  assert_equal(['job_201_0002'], ids(text='BOB'))
+  assert_equal(['job_201_0001'], ids(jobid_exact='job_201_0001'))
+  assert_equal([], ids(jobid_exact='job_201_0001', user='bob'))
+  assert_equal(dict(completed=1, running=0, failed=1, killed=0, all=2),
+               snap.count_by_state('alice'))
+  job = snap.get_jobs(jobid_exact='job_201_0002')[0]
+  assert_equal(50, job.maps_percent_complete)
+  assert_equal('0002', job['jobId_short'].split('_')[-1])
+
+  # Fresh enough: no calls
+  del jt.calls[:]
+  now[0] += snapshot.MAX_STALENESS
+  ids()
+  assert_equal([], jt.calls)
+
+  # Only the running jobs are refreshed; the ones that stopped running are
+  # looked for in the lists of finished jobs
+  jt.jobs['job_201_0002'] = ('bob', 'research', 'KILLED')
+  jt.submit('job_201_0004', 'carol', 'default')
+  now[0] += 1
+  assert_equal(['job_201_0004'], ids(state='running'))
+  assert_equal(['cluster_status', 'running_jobs', 'completed_jobs', 'failed_jobs', 'killed_jobs'],
+               jt.calls)
+  assert_equal(['job_201_0002'], ids(state='killed'))
+
+  # Without jobs stopping, only the running jobs are asked about
+  del jt.calls[:]
+  snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs'], jt.calls)
+
+  # A job submitted and finished between two refreshes is looked for once
+  # it is missing from the running jobs for a second refresh
+  jt.submit('job_201_0005', 'dave', 'default', 'SUCCEEDED')
+  del jt.calls[:]
+  snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs'], jt.calls)
+  del jt.calls[:]
+  snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs', 'completed_jobs'], jt.calls)
+  assert_equal(['job_201_0005'], ids(user='dave'))
+  del jt.calls[:]
+  snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs'], jt.calls)
+
+  # Jobs being prepared are in no job list: they are looked for once
+  jt.submit('job_201_0006', 'erin', 'default', 'PREP')
+  del jt.calls[:]
+  for i in range(3):
+    snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs'] * 2 +
+               ['completed_jobs', 'failed_jobs', 'killed_jobs'] +
+               ['cluster_status', 'running_jobs'], jt.calls)
+  jt.jobs['job_201_0006'] = ('erin', 'default', 'RUNNING')
+  del jt.calls[:]
+  snap.refresh()
+  assert_equal(['cluster_status', 'running_jobs'], jt.calls)
+  assert_equal(['job_201_0006'], ids(user='erin'))
+  assert_equal(0, snap._unseen)
+
+  # Jobs the JobTracker retired while running are dropped, with their index entries
+  del jt.calls[:]
+  del jt.jobs['job_201_0004']
+  now[0] += snapshot.MAX_STALENESS + 1
+  assert_equal([], ids(user='carol'))
+  assert_equal(['cluster_status', 'running_jobs', 'completed_jobs', 'failed_jobs', 'killed_jobs',
+                'cluster_status', 'all_jobs'], jt.calls)
+  assert_false('carol' in snap._by_user)
+
+
+def test_job_tasks():
+  jt = FakeJobTracker()
+  jt.submit('job_201_0001', 'alice', 'default', 'SUCCEEDED')
+  jt.add_task('job_201_0001', 'map', 'succeeded', 10)
+  m1 = jt.add_task('job_201_0001', 'map', 'failed', 20)
+  m2 = jt.add_task('job_201_0001', 'map', 'failed', 5)
+  m3 = jt.add_task('job_201_0001', 'map', 'succeeded', 40)
+  r0 = jt.add_task('job_201_0001', 'reduce', 'succeeded', 30)
+  jt.submit('job_201_0002', 'bob', 'default')
+  snapshot._snapshots[(jt.host, jt.thrift_port)] = snapshot.JobSnapshot(jt, background=False)
+  try:
+    _check_job_tasks(jt, m1, m2, m3, r0)
+  finally:
+    snapshot.clear()
+
+
+def _check_job_tasks(jt, m1, m2, m3, r0):
+  def task_ids(tasks):
+    return [ task.taskId for task in tasks ]
+
+  # The job comes from the job snapshot, without its tasks
+  job = models.Job.from_id(jt, 'job_201_0001')
+  assert_true(job.job.tasks is None)
+  assert_equal(['cluster_status', 'all_jobs'], jt.calls)
+
+  # The JobTracker filters the tasks
+  del jt.calls[:]
+  assert_equal([m2, m1], task_ids(job.latest_tasks(set(['failed']), 5, reverse=False)))
+  assert_equal([m3, r0], task_ids(job.latest_tasks(set(['running', 'succeeded']), 2)))
+  assert_equal([r0], task_ids(job.filter_tasks(task_types=set(['reduce']))))
+  assert_equal([m1], task_ids(job.filter_tasks(task_text='M_000001')))
+  assert_equal([], job.filter_tasks(task_states=set(['killed'])))
+  assert_equal(['get_task_list'] * 5, jt.calls)
+  assert_equal(m3, job.get_task(m3).taskId)
+  assert_equal(5, len(job.tasks))
+
+  # Only the last tasks in the JobTracker's order are ordered
+  orig_batch_size = models.TASK_BATCH_SIZE
+  models.TASK_BATCH_SIZE = 2
+  try:
+    del jt.calls[:]
+    assert_equal([m3, r0], task_ids(job.latest_tasks(set(['succeeded']), 5)))
+    assert_equal(['get_task_list', 'get_task_list'], jt.calls)
+    assert_equal(5, len(models.Job.from_id(jt, 'job_201_0001').filter_tasks()))
+  finally:
+    models.TASK_BATCH_SIZE = orig_batch_size
+
+  # So do running jobs
+  del jt.calls[:]
+  job = models.Job.from_id(jt, 'job_201_0002')
+  assert_equal('RUNNING', job.status)
+  assert_equal([], jt.calls)
+
+  # Jobs started since the last refresh are found by refreshing
+  jt.submit('job_201_0003', 'carol', 'default')
+  job = models.Job.from_id(jt, 'job_201_0003')
+  assert_equal('RUNNING', job.status)
+  assert_equal(['cluster_status', 'running_jobs'], jt.calls)
+
+  # Jobs being prepared are in no job list
+  del jt.calls[:]
+  jt.submit('job_201_0004', 'carol', 'default', 'PREP')
+  job = models.Job.from_id(jt, 'job_201_0004')
+  assert_equal('PREP', job.status)
+  assert_equal(['cluster_status', 'running_jobs', 'get_job'], jt.calls)
+  assert_true(job.job.tasks is None)
+
+
+def _group_list(group, counters):
+  """A ThriftGroupList of one group, from a dict of counter values."""
+  return ThriftGroupList(groups=[ ThriftCounterGroup(name=group, displayName=group.title(), counters=dict(
+    [ (name, ThriftCounter(name=name, displayName=name.lower(), value=value))
+      for name, value in counters.iteritems() ])) ])
+
+
+def test_counter_store():
+  jt = FakeJobTracker()
+  jt.submit('job_201_0001', 'alice', 'default', 'SUCCEEDED')
+  jt.submit('job_201_0002', 'alice', 'default')
+  jt.counters['job_201_0001'] = ThriftJobCounterRollups(
+    mapCounters=_group_list('FS', dict(BYTES_READ=10, BYTES_WRITTEN=2 ** 40)),
+    reduceCounters=_group_list('FS', dict(BYTES_WRITTEN=3)),
+    jobCounters=_group_list('JOB', dict(LAUNCHED_MAPS=1)))
+  jt.counters['job_201_0002'] = ThriftJobCounterRollups(
+    mapCounters=_group_list('FS', dict(BYTES_READ=7)),
+    reduceCounters=ThriftGroupList(groups=[]), jobCounters=ThriftGroupList(groups=[]))
+  store = counter_store.CounterStore()
+
+  # As the nested dicts Job.counters used to build
+  counters = store.get(jt, 'job_201_0001', True)
+  assert_equal({
+    'FS': { 'name': 'FS', 'displayName': 'Fs', 'counters': {
+      'BYTES_READ': { 'name': 'BYTES_READ', 'displayName': 'bytes_read', 'map': 10 },
+      'BYTES_WRITTEN': { 'name': 'BYTES_WRITTEN', 'displayName': 'bytes_written',
+                         'map': 2 ** 40, 'reduce': 3 } } },
+    'JOB': { 'name': 'JOB', 'displayName': 'Job', 'counters': {
+      'LAUNCHED_MAPS': { 'name': 'LAUNCHED_MAPS', 'displayName': 'launched_maps', 'total': 1 } } },
+  }, counters.to_dict(store.catalog))
+  group_list = counters.to_group_list(store.catalog, 'map')
+  assert_equal(['FS'], [ group.name for group in group_list.groups ])
+  assert_equal(10, group_list.groups[0].counters['BYTES_READ'].value)
+
+  # Finished jobs are kept; running ones fetched again
+  store.get(jt, 'job_201_0001', True)
+  store.get(jt, 'job_201_0002', False)
+  store.get(jt, 'job_201_0002', False)
+  assert_equal(['getJobCounterRollups'] * 3, jt.calls)
+
+  # Comparing fetches only what isn't kept
+  del jt.calls[:]
+  jobs = [ ('job_201_0002', False), ('job_201_0001', True), ('job_201_0003', True) ]
+  assert_equal([ ('job_201_0002', dict(map=7)), ('job_201_0001', dict(map=10)), ('job_201_0003', None) ],
+               store.compare(jt, jobs, 'FS', 'BYTES_READ'))
+  assert_equal(['getJobCounterRollups'] * 2, jt.calls)
+  assert_equal([ ('job_201_0002', None), ('job_201_0001', None), ('job_201_0003', None) ],
+               store.compare(jt, jobs, 'FS', 'NO_SUCH_COUNTER'))
+
+
+def test_conf_store():
+  jt = FakeJobTracker()
+  for i, reduces in enumerate(['1', '10', '20', 'lots', '5']):
+    jt.confs['job_201_000%d' % i] = { 'mapred.reduce.tasks': reduces, 'user.name': 'alice' }
+  store = conf_store.ConfStore()
+
+  # Parsed once
+  jobconf = store.get(jt, 'job_201_0001')
+  assert_equal('10', jobconf['mapred.reduce.tasks'])
+  assert_equal([ ('mapred.reduce.tasks', '10'), ('user.name', 'alice') ], jobconf.items())
+  assert_equal(None, jobconf.get('mapred.map.tasks'))
+  assert_false('mapred.map.tasks' in jobconf)
+  assert_true(store.get(jt, 'job_201_0001') is jobconf)
+  assert_equal(['getJobConfXML'], jt.calls)
+  # Shared values are stored once
+  assert_true(store.get(jt, 'job_201_0001')['user.name'] is
+              store.get(jt, 'job_201_0002')['user.name'])
+
+  # Searches only see the kept configurations
+  assert_equal(['job_201_0002'], store.find(jt, 'mapred.reduce.tasks', 'gt', '10'))
+  del jt.calls[:]
+  store.load_many(jt, [ 'job_201_000%d' % i for i in range(6) ])
+  assert_equal(['getJobConfXML'] * 4, jt.calls)
+
+  # Numbers compare as numbers, other values as strings
+  def find(op, value):
+    res = store.find(jt, 'mapred.reduce.tasks', op, value)
+    res.sort()
+    return res
+  assert_equal(['job_201_0001', 'job_201_0002'], find('gt', '9'))
+  assert_equal(['job_201_0002'], find('gte', '20'))
+  assert_equal(['job_201_0000'], find('lt', '5'))
+  assert_equal(['job_201_0000', 'job_201_0004'], find('lte', '5.0'))
+  assert_equal(['job_201_0003'], find('eq', 'lots'))
+  assert_equal([], find('eq', '7'))
+  assert_equal([], store.find(jt, 'no.such.key', 'eq', '1'))
+
+  # Other JobTrackers' jobs are left out
+  other = FakeJobTracker()
+  other.thrift_port += 1
+  assert_equal([], store.find(other, 'mapred.reduce.tasks', 'eq', 'lots'))
+
+
+def test_kill_watcher():
+  jt = FakeJobTracker()
+  for i, user in enumerate(['alice', 'bob', 'bob']):
+    jt.submit('job_201_000%d' % (i + 1,), user, 'default')
+  now = [ 1000.0 ]
+  watcher = kill_watcher.KillWatcher(jt, clock=lambda: now[0], background=False)
+  try:
+    # Kills are requested at once, and pending until the jobs stop running
+    statuses = watcher.kill([ 'job_201_0001', 'job_201_0002', 'job_201_0003', 'job_201_0009' ])
+    assert_equal(['killJob'] * 4, jt.calls)
+    assert_equal([ kill_watcher.KILLING ] * 3 + [ kill_watcher.FAILED ],
+                 [ status.state for status in statuses ])
+    assert_equal(kill_watcher.FAILED, watcher.get_status('job_201_0009').state)
+    watcher.check()
+    assert_equal(set([ 'job_201_0001', 'job_201_0002', 'job_201_0003' ]), watcher.pending())
+
+    # One got killed, one was over before it could be
+    jt.jobs['job_201_0001'] = ('alice', 'default', 'KILLED')
+    jt.jobs['job_201_0002'] = ('bob', 'default', 'SUCCEEDED')
+    watcher.check()
+    assert_equal(kill_watcher.KILLED, watcher.get_status('job_201_0001').state)
+    assert_equal(kill_watcher.FINISHED, watcher.get_status('job_201_0002').state)
+    assert_equal(set([ 'job_201_0003' ]), watcher.pending())
+    # The job lists know
+    assert_equal(['job_201_0001'], [ job.jobId for job in snapshot.get_snapshot(jt).get_jobs(state='killed') ])
+
+    # Jobs in neither job list are asked about
+    jt.submit('job_201_0004', 'bob', 'default', 'PREP')
+    watcher.kill([ 'job_201_0004' ])
+    del jt.calls[:]
+    watcher.check()
+    assert_true('get_job' in jt.calls)
+    assert_true(watcher.get_status('job_201_0004').is_pending)
+    jt.jobs['job_201_0004'] = ('bob', 'default', 'KILLED')
+    watcher.check()
+    assert_equal(kill_watcher.KILLED, watcher.get_status('job_201_0004').state)
+
+    # Jobs that keep running weren't killed
+    now[0] += kill_watcher.KILL_TIMEOUT + 1
+    watcher.check()
+    assert_equal(kill_watcher.FAILED, watcher.get_status('job_201_0003').state)
+    assert_equal(set(), watcher.pending())
+    assert_equal(None, watcher.get_status('job_201_0005'))
+  finally:
+    snapshot.clear()
+
+
+class FakeTaskLogServlet(object):
+  """Serves byte ranges of logs like the TaskTracker's /tasklog."""
+  def __init__(self, logs):
+    self.logs = logs
+    self.urls = []
+
+  def urlopen(self, url):
+    self.urls.append(url)
+    params = cgi.parse_qs(urlparse.urlparse(url)[4])
+    log = self.logs[params['filter'][0]]
+    start, end = int(params['start'][0]), int(params['end'][0])
+    if start < 0:
+      start += len(log) + 1
+    if end < 0:
+      end += len(log) + 1
+    return StringIO.StringIO(log[max(start, 0):max(end, 0)])
+
+
+def test_task_attempt_log():
+  status = ThriftTaskStatus(
+    taskID=ThriftTaskAttemptID(taskID=ThriftTaskID(), asString='attempt_201_0001_m_000000_0'),
+    taskTracker='tracker_1')
+  status.taskID.taskID.taskTypeAsString = 'MAP'
+  status.stateAsString = 'SUCCEEDED'
+  status.phaseAsString = 'CLEANUP'
+  attempt = models.TaskAttempt(status, task=None)
+  attempt._tracker = models.Tracker.__new__(models.Tracker)
+  attempt._tracker.host, attempt._tracker.httpPort = 'tt1', 50060
+  line = 'x' * 99 + '\n'
+  servlet = FakeTaskLogServlet({
+    'stdout': '',
+    'stderr': 'oops\n',
+    'syslog': ''.join([ line ] * ((models.LOG_CHUNK_SIZE * 5 / 2) / 100)),
+  })
+  syslog = servlet.logs['syslog']
+  models._log_ranges.clear()
+  urlopen = models.urllib2.urlopen
+  models.urllib2.urlopen = servlet.urlopen
+  try:
+    assert_equal([u'', u'oops\n', syslog[-models.LOG_CHUNK_SIZE:][models.LOG_CHUNK_SIZE % 100:]],
+                 attempt.get_task_log())
+    assert_true('filter=stderr' in servlet.urls[1])
+    assert_true(servlet.urls[1].startswith('http://tt1:50060/tasklog?'))
+
+    # The end of the log first, starting with a full line
+    text, complete = attempt.get_task_log_tail('syslog', 2)
+    assert_false(complete)
+    assert_true(text.startswith(line) and syslog.endswith(text))
+    assert_equal((syslog, True), attempt.get_task_log_tail('syslog', 3))
+    assert_equal((syslog, True), attempt.get_task_log_tail('syslog', 4))
+
+    # The logs of finished attempts are kept
+    del servlet.urls[:]
+    attempt.get_task_log_tail('syslog', 3)
+    assert_equal([], servlet.urls)
+    attempt.state = 'running'
+    attempt.get_task_log_tail('syslog', 3)
+    assert_equal(3, len(servlet.urls))
+
+    # Downloads go through the whole log, a chunk at a time
+    assert_equal(syslog, ''.join(attempt.iter_task_log('syslog')))
+    assert_equal('', ''.join(attempt.iter_task_log('stdout')))
+  finally:
+    models.urllib2.urlopen = urlopen
+    models._log_ranges.clear()
+
+
 def get_hadoop_job_id(jobsubd, jobsub_id):
   handle = SubmissionHandle(id=jobsub_id)
   job_data = jobsubd.client.get_job_data(handle)
@@ -80,6 +583,7 @@ class TestJobBrowserWithHadoop(object):
 
   @classmethod
   def teardown_class(cls):
+    snapshot.clear()
     cls.jobsubd.exit()
     cls.cluster.shutdown()
 
@@ -129,6 +633,7 @@ class TestJobBrowserWithHadoop(object):
     assert_true('failed task' in html)
 
     # Select only failed jobs (should be present)
+    snapshot.get_snapshot(self.cluster.jt).refresh()
     response = self.client.get('/jobbrowser/jobs/?state=failed')
     assert_true(hadoop_job_id in response.content)
 
@@ -175,6 +680,7 @@ class TestJobBrowserWithHadoop(object):
     hadoop_job_id = get_hadoop_job_id(self.jobsubd, job_id)
 
     # All jobs page
+    snapshot.get_snapshot(self.cluster.jt).refresh()
     response = self.client.get('/jobbrowser/jobs/')
     assert_true(hadoop_job_id.lstrip('job_') in response.content)
 
@@ -201,6 +707,17 @@ class TestJobBrowserWithHadoop(object):
     assert_true(response.context['job'].counters['org.apache.hadoop.mapred.JobInProgress$Counter']['counters']['SLOTS_MILLIS_MAPS']['total'] > 0)
     assert_true(response.context['job'].counters['org.apache.hadoop.mapred.JobInProgress$Counter']['counters']['SLOTS_MILLIS_REDUCES']['total'] > 0)
 
+    # Compare a counter across runs
+    response = self.client.get('/jobbrowser/jobs/counters/compare?group=FileSystemCounters'
+                               '&counter=FILE_BYTES_WRITTEN&jobs=%s' % (hadoop_job_id,))
+    assert_equal([ (hadoop_job_id, dict(map=44L, reduce=12L)) ],
+                 [ (job_id, values) for job_id, job, values in response.context['rows'] ])
+
+    # Search jobs by configuration
+    response = self.client.get('/jobbrowser/jobs/conf/search?key=mapred.reducer.class'
+                               '&value=org.apache.hadoop.examples.SleepJob')
+    assert_true(hadoop_job_id in [ job.jobId for job, value in response.context['rows'] ])
+
     # Check conf keys made it
     assert_equal(response.context['job'].conf_keys['mapredReducerClass'],
                  'org.apache.hadoop.examples.SleepJob')
@@ -233,9 +750,15 @@ class TestJobBrowserWithHadoop(object):
     assert_equal("Permission denied.  User test_non_superuser cannot delete user test's job.",
       response.context["error"])
 
-    self.client.post('/jobbrowser/jobs/%s/kill' % (hadoop_job_id,))
-
-  
+    response = self.client.post('/jobbrowser/jobs/%s/kill' % (hadoop_job_id,))
+    assert_equal(302, response.status_code)
+    # The kill is watched in the background
+    for i in range(30):
+      response = self.client.get('/jobbrowser/jobs/kill/status?format=json&jobs=%s' % (hadoop_job_id,))
+      if 'killing' not in response.content:
+        break
+      time.sleep(1)
+    assert_true('"killed"' in response.content, response.content)
 
     # It should say killed
     response = self.client.get('/jobbrowser/jobs/%s' % (hadoop_job_id,))
@@ -266,6 +789,9 @@ class TestJobBrowserWithHadoop(object):
     response = self.client.get('/jobbrowser/jobs/%s/tasks/%s/attempts/%s' %
                           (hadoop_job_id, early_task_id, attempt_id))
     assert_true('syslog' in response.content)
+    response = self.client.get('/jobbrowser/jobs/%s/tasks/%s/attempts/%s/logs/syslog' %
+                          (hadoop_job_id, early_task_id, attempt_id))
+    assert_true(response['Content-Disposition'].endswith('%s.syslog.log' % (attempt_id,)))
 
     # Test dock jobs
     response = self.client.get('/jobbrowser/dock_jobs/')
@@ -24,6 +24,10 @@ urlpatterns = patterns('jobbrowser.views',
   url(r'^trackers/(?P<trackerid>.+)$','single_tracker',name='single_tracker'),
   url(r'^jobs/$','jobs',name='jobs'),
   url(r'^dock_jobs/$','dock_jobs',name='dock_jobs'),
+  url(r'^jobs/kill$','kill_jobs',name='kill_jobs'),
+  url(r'^jobs/kill/status$','kill_status',name='kill_status'),
+  url(r'^jobs/counters/compare$','compare_counters',name='compare_counters'),
+  url(r'^jobs/conf/search$','search_conf',name='search_conf'),
   url(r'^jobs/(?P<jobid>\w+)$','single_job',name='single_job'),
   url(r'^jobs/(?P<jobid>\w+)/counters$','job_counters',name='job_counters'),
   url(r'^jobs/(?P<jobid>\w+)/kill$','kill_job',name='kill_job'),
@@ -34,6 +38,8 @@ urlpatterns = patterns('jobbrowser.views',
       'single_task_attempt',name='single_task_attempt'),
   url(r'^jobs/(?P<jobid>\w+)/tasks/(?P<taskid>\w+)/attempts/(?P<attemptid>\w+)/counters$',
       'task_attempt_counters',name='task_attempt_counters'),
+  url(r'^jobs/(?P<jobid>\w+)/tasks/(?P<taskid>\w+)/attempts/(?P<attemptid>\w+)/logs/(?P<name>stdout|stderr|syslog)$',
+      'task_attempt_log',name='task_attempt_log'),
   url(r'^jobs/(\w+)/tasks/(\w+)/attempts/(?P<attemptid>\w+)/kill$',
       'kill_task_attempt',name='kill_task_attempt'),
   url(r'^clusterstatus$', 'clusterstatus',name='clusterstatus'),
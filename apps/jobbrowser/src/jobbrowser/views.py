@@ -18,7 +18,6 @@
 # Implements simple jobbrowser api
 #
 import re
-import time
 import logging
 import string
 from urllib import quote_plus
@@ -26,18 +25,26 @@ from urllib import quote_plus
 from desktop.lib.paginator import Paginator
 from desktop.lib.django_util import render_json, MessageException, render
 from desktop.lib.django_util import copy_query_dict
-from django.http import HttpResponseRedirect
+from django.core import urlresolvers
+from django.http import HttpResponse, HttpResponseRedirect, QueryDict
 
 from desktop.log.access import access_warn, access_log_level
 from desktop.views import register_status_bar_view
 from hadoop.api.jobtracker.ttypes import ThriftJobPriority
 
-from jobbrowser.models import Job, JobLinkage, TaskList, Tracker, Cluster
+from jobbrowser import conf_store, counter_store, kill_watcher, snapshot
+from jobbrowser.models import Job, JobLinkage, TaskList, Tracker, Cluster, LOG_NAMES
 
 ##################################
 ## View end-points
 
 __DEFAULT_OBJ_PER_PAGINATION = 10
+__JOBS_PER_PAGE = 100
+__MAX_COMPARED_JOBS = 100
+__MAX_SEARCHED_JOBS = 500
+__MAX_KILLED_JOBS = 100
+# Chunks of a task attempt log shown at most, see models.LOG_CHUNK_SIZE
+__MAX_LOG_CHUNKS = 64
 
 def single_job(request, jobid):
   """
@@ -45,19 +52,14 @@ def single_job(request, jobid):
   """
   job = Job.from_id(jt=request.jt, jobid=jobid)
 
-  def cmp_exec_time(foo, bar):
-    return cmp(foo.execStartTimeMs, bar.execStartTimeMs)
-
-  failed_tasks = job.filter_tasks(task_states=set(['failed']))
-  failed_tasks.sort(cmp_exec_time)
-  recent_tasks = job.filter_tasks(task_states=set(['running', 'succeeded']))
-  recent_tasks.sort(cmp_exec_time, reverse=True)
+  failed_tasks = job.latest_tasks(set(['failed']), 5, reverse=False)
+  recent_tasks = job.latest_tasks(set(['running', 'succeeded']), 5)
 
   return render("job.mako", request, {
     'request': request,
     'job': job,
-    'failed_tasks': failed_tasks[:5],
-    'recent_tasks': recent_tasks[:5]
+    'failed_tasks': failed_tasks,
+    'recent_tasks': recent_tasks
   })
 
 def job_counters(request, jobid):
@@ -69,14 +71,32 @@ def job_counters(request, jobid):
 
 def jobs(request):
   """
-  We get here from /jobs?filterargs
+  We get here from /jobs?filterargs, with the options being:
+    page=<n>            - Controls pagination. Defaults to 1.
+    state=<state>       - One of snapshot.STATE_FILTERS
+    user=<user>         - Where <user> is a substring of the job's user
+    text=<text>         - Where <text> is a string matching info on the job
   """
   matching_jobs = sort_if_necessary(request, get_matching_jobs(request))
   state = request.GET.get('state', 'all')
   user = request.GET.get('user', '')
   text = request.GET.get('text', '')
+
+  try:
+    pagenum = int(request.GET.get('page', 1))
+  except ValueError:
+    pagenum = 1
+  paginator = Paginator(matching_jobs, __JOBS_PER_PAGE)
+  page = paginator.page(min(max(pagenum, 1), paginator.num_pages))
+
+  # We need to pass the parameters back to the template to generate links
+  filter_params = copy_query_dict(
+        request.GET, ('state', 'user', 'text', 'sortkey', 'sortrev')).urlencode()
+
   return render("jobs.mako", request, {
-    'jobs':matching_jobs,
+    'jobs': page.object_list,
+    'page': page,
+    'filter_params': filter_params,
     'request': request,
     'state_filter': state,
     'user_filter': user,
@@ -93,33 +113,89 @@ def dock_jobs(request):
 register_status_bar_view(dock_jobs)
 
 
+def _check_kill_permission(request, job_ids):
+  """Raises unless the user may kill every one of the jobs."""
+  if request.user.is_superuser:
+    return
+  jobs = snapshot.get_snapshot(request.jt)
+  for job_id in job_ids:
+    records = jobs.get_jobs(jobid_exact=job_id)
+    if records:
+      user = records[0].user
+    else:
+      # Too new for the snapshot
+      user = Job.from_id(jt=request.jt, jobid=job_id).user
+    if user != request.user.username:
+      access_warn(request, 'Insufficient permission')
+      raise MessageException("Permission denied.  User %s cannot delete user %s's job." %
+                             (request.user.username, user))
+
+def _kill_status_redirect(request, job_ids):
+  params = QueryDict('', mutable=True)
+  params['jobs'] = ','.join(job_ids)
+  if request.REQUEST.get("next"):
+    params['next'] = request.REQUEST.get("next")
+  return HttpResponseRedirect("%s?%s" % (urlresolvers.reverse('jobbrowser.views.kill_status'), params.urlencode()))
+
 @access_log_level(logging.WARN)
 def kill_job(request, jobid):
   """
   We get here from /jobs/jobid/kill
+
+  The kill is requested, and is watched in the background; this redirects
+  to its status.
   """
   if request.method != "POST":
     raise Exception("kill_job may only be invoked with a POST (got a %s)" % request.method)
-  job = Job.from_id(jt=request.jt, jobid=jobid)
-  if job.user != request.user.username and not request.user.is_superuser:
-    access_warn(request, 'Insufficient permission')
-    raise MessageException("Permission denied.  User %s cannot delete user %s's job." %
-                           (request.user.username, job.user))
-
-  job.kill()
-  cur_time = time.time()
-  while time.time() - cur_time < 15:
-    job = Job.from_id(jt=request.jt, jobid=jobid)
-
-    if job.status not in ["RUNNING", "QUEUED"]:
-      if request.REQUEST.get("next"):
-        return HttpResponseRedirect(request.REQUEST.get("next"))
-      else:
-        raise MessageException("Job Killed")
-    time.sleep(1)
-    job = Job.from_id(jt=request.jt, jobid=jobid)
-
-  raise Exception("Job did not appear as killed within 15 seconds")
+  _check_kill_permission(request, [ jobid ])
+  kill_watcher.get_watcher(request.jt).kill([ jobid ])
+  return _kill_status_redirect(request, [ jobid ])
+
+@access_log_level(logging.WARN)
+def kill_jobs(request):
+  """
+  We get here from /jobs/kill, with
+    jobs=<id>,<id>,...  - The jobs to kill, at most __MAX_KILLED_JOBS.
+
+  The kills are requested a few at a time, and watched in the background;
+  this redirects to their status.
+  """
+  if request.method != "POST":
+    raise Exception("kill_jobs may only be invoked with a POST (got a %s)" % request.method)
+  job_ids = [ job_id.strip() for job_id in request.POST.get('jobs', '').split(',') if job_id.strip() ]
+  if not job_ids:
+    raise MessageException("Pick the jobs to kill.")
+  if len(job_ids) > __MAX_KILLED_JOBS:
+    raise MessageException("Cannot kill more than %d jobs at once." % (__MAX_KILLED_JOBS,))
+  _check_kill_permission(request, job_ids)
+  kill_watcher.get_watcher(request.jt).kill(job_ids)
+  return _kill_status_redirect(request, job_ids)
+
+def kill_status(request):
+  """
+  We get here from /jobs/kill/status?jobs=<id>,<id>,..., after killing jobs.
+
+  Shows how their kills went, and refreshes itself while any is pending.
+  Once none is, it redirects to next=<url>, if given. format=json has the
+  statuses as JSON.
+  """
+  job_ids = [ job_id.strip() for job_id in request.GET.get('jobs', '').split(',') if job_id.strip() ]
+  watcher = kill_watcher.get_watcher(request.jt)
+  statuses = []
+  for job_id in job_ids[:__MAX_KILLED_JOBS]:
+    status = watcher.get_status(job_id)
+    if status is None:
+      status = kill_watcher.KillStatus(job_id, None, state=None, message='No kill of this job is known.')
+    statuses.append(status)
+
+  pending = [ status for status in statuses if status.is_pending ]
+  if not pending and request.GET.get("next") and not request.ajax:
+    return HttpResponseRedirect(request.GET.get("next"))
+  return render("kill_status.mako", request, {
+    'statuses': statuses,
+    'pending': pending,
+    'params': request.GET.urlencode(),
+  }, json=[ status.to_dict() for status in statuses ])
 
 def tasks(request, jobid):
   """
@@ -196,7 +272,23 @@ def single_task_attempt(request, jobid, taskid, attemptid):
   except KeyError:
     raise KeyError("Cannot find attempt '%s' in task" % (attemptid,))
 
-  logs = [ section.strip() for section in attempt.get_task_log() ]
+  # The end of each log is shown; <log>_chunks=n shows n chunks of it
+  chunk_params = [ name + '_chunks' for name in LOG_NAMES ]
+  logs = []
+  for name in LOG_NAMES:
+    try:
+      chunks = min(max(int(request.GET.get(name + '_chunks', 1)), 1), __MAX_LOG_CHUNKS)
+    except ValueError:
+      chunks = 1
+    text, complete = attempt.get_task_log_tail(name, chunks)
+    more_params = copy_query_dict(request.GET, chunk_params)
+    more_params[name + '_chunks'] = chunks + 1
+    logs.append({
+      'name': name,
+      'text': text.strip(),
+      'complete': complete or chunks >= __MAX_LOG_CHUNKS,
+      'more_params': more_params.urlencode(),
+    })
   return render("attempt.mako", request,
     {
       "attempt":attempt,
@@ -206,19 +298,108 @@ def single_task_attempt(request, jobid, taskid, attemptid):
       "logs": logs
     })
 
+def task_attempt_log(request, jobid, taskid, attemptid, name):
+  """
+  We get here from /jobs/jobid/tasks/taskid/attempts/attemptid/logs/name
+
+  Downloads the whole log, streamed from the TaskTracker a chunk at a time.
+  """
+  job_link = JobLinkage(request.jt, jobid)
+  task = job_link.get_task(taskid)
+  try:
+    attempt = task.get_attempt(attemptid)
+  except KeyError:
+    raise KeyError("Cannot find attempt '%s' in task" % (attemptid,))
+
+  response = HttpResponse(attempt.iter_task_log(name), mimetype='text/plain')
+  response['Content-Disposition'] = 'attachment; filename=%s.%s.log' % (attemptid, name)
+  return response
+
 def task_attempt_counters(request, jobid, taskid, attemptid):
   """
   We get here from /jobs/jobid/tasks/taskid/attempts/attemptid/counters
   (phew!)
   """
+  store = counter_store.get_store()
+  kept = store.get_attempt(attemptid)
+  if kept is not None:
+    return render("counters.html", request, {'counters': kept.to_group_list(store.catalog)})
+
   job_link = JobLinkage(request.jt, jobid)
   task = job_link.get_task(taskid)
   attempt = task.get_attempt(attemptid)
   counters = {}
   if attempt:
     counters = attempt.counters
+    if counters is not None and attempt.state in ('succeeded', 'failed', 'killed'):
+      store.put_attempt(attemptid, counters)
   return render("counters.html", request, {'counters':counters})
 
+def compare_counters(request):
+  """
+  We get here from /jobs/counters/compare?group=<group>&counter=<counter>, and either
+    jobs=<id>,<id>,...  - The jobs to compare
+    name=<name>         - All the jobs with that name (the runs of one design)
+
+  Counters of finished jobs come from the counter store; the others are
+  fetched a few at a time, in parallel.
+  """
+  group = request.GET.get('group')
+  counter = request.GET.get('counter')
+  if not group or not counter:
+    raise MessageException("Pick the counter group and the counter to compare.")
+
+  records = dict([ (job.jobId, job) for job in snapshot.get_snapshot(request.jt).get_jobs() ])
+  if request.GET.get('jobs'):
+    job_ids = [ job_id.strip() for job_id in request.GET['jobs'].split(',') if job_id.strip() ]
+  else:
+    name = request.GET.get('name')
+    job_ids = [ job_id for job_id, job in records.iteritems() if job.jobName == name ]
+    job_ids.sort(reverse=True)
+  job_ids = job_ids[:__MAX_COMPARED_JOBS]
+
+  jobs = []
+  for job_id in job_ids:
+    job = records.get(job_id)
+    jobs.append((job_id, job is not None and not job.is_running))
+
+  values = counter_store.get_store().compare(request.jt, jobs, group, counter)
+  return render("counter_comparison.mako", request, {
+    'group': group,
+    'counter': counter,
+    'rows': [ (job_id, records.get(job_id), job_values) for job_id, job_values in values ],
+  })
+
+def search_conf(request):
+  """
+  We get here from /jobs/conf/search?key=<key>&op=<op>&value=<value>, with
+    op=<op>             - One of conf_store.OPERATORS ("eq", "gt", "gte", "lt", "lte").
+                          Defaults to "eq". Numbers compare as numbers.
+  and the filter arguments of /jobs (state, user, text) to narrow the jobs searched.
+
+  The configurations of the newest matching jobs are fetched once, and
+  searched in the conf store from then on.
+  """
+  key = request.GET.get('key')
+  op = request.GET.get('op', 'eq')
+  value = request.GET.get('value')
+  if not key or value is None:
+    raise MessageException("Pick the configuration key and the value to search for.")
+  if op not in conf_store.OPERATORS:
+    raise MessageException("Unknown comparison: %s" % (op,))
+
+  records = get_matching_jobs(request)[:__MAX_SEARCHED_JOBS]
+  store = conf_store.get_store()
+  store.load_many(request.jt, [ job.jobId for job in records ])
+  found = set(store.find(request.jt, key, op, value))
+  jobs = [ job for job in records if job.jobId in found ]
+  return render("conf_search.mako", request, {
+    'key': key,
+    'op': op,
+    'value': value,
+    'rows': [ (job, store.get(request.jt, job.jobId).get(key)) for job in jobs ],
+  })
+
 @access_log_level(logging.WARN)
 def kill_task_attempt(request, attemptid):
   """
@@ -335,73 +516,15 @@ def get_state_link(request, option=None, val='',
   return "&".join([ "%s=%s" % (key, quote_plus(value)) for key, value in states.iteritems() ])
 
 
-def _filter_jobs_by_req(joblist, request, **kwargs):
-  """
-  Unpacks filter arguments from the request object and optional
-  keyword arguments, and supplies the resulting filter to _filter_jobs.
-  """
-  args = {}
-  for x in ["jobid_exact", "jobid_substr", "pools", "user", "tasks", "text"]:
-    if x in kwargs:
-      args[x] = kwargs[x]
-    else:
-      args[x] = request.GET.get(x)
-  return _filter_jobs(joblist, **args)
-
-
-def _filter_jobs(jobs, jobid_exact=None, jobid_substr=None, pools=None, user=None, tasks=None, text=None):
-  # TODO(henry): this naive version can be replaced with something
-  # more flexible. (i.e. use getattr with a dict of values, check
-  # the type and do the right kind of test)
-  """
-  Return the set in jobs that match the supplied parameters (any of which may be
-  None). If jobid is supplied will only return exact id matches if exactid = True.
-
-  All other parameters are substring matched.
-  """
-  def predicate(job):
-    """
-    Return True if a ThriftJobInProgress structure matches the supplied filters.
-
-    If a filter argument is None, everything matches it.
-    """
-    if jobid_exact and jobid_exact != job.jobID.asString:
-      return False
-    if jobid_substr and jobid_substr not in job.jobID.asString:
-      return False
-    if pools and pools not in job.profile.queueName:
-      return False
-    if user and user not in job.profile.user:
-      return False
-    if tasks and not True: # TODO: figure out what Nutron wants to happen here
-      return False
-    if text:
-      search = text.lower()
-      # These fields are chosen to match those displayed by the JT UI
-      saw_text = False
-      for t in [job.profile.user,
-                job.profile.name,
-                job.jobID.asString,
-                job.profile.queueName,
-                job.priorityAsString
-                ]:
-        if search in t.lower():
-          saw_text = True
-          break
-      if not saw_text:
-        return False
-    return True
-
-  return filter(predicate, jobs)
-
 ##################################
 ## Task trackers
 
 def get_tasktrackers(request):
   """
-  Return a ThriftTaskTrackerStatusList object containing all task trackers
+  Return a list of Tracker objects for all task trackers, as of the
+  cluster topology the JobTracker keeps
   """
-  return [ Tracker(tracker) for tracker in request.jt.all_task_trackers().trackers]
+  return [ Tracker(tracker) for tracker in request.jt.topology().trackers() ]
 
 
 ##################################
@@ -416,51 +539,28 @@ def get_single_job(request, jobid):
 
 def get_matching_jobs(request, **kwargs):
   """
-  Returns an array of jobs where the returned
-  jobs are matched by the provided filter arguments.
+  Returns a list of the jobs (as snapshot.JobRecords) matched by the
+  provided filter arguments, newest first.
 
   If a filter argument is in kwargs it will supersede the same argument
   in the request object.
 
-  Filter arguments may be jobid, pools, user, tasks, text and state.
-  """
-  jobfunc = {"completed" : request.jt.completed_jobs,
-             # Succeeded and completed are synonyms here.
-             "succeeded" : request.jt.completed_jobs,
-             "running" : request.jt.running_jobs,
-             "failed" : request.jt.failed_jobs,
-             "killed" : request.jt.killed_jobs,
-             "all" : request.jt.all_jobs}
-  if 'state' in kwargs:
-    selection = kwargs['state']
-  else:
-    selection = request.GET.get("state", "all")
-
-  joblist = jobfunc[selection]().jobs
-
-  return [Job.from_thriftjob(request.jt, j)
-          for j in _filter_jobs_by_req(joblist, request, **kwargs) ]
+  Filter arguments may be jobid_exact, jobid_substr, pools, user, text and state.
+  """
+  args = {}
+  for x in ["jobid_exact", "jobid_substr", "pools", "user", "text", "state"]:
+    if x in kwargs:
+      args[x] = kwargs[x]
+    else:
+      args[x] = request.GET.get(x)
+  return snapshot.get_snapshot(request.jt).get_jobs(**args)
 
 
 def get_job_count_by_state(request, username):
   """
   Returns the number of comlpeted, running, and failed jobs for a user.
   """
-  res = {
-    'completed': 0,
-    'running': 0,
-    'failed': 0,
-    'killed': 0,
-    'all': 0
-  }
-
-  jobcounts = request.jt.get_job_count_by_user(username)
-  res['completed'] = jobcounts.nSucceeded
-  res['running'] = jobcounts.nPrep + jobcounts.nRunning
-  res['failed'] = jobcounts.nFailed
-  res['killed'] = jobcounts.nKilled
-  res['all'] = res['completed'] + res['running'] + res['failed'] + res['killed']
-  return res
+  return snapshot.get_snapshot(request.jt).count_by_state(username)
 
 
 ##################################
@@ -209,6 +209,29 @@ KERBEROS = ConfigSection(
   )
 )
 
+THRIFT_POOL = ConfigSection(
+  key="thrift_pool",
+  help="""Sizing of the connection pools Hue keeps for each Thrift service
+          (NameNode, DataNodes, JobTracker, Beeswax, ...) it talks to.""",
+  members=dict(
+    MIN_SIZE=Config(
+      key="min_size",
+      help="Number of idle connections kept open to each Thrift endpoint.",
+      type=int,
+      default=0),
+    MAX_SIZE=Config(
+      key="max_size",
+      help="Maximum number of connections to each Thrift endpoint. Calls wait for a free connection beyond that.",
+      type=int,
+      default=10),
+    IDLE_TIMEOUT=Config(
+      key="idle_timeout",
+      help="Seconds after which an unused connection above min_size is closed.",
+      type=int,
+      default=300),
+  )
+)
+
 # See python's documentation for time.tzset for valid values.
 TIME_ZONE = Config(
   key="time_zone",
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+A compact binary columnar format for tabular data, meant to be loaded by
+downstream tools without parsing CSV.
+
+All integers are 4-byte unsigned big-endian. A file is:
+
+  magic       "HUECOL\\x01\\n"
+  ncols       number of columns
+  names       ncols times: length, utf-8 bytes of the column name
+  row groups  each: nrows, then ncols times: length, column chunk
+  end         nrows of 0
+
+A column chunk is the zlib-compressed concatenation of the nrows value
+lengths followed by the nrows utf-8 values of that column. Row groups
+hold up to ROW_GROUP_SIZE rows, so writers and readers only ever keep one
+group in memory.
+"""
+
+import struct
+import zlib
+
+MAGIC = 'HUECOL\x01\n'
+ROW_GROUP_SIZE = 10000
+
+
+def _pack_uint(n):
+  return struct.pack('>I', n)
+
+
+class ColumnarWriter(object):
+  """
+  Encodes rows into the columnar format. Every method returns the next
+  bytes of the file.
+  """
+
+  def __init__(self, columns, row_group_size=ROW_GROUP_SIZE):
+    self.columns = [ _to_utf8(name) for name in columns ]
+    self.row_group_size = row_group_size
+    self._group = [ [] for name in self.columns ]
+    self._rows = 0
+
+  def header(self):
+    return MAGIC + _pack_uint(len(self.columns)) + \
+        ''.join([ _pack_uint(len(name)) + name for name in self.columns ])
+
+  def add_row(self, row):
+    """Rows with too few or too many cells are padded with empty values or cut."""
+    group = self._group
+    for i in xrange(len(group)):
+      if i < len(row):
+        group[i].append(_to_utf8(row[i]))
+      else:
+        group[i].append('')
+    self._rows += 1
+    if self._rows >= self.row_group_size:
+      return self.flush()
+    return ''
+
+  def flush(self):
+    """Ends the current row group."""
+    if not self._rows:
+      return ''
+    res = [ _pack_uint(self._rows) ]
+    for values in self._group:
+      lengths = struct.pack('>%dI' % (len(values),), *[ len(v) for v in values ])
+      chunk = zlib.compress(lengths + ''.join(values))
+      res.append(_pack_uint(len(chunk)))
+      res.append(chunk)
+    self._group = [ [] for name in self.columns ]
+    self._rows = 0
+    return ''.join(res)
+
+  def finish(self):
+    return self.flush() + _pack_uint(0)
+
+
+def _to_utf8(value):
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if not isinstance(value, str):
+    return str(value)
+  return value
+
+
+def _read_exactly(fileobj, n):
+  data = fileobj.read(n)
+  if len(data) != n:
+    raise ValueError('Truncated columnar data')
+  return data
+
+
+def _read_uint(fileobj):
+  return struct.unpack('>I', _read_exactly(fileobj, 4))[0]
+
+
+def read_columns(fileobj):
+  """
+  read_columns(fileobj) -> (column names, row group generator)
+
+  Every row group is a list holding, for each column, the list of its
+  values as unicode.
+  """
+  if _read_exactly(fileobj, len(MAGIC)) != MAGIC:
+    raise ValueError('Not columnar data')
+  columns = []
+  for i in xrange(_read_uint(fileobj)):
+    columns.append(_read_exactly(fileobj, _read_uint(fileobj)).decode('utf-8'))
+
+  def groups():
+    while True:
+      nrows = _read_uint(fileobj)
+      if not nrows:
+        return
+      group = []
+      for i in xrange(len(columns)):
+        chunk = zlib.decompress(_read_exactly(fileobj, _read_uint(fileobj)))
+        lengths = struct.unpack('>%dI' % (nrows,), chunk[:4 * nrows])
+        values = []
+        pos = 4 * nrows
+        for length in lengths:
+          values.append(chunk[pos:pos + length].decode('utf-8'))
+          pos += length
+        group.append(values)
+      yield group
+  return columns, groups()
+
+
+def read_rows(fileobj):
+  """
+  read_rows(fileobj) -> (column names, row generator)
+
+  Convenience over read_columns() for row-at-a-time consumers.
+  """
+  columns, groups = read_columns(fileobj)
+  def rows():
+    for group in groups:
+      for row in zip(*group):
+        yield list(row)
+  return columns, rows()
@@ -15,19 +15,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-Common library to export either CSV or XLS.
+Common library to export tabular data as CSV, TSV, Excel and other formats.
 """
-import pyExcelerator as xl
-import cStringIO
+import codecs
 import csv
 import logging
+import re
+import struct
+import time
+import zlib
+from xml.sax.saxutils import escape
 
 from django.http import HttpResponse
 from django.utils.encoding import smart_str, force_unicode
-from desktop.lib import i18n
+from desktop.lib import columnar, i18n
 
 LOG = logging.getLogger(__name__)
-XLS_SIZE_LIMIT = 200 * 1024 * 1024      # 200MB
 
 class TooBigToDownloadException(Exception):
   pass
@@ -35,7 +38,12 @@ class TooBigToDownloadException(Exception):
 class Formatter(object):
   """
   The interface for a helper class to write formatted data.
+
+  Formatters that set accepts_raw_rows also implement format_raw_row(), and
+  can take rows that are already tab separated, without splitting them.
   """
+  accepts_raw_rows = False
+
   def init_doc(self):
     """
     init_doc() -> initial data to appear before the header
@@ -60,6 +68,13 @@ class Formatter(object):
     """
     raise NotImplementedError()
 
+  def format_raw_row(self, line, encoding):
+    """
+    format_raw_row(line, encoding) -> line
+    line is a tab separated row, as a byte string in the given encoding
+    """
+    raise NotImplementedError()
+
   def fini_doc(self):
     """
     fini_doc() -> final data to appear after all rows
@@ -94,21 +109,17 @@ def make_response(header, data, format, name, encoding=None):
   """
   @param header List of strings to form the header
   @param data An iterator of rows, where every row is a list of strings
-  @param format Either "csv" or "xls"
+  @param format One of FORMATS. "xls" produces an Excel 2007 (xlsx) workbook.
   @param name Base name for output file
   @param encoding Unicode encoding for data
   """
-  if format == 'csv':
-    formatter = CSVformatter(encoding)
-    mimetype = 'application/csv'
-  elif format == 'xls':
-    formatter = XLSformatter(encoding)
-    mimetype = 'application/xls'
-  else:
+  if format not in FORMATS:
     raise Exception("Unknown format: %s" % (format,))
+  make_formatter, mimetype, extension = FORMATS[format]
+  formatter = make_formatter(encoding)
 
   resp = HttpResponse(generator(header, data, formatter), mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, format)
+  resp['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, extension)
   return resp
 
 class CSVformatter(Formatter):
@@ -138,50 +149,321 @@ class CSVformatter(Formatter):
   def fini_doc(self):
     return ""
 
-class XLSformatter(Formatter):
-  """Unfortunately, pyExcelerator can't stream."""
+class TSVformatter(Formatter):
+  """
+  Tab separated values, without quoting. Tabs and line breaks within
+  cells are replaced by spaces.
+  """
+  accepts_raw_rows = True
+
   def __init__(self, encoding=None):
-    super(XLSformatter, self).__init__()
+    super(TSVformatter, self).__init__()
     self._encoding = encoding or i18n.get_site_encoding()
-    self._book = xl.Workbook()
-    self._sheet = self._book.add_sheet("Sheet 1")
-    self._row = 0
+    self._codec = codecs.lookup(self._encoding)
+
+  def init_doc(self):
+    return ""
+
+  def format_header(self, header):
+    return self.format_row(header)
+
+  def format_row(self, row):
+    row = [ _TSV_SPECIAL_CHARS.sub(' ', smart_str(cell, self._encoding, errors='replace'))
+            for cell in row ]
+    return '\t'.join(row) + '\n'
+
+  def format_raw_row(self, line, encoding):
+    if codecs.lookup(encoding) != self._codec:
+      line = smart_str(force_unicode(line, encoding, errors='replace'), self._encoding, errors='replace')
+    return line + '\n'
+
+  def fini_doc(self):
+    return ""
+
+_TSV_SPECIAL_CHARS = re.compile('[\t\r\n]')
+
+class GzipFormatter(Formatter):
+  """Gzip-compresses the output of another formatter, as it comes."""
+  def __init__(self, formatter, level=6):
+    super(GzipFormatter, self).__init__()
+    self._formatter = formatter
+    self.accepts_raw_rows = formatter.accepts_raw_rows
+    self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    self._crc = 0
     self._size = 0
 
+  def _compress(self, data):
+    self._crc = zlib.crc32(data, self._crc)
+    self._size += len(data)
+    return self._compressor.compress(data)
+
+  def init_doc(self):
+    # No file name; mtime; no flags; unknown OS
+    header = '\x1f\x8b\x08\x00' + struct.pack('<I', long(time.time())) + '\x00\xff'
+    return header + self._compress(self._formatter.init_doc())
+
+  def format_header(self, header):
+    return self._compress(self._formatter.format_header(header))
+
+  def format_row(self, row):
+    return self._compress(self._formatter.format_row(row))
+
+  def format_raw_row(self, line, encoding):
+    return self._compress(self._formatter.format_raw_row(line, encoding))
+
+  def fini_doc(self):
+    data = self._compress(self._formatter.fini_doc()) + self._compressor.flush()
+    return data + struct.pack('<II', self._crc & 0xffffffffL, self._size & 0xffffffffL)
+
+class ColumnarFormatter(Formatter):
+  """
+  The binary columnar format of desktop.lib.columnar. Always utf-8.
+  """
+  def __init__(self, encoding=None):
+    super(ColumnarFormatter, self).__init__()
+    self._encoding = encoding or i18n.get_site_encoding()
+    self._writer = None
+
   def init_doc(self):
-    return ''
+    return ""
 
   def _decode_cell(self, cell):
-    """PyExcelerator happily takes unicode. So first decode binary data."""
     return force_unicode(cell, self._encoding, strings_only=True, errors='replace')
 
   def format_header(self, header):
-    for i, cell in enumerate(header):
-      self._sheet.write(self._row, i, self._decode_cell(cell))
-    self._row += 1
-    return ''
+    self._writer = columnar.ColumnarWriter([ self._decode_cell(name) for name in header ])
+    return self._writer.header()
 
   def format_row(self, row):
-    for i, cell in enumerate(row):
-      self._sheet.write(self._row, i, self._decode_cell(cell))
-      self._limit_size(cell)
+    return self._writer.add_row([ self._decode_cell(cell) for cell in row ])
+
+  def fini_doc(self):
+    return self._writer.finish()
+
+class XLSformatter(Formatter):
+  """
+  Writes an Excel (xlsx) workbook as the rows come.
+
+  The worksheets are streamed out as they are written, compressed, so that
+  the whole spreadsheet is never held in memory and exports of any size
+  work. Rows beyond what a worksheet can hold, or past XLSX_MAX_SHEET_SIZE
+  bytes of it, go to further worksheets.
+  """
+  def __init__(self, encoding=None):
+    super(XLSformatter, self).__init__()
+    self._encoding = encoding or i18n.get_site_encoding()
+    self._zip = _ZipStream()
+    self._sheets = 0
+    self._row = 0
+    self._header = None
+
+  def init_doc(self):
+    return self._start_sheet()
+
+  def _start_sheet(self):
+    self._sheets += 1
+    self._row = 0
+    return self._zip.start_entry('xl/worksheets/sheet%d.xml' % (self._sheets,)) + \
+        self._zip.write(_XLSX_SHEET_START)
+
+  def _end_sheet(self):
+    return self._zip.write(_XLSX_SHEET_END) + self._zip.end_entry()
+
+  def _format_cell(self, cell):
+    cell = force_unicode(cell, self._encoding, strings_only=True, errors='replace')
+    if not isinstance(cell, unicode):
+      cell = unicode(cell)
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % \
+        (escape(_INVALID_XML_CHARS.sub(u'', cell)).encode('utf-8'),)
+
+  def _format_row(self, row):
     self._row += 1
-    return ''
+    return '<row r="%d">%s</row>' % (self._row, ''.join([ self._format_cell(cell) for cell in row ]))
+
+  def format_header(self, header):
+    # Repeated at the top of every worksheet
+    self._header = header
+    return self._zip.write(self._format_row(header))
+
+  def format_row(self, row):
+    res = ''
+    if self._row >= XLSX_MAX_ROWS or self._zip.entry_size >= XLSX_MAX_SHEET_SIZE:
+      res = self._end_sheet() + self._start_sheet()
+      if self._header is not None:
+        res += self._zip.write(self._format_row(self._header))
+    return res + self._zip.write(self._format_row(row))
 
   def fini_doc(self):
-    string_io = cStringIO.StringIO()
-    self._book.save(string_io)
-    res = string_io.getvalue()
-    string_io.close()
-    return res
-
-  def _limit_size(self, cell):
-    # Coerce cell to a string
-    if not isinstance(cell, basestring):
-      cell = str(cell)
-    self._size += len(cell)
-    if self._size > XLS_SIZE_LIMIT:
-      msg = 'ERROR: Data too large to be downloaded as XLS file.'
-      self._row += 1
-      self._sheet.write(self._row, 0, msg)
-      raise TooBigToDownloadException(msg)
+    sheets = range(1, self._sheets + 1)
+    parts = [
+      (_XLSX_CONTENT_TYPES_PATH, _XLSX_CONTENT_TYPES %
+          ''.join([ _XLSX_SHEET_CONTENT_TYPE % (i,) for i in sheets ])),
+      (_XLSX_RELS_PATH, _XLSX_RELS),
+      (_XLSX_WORKBOOK_PATH, _XLSX_WORKBOOK %
+          ''.join([ '<sheet name="Sheet %d" sheetId="%d" r:id="rId%d"/>' % (i, i, i) for i in sheets ])),
+      (_XLSX_WORKBOOK_RELS_PATH, _XLSX_WORKBOOK_RELS %
+          ''.join([ _XLSX_SHEET_REL % (i, i) for i in sheets ])),
+    ]
+    res = [ self._end_sheet() ]
+    for path, content in parts:
+      res.append(self._zip.start_entry(path))
+      res.append(self._zip.write(content))
+      res.append(self._zip.end_entry())
+    res.append(self._zip.close())
+    return ''.join(res)
+
+
+# Excel 2007 and later limit
+XLSX_MAX_ROWS = 1048576
+# Worksheets are kept below this many bytes (uncompressed), well within
+# what a zip entry can hold, whatever the width of the rows
+XLSX_MAX_SHEET_SIZE = 2 * 1024 * 1024 * 1024
+
+# Characters that may not appear in XML 1.0
+_INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_XLSX_SHEET_START = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+  '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+_XLSX_SHEET_END = '</sheetData></worksheet>'
+
+_XLSX_CONTENT_TYPES_PATH = '[Content_Types].xml'
+_XLSX_CONTENT_TYPES = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+  '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">' \
+  '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>' \
+  '<Default Extension="xml" ContentType="application/xml"/>' \
+  '<Override PartName="/xl/workbook.xml" ' \
+  'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>' \
+  '%s</Types>'
+_XLSX_SHEET_CONTENT_TYPE = '<Override PartName="/xl/worksheets/sheet%d.xml" ' \
+  'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+
+_XLSX_RELS_PATH = '_rels/.rels'
+_XLSX_RELS = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+  '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' \
+  '<Relationship Id="rId1" ' \
+  'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" ' \
+  'Target="xl/workbook.xml"/></Relationships>'
+
+_XLSX_WORKBOOK_PATH = 'xl/workbook.xml'
+_XLSX_WORKBOOK = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+  '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ' \
+  'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">' \
+  '<sheets>%s</sheets></workbook>'
+
+_XLSX_WORKBOOK_RELS_PATH = 'xl/_rels/workbook.xml.rels'
+_XLSX_WORKBOOK_RELS = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+  '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' \
+  '%s</Relationships>'
+_XLSX_SHEET_REL = '<Relationship Id="rId%d" ' \
+  'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" ' \
+  'Target="worksheets/sheet%d.xml"/>'
+
+
+class _ZipStream(object):
+  """
+  Writes a zip archive front to back, without seeking, as a series of
+  strings: every method returns the next bytes of the archive.
+
+  Entries are deflated, and their sizes and checksums follow their data
+  (general purpose flag bit 3) since they are not known up front. Entries
+  must stay below 4GB; the archive may grow past that, its central
+  directory then has zip64 records for the offsets that don't fit.
+  """
+  _LOCAL_HEADER = '<IHHHHHIIIHH'
+  _DATA_DESCRIPTOR = '<IIII'
+  _CENTRAL_HEADER = '<IHHHHHHIIIHHHHHII'
+  _ZIP64_OFFSET = '<HHQ'
+  _ZIP64_END_OF_CENTRAL_DIR = '<IQHHIIQQQQ'
+  _ZIP64_END_OF_CENTRAL_DIR_LOCATOR = '<IIQI'
+  _END_OF_CENTRAL_DIR = '<IHHHHIIH'
+  _FLAGS = 0x08
+  _VERSION = 20
+  _ZIP64_VERSION = 45
+  # What 32 and 16 bit fields hold when the value is in a zip64 record
+  _MAX_32 = 0xffffffff
+  _MAX_16 = 0xffff
+  # Offsets and sizes from this one on, and this many entries, need zip64 records
+  _ZIP64_LIMIT = _MAX_32
+  _ZIP64_COUNT_LIMIT = _MAX_16
+
+  def __init__(self):
+    self._offset = 0
+    self._entries = []
+    self._current = None
+    t = time.localtime()
+    self._dos_time = (t[3] << 11) | (t[4] << 5) | (t[5] // 2)
+    self._dos_date = ((t[0] - 1980) << 9) | (t[1] << 5) | t[2]
+
+  def _emit(self, data):
+    self._offset += len(data)
+    return data
+
+  @property
+  def entry_size(self):
+    """The uncompressed size of the current entry so far."""
+    return self._current['size']
+
+  def start_entry(self, name):
+    self._current = dict(name=name, offset=self._offset, crc=0, size=0, compressed_size=0,
+                         compressor=zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15))
+    return self._emit(struct.pack(self._LOCAL_HEADER, 0x04034b50, self._VERSION, self._FLAGS,
+        zlib.DEFLATED, self._dos_time, self._dos_date, 0, 0, 0, len(name), 0) + name)
+
+  def write(self, data):
+    entry = self._current
+    entry['crc'] = zlib.crc32(data, entry['crc'])
+    entry['size'] += len(data)
+    compressed = entry['compressor'].compress(data)
+    entry['compressed_size'] += len(compressed)
+    return self._emit(compressed)
+
+  def end_entry(self):
+    entry = self._current
+    compressed = entry.pop('compressor').flush()
+    entry['compressed_size'] += len(compressed)
+    entry['crc'] &= 0xffffffff
+    self._entries.append(entry)
+    self._current = None
+    return self._emit(compressed + struct.pack(self._DATA_DESCRIPTOR,
+        0x08074b50, entry['crc'], entry['compressed_size'], entry['size']))
+
+  def close(self):
+    start = self._offset
+    res = []
+    for entry in self._entries:
+      if entry['offset'] < self._ZIP64_LIMIT:
+        version, offset, extra = self._VERSION, entry['offset'], ''
+      else:
+        version, offset = self._ZIP64_VERSION, self._MAX_32
+        extra = struct.pack(self._ZIP64_OFFSET, 0x0001, 8, entry['offset'])
+      res.append(struct.pack(self._CENTRAL_HEADER, 0x02014b50, version, version, self._FLAGS,
+          zlib.DEFLATED, self._dos_time, self._dos_date, entry['crc'], entry['compressed_size'],
+          entry['size'], len(entry['name']), len(extra), 0, 0, 0, 0, offset))
+      res.append(entry['name'])
+      res.append(extra)
+    directory = ''.join(res)
+    count = len(self._entries)
+
+    if count < self._ZIP64_COUNT_LIMIT and len(directory) < self._ZIP64_LIMIT and \
+        start < self._ZIP64_LIMIT:
+      return self._emit(directory + struct.pack(self._END_OF_CENTRAL_DIR, 0x06054b50, 0, 0,
+          count, count, len(directory), start, 0))
+    end = start + len(directory)
+    return self._emit(directory +
+        struct.pack(self._ZIP64_END_OF_CENTRAL_DIR, 0x06064b50, 44, self._ZIP64_VERSION,
+                    self._ZIP64_VERSION, 0, 0, count, count, len(directory), start) +
+        struct.pack(self._ZIP64_END_OF_CENTRAL_DIR_LOCATOR, 0x07064b50, 0, end, 1) +
+        struct.pack(self._END_OF_CENTRAL_DIR, 0x06054b50, 0, 0, self._MAX_16, self._MAX_16,
+                    self._MAX_32, self._MAX_32, 0))
+
+
+# Maps a format name to its (formatter factory, mimetype, file extension).
+# The factory takes the encoding of the data.
+FORMATS = {
+  'csv': (CSVformatter, 'application/csv', 'csv'),
+  'xls': (XLSformatter, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+  'tsv': (TSVformatter, 'text/tab-separated-values', 'tsv'),
+  'csv_gz': (lambda encoding=None: GzipFormatter(CSVformatter(encoding)), 'application/x-gzip', 'csv.gz'),
+  'tsv_gz': (lambda encoding=None: GzipFormatter(TSVformatter(encoding)), 'application/x-gzip', 'tsv.gz'),
+  'columnar': (ColumnarFormatter, 'application/octet-stream', 'hcol'),
+}
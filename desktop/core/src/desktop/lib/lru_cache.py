@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A thread-safe, size-bounded LRU cache with optional expiry.
+"""
+
+import threading
+import time
+
+# Indexes into the linked list nodes
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES, _SIZE = range(6)
+
+
+class LRUCache(object):
+  """
+  Maps keys to values, evicting the least recently used entries once the
+  total size of the entries exceeds max_size.
+
+  By default every entry has size 1, so max_size is a number of entries;
+  pass a sizeof function to bound the cache by, say, bytes instead.
+  If ttl (seconds) is given, entries older than that are treated as absent.
+
+  hits, misses and evictions count what happened to the cache so far.
+  """
+
+  def __init__(self, max_size, ttl=None, sizeof=None, clock=time.time):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.sizeof = sizeof
+    self.clock = clock
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._lock = threading.RLock()
+    self._clear()
+
+  def _clear(self):
+    self._map = {}
+    self._size = 0
+    # Circular doubly linked list; _root[_NEXT] is the least recently used.
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None, None, 0]
+
+  def _unlink(self, node):
+    node[_PREV][_NEXT] = node[_NEXT]
+    node[_NEXT][_PREV] = node[_PREV]
+
+  def _append(self, node):
+    last = self._root[_PREV]
+    node[_PREV] = last
+    node[_NEXT] = self._root
+    last[_NEXT] = node
+    self._root[_PREV] = node
+
+  def _remove(self, node):
+    self._unlink(node)
+    del self._map[node[_KEY]]
+    self._size -= node[_SIZE]
+
+  def _is_expired(self, node):
+    return node[_EXPIRES] is not None and node[_EXPIRES] <= self.clock()
+
+  def get(self, key, default=None):
+    self._lock.acquire()
+    try:
+      node = self._map.get(key)
+      if node is None:
+        self.misses += 1
+        return default
+      if self._is_expired(node):
+        self._remove(node)
+        self.misses += 1
+        return default
+      self._unlink(node)
+      self._append(node)
+      self.hits += 1
+      return node[_VALUE]
+    finally:
+      self._lock.release()
+
+  def put(self, key, value):
+    if self.sizeof is not None:
+      size = self.sizeof(value)
+    else:
+      size = 1
+    if self.ttl is not None:
+      expires = self.clock() + self.ttl
+    else:
+      expires = None
+
+    self._lock.acquire()
+    try:
+      old = self._map.get(key)
+      if old is not None:
+        self._remove(old)
+      if size > self.max_size:
+        # Would evict everything else and still not fit.
+        return
+      node = [None, None, key, value, expires, size]
+      self._append(node)
+      self._map[key] = node
+      self._size += size
+      while self._size > self.max_size:
+        self._remove(self._root[_NEXT])
+        self.evictions += 1
+    finally:
+      self._lock.release()
+
+  def pop(self, key, default=None):
+    self._lock.acquire()
+    try:
+      node = self._map.get(key)
+      if node is None:
+        return default
+      self._remove(node)
+      if self._is_expired(node):
+        return default
+      return node[_VALUE]
+    finally:
+      self._lock.release()
+
+  def remove_if(self, predicate):
+    """Removes every entry whose key satisfies predicate(key)."""
+    self._lock.acquire()
+    try:
+      for key in [ k for k in self._map if predicate(k) ]:
+        self._remove(self._map[key])
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._clear()
+    finally:
+      self._lock.release()
+
+  def keys(self):
+    """Snapshot of the keys, least recently used first. May include expired keys."""
+    self._lock.acquire()
+    try:
+      keys = []
+      node = self._root[_NEXT]
+      while node is not self._root:
+        keys.append(node[_KEY])
+        node = node[_NEXT]
+      return keys
+    finally:
+      self._lock.release()
+
+  def __contains__(self, key):
+    self._lock.acquire()
+    try:
+      node = self._map.get(key)
+      return node is not None and not self._is_expired(node)
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._map)
+
+  @property
+  def size(self):
+    """Total size of the entries, as measured by sizeof."""
+    return self._size
+
+  def stats(self):
+    return dict(hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._map),
+                size=self._size,
+                max_size=self.max_size)
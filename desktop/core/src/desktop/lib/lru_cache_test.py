@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from desktop.lib.lru_cache import LRUCache
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+def test_lru_eviction():
+  cache = LRUCache(3)
+  for k in "abc":
+    cache.put(k, k.upper())
+  assert_equal("A", cache.get("a"))
+  cache.put("d", "D")
+  # "b" was least recently used
+  assert_equal(None, cache.get("b"))
+  assert_equal(["c", "a", "d"], cache.keys())
+  assert_equal(1, cache.evictions)
+  assert_equal(1, cache.hits)
+  assert_equal(1, cache.misses)
+
+  cache.put("a", "AA")
+  assert_equal(3, len(cache))
+  assert_equal("AA", cache.pop("a"))
+  assert_false("a" in cache)
+
+  cache.remove_if(lambda k: k == "c")
+  assert_equal(["d"], cache.keys())
+  cache.clear()
+  assert_equal(0, len(cache))
+
+
+def test_sizeof():
+  cache = LRUCache(10, sizeof=len)
+  cache.put("a", "12345")
+  cache.put("b", "1234")
+  assert_equal(9, cache.size)
+  cache.put("c", "12")
+  assert_equal(["b", "c"], cache.keys())
+  # Too big to ever fit
+  cache.put("d", "x" * 11)
+  assert_false("d" in cache)
+  assert_equal(6, cache.size)
+
+
+def test_ttl():
+  clock = FakeClock()
+  cache = LRUCache(10, ttl=5, clock=clock)
+  cache.put("a", 1)
+  clock.now = 4
+  assert_true("a" in cache)
+  assert_equal(1, cache.get("a"))
+  clock.now = 5
+  assert_false("a" in cache)
+  assert_equal("gone", cache.get("a", "gone"))
+  assert_equal(0, len(cache))
@@ -15,9 +15,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pyExcelerator as xl
 import cStringIO
-from desktop.lib.export_csvxls import make_response
+import gzip
+import zipfile
+from xml.dom import minidom
+
+from desktop.lib import columnar, export_csvxls
+from desktop.lib.export_csvxls import make_response, XLSformatter, TSVformatter
 from nose.tools import assert_true, assert_equal, assert_false
 
 def test_export_csvxls():
@@ -32,44 +36,117 @@ def test_export_csvxls():
 
   # Check XLS
   response = make_response(header, data, "xls", "bar")
-  assert_equal("application/xls", response["content-type"])
-  assert_equal("attachment; filename=bar.xls", response["content-disposition"])
+  assert_equal("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", response["content-type"])
+  assert_equal("attachment; filename=bar.xlsx", response["content-disposition"])
   assert_equal('"x","y"\r\n"1","2"\r\n"3","4"\r\n', xls2csv(response.content))
 
 
+def test_xls_streaming():
+  saved = export_csvxls.XLSX_MAX_ROWS
+  export_csvxls.XLSX_MAX_ROWS = 1000
+  try:
+    formatter = XLSformatter()
+    chunks = [ formatter.init_doc(), formatter.format_header(["n", "text"]) ]
+    for i in xrange(2500):
+      chunks.append(formatter.format_row([str(i), u"r\u00e9sum\u00e9 <%d> & \x01" % (i,)]))
+    # Rows are emitted as they come, not all at the end.
+    streamed = len("".join(chunks))
+    assert_true(streamed > 0)
+    chunks.append(formatter.fini_doc())
+    assert_true(streamed > len(chunks[-1]))
+  finally:
+    export_csvxls.XLSX_MAX_ROWS = saved
+
+  sheets = read_xlsx("".join(chunks))
+  # Every sheet repeats the header
+  assert_equal([1000, 1000, 503], [ len(rows) for rows in sheets ])
+  assert_equal([u"n", u"text"], sheets[1][0])
+  assert_equal([u"999", u"r\u00e9sum\u00e9 <999> & "], sheets[1][1])
+  assert_equal([u"2499", u"r\u00e9sum\u00e9 <2499> & "], sheets[2][-1])
+
+
+def test_xls_large():
+  saved = (export_csvxls.XLSX_MAX_SHEET_SIZE, export_csvxls._ZipStream._ZIP64_LIMIT)
+  # Stand-ins for 2GB worksheets and archives past 4GB
+  export_csvxls.XLSX_MAX_SHEET_SIZE = 4096
+  export_csvxls._ZipStream._ZIP64_LIMIT = 1024
+  try:
+    formatter = XLSformatter()
+    chunks = [ formatter.init_doc(), formatter.format_header(["n", "text"]) ]
+    for i in xrange(300):
+      chunks.append(formatter.format_row([str(i), "x" * 50]))
+    chunks.append(formatter.fini_doc())
+  finally:
+    export_csvxls.XLSX_MAX_SHEET_SIZE, export_csvxls._ZipStream._ZIP64_LIMIT = saved
+
+  # Wide rows roll over to further worksheets, and the archive has zip64
+  # records for what is past the limit.
+  data = "".join(chunks)
+  assert_true('PK\x06\x06' in data)
+  sheets = read_xlsx(data)
+  assert_true(len(sheets) > 2)
+  assert_equal(300 + len(sheets), sum([ len(rows) for rows in sheets ]))
+  assert_equal([u"n", u"text"], sheets[-1][0])
+  assert_equal([u"299", u"x" * 50], sheets[-1][-1])
+
+
+def test_export_tsv_gz_columnar():
+  header = ["x", "y"]
+  data = [ ["1", "a\tb"], [u"\u00e9", "4"] ]
+
+  response = make_response(header, data, "tsv", "foo", encoding="utf-8")
+  assert_equal("attachment; filename=foo.tsv", response["content-disposition"])
+  assert_equal('x\ty\n1\ta b\n\xc3\xa9\t4\n', response.content)
+
+  # Raw rows are passed through, and re-encoded if need be.
+  assert_equal('1\t2\n', TSVformatter("utf-8").format_raw_row('1\t2', "utf-8"))
+  assert_equal('\xe9\n', TSVformatter("latin-1").format_raw_row('\xc3\xa9', "utf-8"))
+
+  response = make_response(header, data, "csv_gz", "foo", encoding="utf-8")
+  assert_equal("attachment; filename=foo.csv.gz", response["content-disposition"])
+  csv = make_response(header, data, "csv", "foo", encoding="utf-8").content
+  assert_equal(csv, gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
+
+  response = make_response(header, data, "columnar", "foo", encoding="utf-8")
+  columns, rows = columnar.read_rows(cStringIO.StringIO(response.content))
+  assert_equal([u"x", u"y"], columns)
+  assert_equal([[u"1", u"a\tb"], [u"\u00e9", u"4"]], list(rows))
+
+
+def test_columnar_row_groups():
+  writer = columnar.ColumnarWriter(["a", "b"], row_group_size=3)
+  out = [ writer.header() ]
+  for i in xrange(7):
+    out.append(writer.add_row([str(i)] * (i % 3)))
+  out.append(writer.finish())
+  columns, groups = columnar.read_columns(cStringIO.StringIO("".join(out)))
+  groups = list(groups)
+  assert_equal([3, 3, 1], [ len(group[0]) for group in groups ])
+  # Short rows are padded, long ones cut.
+  assert_equal([[u"", u"1", u"2"], [u"", u"", u"2"]], groups[0])
+
+
+def read_xlsx(data_str):
+  """Returns the rows of every worksheet of an xlsx workbook, as lists of unicode."""
+  archive = zipfile.ZipFile(cStringIO.StringIO(data_str))
+  assert_equal(None, archive.testzip())
+  workbook = minidom.parseString(archive.read("xl/workbook.xml"))
+  sheets = []
+  for i in range(len(workbook.getElementsByTagName("sheet"))):
+    sheet = minidom.parseString(archive.read("xl/worksheets/sheet%d.xml" % (i + 1,)))
+    rows = []
+    for row in sheet.getElementsByTagName("row"):
+      cells = []
+      for t in row.getElementsByTagName("t"):
+        cells.append(u"".join([ node.data for node in t.childNodes ]))
+      rows.append(cells)
+    sheets.append(rows)
+  return sheets
+
 
 def xls2csv(data_str):
-  """
-  Modification of xls2csv.py from pyExcelerator. BSD license.
-  Copyright (C) 2005 Kiseliov Roman
-  """
-  buf_in = cStringIO.StringIO(data_str)
-  buf_out = cStringIO.StringIO()
-  for sheet_name, values in xl.parse_xls(buf_in, 'cp1251'): # parse_xls(arg) -- default encoding
-    matrix = [[]]
-    for row_idx, col_idx in sorted(values.keys()):
-      v = values[(row_idx, col_idx)]
-      if isinstance(v, unicode):
-        v = v.encode('cp866', 'backslashreplace')
-      else:
-        v = `v`
-      v = '"%s"' % v.strip()
-      last_row, last_col = len(matrix), len(matrix[-1])
-      while last_row <= row_idx:
-        matrix.extend([[]])
-        last_row = len(matrix)
-
-      while last_col < col_idx:
-        matrix[-1].extend([''])
-        last_col = len(matrix[-1])
-
-      matrix[-1].extend([v])
-
-    for row in matrix:
-      csv_row = ','.join(row)
-      buf_out.write(csv_row + '\r\n')
-
-  res = buf_out.getvalue()
-  buf_in.close()
-  buf_out.close()
-  return res
+  """Turns the first worksheet of an xlsx workbook into csv."""
+  res = []
+  for row in read_xlsx(data_str)[0]:
+    res.append(",".join([ '"%s"' % (cell.encode("utf-8").strip(),) for cell in row ]) + "\r\n")
+  return "".join(res)
@@ -19,7 +19,6 @@
 
 import socket
 import logging
-import Queue
 import sasl
 import select
 import sys
@@ -30,8 +29,25 @@ from thrift.Thrift import TType
 from thrift.transport.TSocket import TSocket
 from thrift.transport.TTransport import TBufferedTransport, TMemoryBuffer,\
                                         TTransportException
-from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
 from desktop.lib.thrift_sasl import TSaslClientTransport
+import desktop.conf
+
+try:
+  from thrift.protocol import fastbinary
+except ImportError:
+  fastbinary = None
+
+# The generated code (de)serializes whole structs in C, through the
+# fastbinary extension, when given a TBinaryProtocolAccelerated. Both
+# protocols speak the same wire format, so we fall back to the pure Python
+# one when the extension isn't built.
+if fastbinary is not None:
+  PROTOCOL_CLASS = TBinaryProtocolAccelerated
+else:
+  logging.info("thrift.protocol.fastbinary is not available; "
+               "using the slower pure Python Thrift protocol.")
+  PROTOCOL_CLASS = TBinaryProtocol
 
 # The maximum depth that we will recurse through a "jsonable" structure
 # while converting to thrift. This prevents us from infinite recursion
@@ -69,28 +85,209 @@ class ConnectionConfig(object):
     self.timeout_seconds = timeout_seconds
 
 
+# Calls per second are measured over windows of this many seconds
+CALL_RATE_WINDOW_SECONDS = 10
+
+
+class _EndpointPool(object):
+  """
+  The connections to one Thrift endpoint.
+
+  Connections are made on demand, up to max_size; callers wait for a free
+  one beyond that. Connections left unused for idle_timeout seconds are
+  closed, down to min_size. Idle connections are reused most recently
+  returned first, so that the surplus after a burst of calls goes idle
+  and gets closed.
+  """
+
+  def __init__(self, conf, min_size, max_size, idle_timeout, clock=time.time):
+    self.conf = conf
+    self.min_size = min_size
+    self.max_size = max(max_size, 1)
+    self.idle_timeout = idle_timeout
+    self.clock = clock
+    self._cond = threading.Condition()
+    # (client, time it was returned), oldest first
+    self._idle = []
+    self._next_cid = 0
+
+    # Metrics
+    self.size = 0
+    self.in_use = 0
+    self.waiting = 0
+    self.calls = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    self.calls_per_second = 0.0
+    self._rate_window_start = clock()
+    self._rate_window_calls = 0
+
+  def get(self, timeout=None):
+    """
+    Returns a client, waiting up to timeout seconds (forever if None)
+    for one to become available.
+    """
+    start = self.clock()
+    new_cid = None
+    self._cond.acquire()
+    try:
+      self._close_idle()
+      while True:
+        if self._idle:
+          client = self._idle.pop()[0]
+          break
+        if self.size < self.max_size:
+          self.size += 1
+          new_cid = self._next_cid
+          self._next_cid += 1
+          client = None
+          break
+
+        has_waited_for = self.clock() - start
+        if timeout is not None and has_waited_for >= timeout:
+          raise socket.timeout(
+            ("Timed out after %.2f seconds waiting to retrieve a " +
+             "%s client from the pool.") % (has_waited_for, self.conf.service_name))
+        if has_waited_for >= 1:
+          logging.warn("Waited %d seconds for a thrift client to %s:%d" %
+            (has_waited_for, self.conf.host, self.conf.port))
+        if timeout is not None:
+          this_round_timeout = max(min(timeout - has_waited_for, 1), 0)
+        else:
+          this_round_timeout = 1
+        self.waiting += 1
+        try:
+          self._cond.wait(this_round_timeout)
+        finally:
+          self.waiting -= 1
+
+      self.in_use += 1
+      self._record_call(self.clock() - start)
+    finally:
+      self._cond.release()
+
+    if client is None:
+      try:
+        client = construct_superclient(self.conf)
+        client.CID = new_cid
+      except:
+        self._cond.acquire()
+        try:
+          self.size -= 1
+          self.in_use -= 1
+          self._cond.notify()
+        finally:
+          self._cond.release()
+        raise
+    return client
+
+  def put(self, client):
+    self._cond.acquire()
+    try:
+      self.in_use -= 1
+      self._idle.append((client, self.clock()))
+      self._close_idle()
+      self._cond.notify()
+    finally:
+      self._cond.release()
+
+  def _close_idle(self):
+    """Closes connections that have been idle too long. Holds the lock."""
+    if self.idle_timeout is None:
+      return
+    deadline = self.clock() - self.idle_timeout
+    while self._idle and self.size > self.min_size and self._idle[0][1] <= deadline:
+      client = self._idle.pop(0)[0]
+      self.size -= 1
+      try:
+        client.transport.close()
+      except Exception, e:
+        logging.debug("Error closing idle thrift connection: %s" % (e,))
+
+  def _record_call(self, wait):
+    self.calls += 1
+    self.total_wait += wait
+    self.max_wait = max(self.max_wait, wait)
+    self._rate_window_calls += 1
+    self._roll_rate_window()
+
+  def _roll_rate_window(self):
+    now = self.clock()
+    elapsed = now - self._rate_window_start
+    if elapsed >= CALL_RATE_WINDOW_SECONDS:
+      self.calls_per_second = self._rate_window_calls / float(elapsed)
+      self._rate_window_start = now
+      self._rate_window_calls = 0
+
+  def metrics(self):
+    self._cond.acquire()
+    try:
+      self._roll_rate_window()
+      if self.calls:
+        avg_wait = self.total_wait / self.calls
+      else:
+        avg_wait = 0.0
+      return dict(service=self.conf.service_name,
+                  size=self.size,
+                  idle=len(self._idle),
+                  in_use=self.in_use,
+                  waiting=self.waiting,
+                  calls=self.calls,
+                  calls_per_second=self.calls_per_second,
+                  avg_wait_seconds=avg_wait,
+                  max_wait_seconds=self.max_wait)
+    finally:
+      self._cond.release()
+
+
 class ConnectionPooler(object):
   """
   Thread-safe connection pooling for thrift. (With about 3 changes,
   this could be made general).
 
-  Each host,port pair has a connection pool set associated with it.
-  Clients can get connections from this pool and then block when
-  none are available.
+  Each host,port pair has a connection pool associated with it, which
+  grows and shrinks between min_size and max_size connections (see
+  _EndpointPool). Clients can get connections from this pool and then
+  block when none are available.
 
   A connection is a 'SuperClient', which deals with timeout errors
   automatically so we don't have to worry about refreshing a stale pool.
 
-  We could be fancier here - we could reclaim clients ourselves without
-  relying on them to be returned but that would increase complexity. The
-  benefit would be not having to hit the connection pool on every client call.
+  Pool sizes default to the [[thrift_pool]] section of the configuration.
   """
 
-  def __init__(self, poolsize=10):
+  def __init__(self, min_size=None, max_size=None, idle_timeout=None, clock=time.time):
     self.pooldict = {}
-    self.poolsize = poolsize
+    self.min_size = min_size
+    self.max_size = max_size
+    self.idle_timeout = idle_timeout
+    self.clock = clock
     self.dictlock = threading.Lock()
 
+  def _get_pool(self, conf):
+    key = (conf.host, conf.port)
+    pool = self.pooldict.get(key)
+    if pool is None:
+      # Double-checked locking. Assigning the fully constructed pool to the
+      # dict is atomic in CPython, so other threads either see no pool or a
+      # complete one.
+      self.dictlock.acquire()
+      try:
+        pool = self.pooldict.get(key)
+        if pool is None:
+          min_size, max_size, idle_timeout = self.min_size, self.max_size, self.idle_timeout
+          if min_size is None:
+            min_size = desktop.conf.THRIFT_POOL.MIN_SIZE.get()
+          if max_size is None:
+            max_size = desktop.conf.THRIFT_POOL.MAX_SIZE.get()
+          if idle_timeout is None:
+            idle_timeout = desktop.conf.THRIFT_POOL.IDLE_TIMEOUT.get()
+          pool = _EndpointPool(conf, min_size, max_size, idle_timeout, self.clock)
+          self.pooldict[key] = pool
+      finally:
+        self.dictlock.release()
+    return pool
+
   def get_client(self, conf,
                  get_client_timeout=None):
     """
@@ -99,56 +296,7 @@ class ConnectionPooler(object):
     @param get_client_timeout: how long (in seconds) to wait on the pool
                                to get a client before failing
     """
-    # First up, check to see if we have a pool for this endpoint
-    if (conf.host, conf.port) not in self.pooldict:
-      # Uh-oh, we need to initialise the queue. Take the dict lock.
-      # Note that this is 'double-checked locking'.
-
-      # The reason this pattern doesn't work in Java is that the write to the dict
-      # may get issued before the construction of the Queue due to new Queue(..) not
-      # being atomic. However in Python this becomes CALL_FUNCTION and STORE_FAST,
-      # therefore as long as a) the function doesn't get inlined b) Python's bytecode
-      # generator doesn't move the write to q before the function completes there's no
-      # way for another thread to observe a partially constructed queue.
-
-      # I haven't found a reference for the Python memory model, so I'm leaving this comment
-      # here in case unladen-swallow or something breaks this assumption of correctness.
-
-      self.dictlock.acquire()
-      try:
-        if (conf.host, conf.port) not in self.pooldict:
-          q = Queue.Queue(self.poolsize)
-          self.pooldict[(conf.host, conf.port)] = q
-          for i in xrange(self.poolsize):
-            client = construct_superclient(conf)
-            client.CID = i
-            q.put(client, False)
-      finally:
-        self.dictlock.release()
-
-    connection = None
-
-    start_pool_get_time = time.time()
-    has_waited_for = 0
-    while connection is None:
-      if get_client_timeout is not None:
-        this_round_timeout = max(min(get_client_timeout - has_waited_for, 1), 0)
-      else:
-        this_round_timeout = None
-
-      try:
-        connection = self.pooldict[(conf.host, conf.port)].get(
-          block=True, timeout=this_round_timeout)
-      except Queue.Empty:
-        has_waited_for = time.time() - start_pool_get_time
-        if get_client_timeout is not None and has_waited_for > get_client_timeout:
-          raise socket.timeout(
-            ("Timed out after %.2f seconds waiting to retrieve a " +
-             "%s client from the pool.") % (has_waited_for, conf.service_name))
-        logging.warn("Waited %d seconds for a thrift client to %s:%d" %
-          (has_waited_for, conf.host, conf.port))
-
-    return connection
+    return self._get_pool(conf).get(get_client_timeout)
 
   def return_client(self, host, port, client):
     """
@@ -158,6 +306,16 @@ class ConnectionPooler(object):
     """
     self.pooldict[(host, port)].put(client)
 
+  def metrics(self):
+    """
+    Returns a dictionary of "host:port" to the metrics of its pool: number
+    of connections (size, idle, in_use), callers waiting for one, calls
+    made so far and per second, and the average and maximum time calls
+    waited for a connection.
+    """
+    return dict(("%s:%s" % key, pool.metrics())
+                for key, pool in self.pooldict.items())
+
 def construct_superclient(conf):
   """
   Constructs a thrift client, lazily.
@@ -190,7 +348,7 @@ def connect_to_thrift(conf):
   else:
     transport = TBufferedTransport(sock)
 
-  protocol = TBinaryProtocol(transport)
+  protocol = PROTOCOL_CLASS(transport)
   service = conf.klass(protocol)
   return service, protocol, transport
 
@@ -204,6 +362,65 @@ def get_client(klass, host, port, service_name,
     **kwargs)
   return PooledClient(conf)
 
+def pool_metrics():
+  """Metrics of the connection pool of every Thrift endpoint. See ConnectionPooler.metrics."""
+  return _connection_pool.metrics()
+
+
+class ThriftFuture(object):
+  """The eventual result of a call started with call_async."""
+
+  def __init__(self):
+    self._done = threading.Event()
+    self._result = None
+    self._exc_info = None
+
+  def _set_result(self, result):
+    self._result = result
+    self._done.set()
+
+  def _set_exc_info(self, exc_info):
+    self._exc_info = exc_info
+    self._done.set()
+
+  def done(self):
+    return self._done.isSet()
+
+  def result(self, timeout=None):
+    """
+    Waits up to timeout seconds (forever if None) for the call to finish,
+    and returns its result or raises its exception.
+    """
+    self._done.wait(timeout)
+    if not self._done.isSet():
+      raise socket.timeout("Timed out after %s seconds waiting for a thrift call" % (timeout,))
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+def call_async(func, *args, **kwargs):
+  """
+  Calls func(*args, **kwargs) in a new thread and returns a ThriftFuture
+  for its result. Lets a view fan out several Thrift calls at once:
+
+    job = call_async(jt.client.getJob, ctx, jobid)
+    counters = call_async(jt.client.getJobCounterRollups, ctx, jobid)
+    render(job.result(), counters.result())
+
+  Each call takes its own connection from the pool of its endpoint.
+  """
+  future = ThriftFuture()
+  def run():
+    try:
+      future._set_result(func(*args, **kwargs))
+    except:
+      future._set_exc_info(sys.exc_info())
+  thread = threading.Thread(target=run, name="thrift call_async")
+  thread.setDaemon(True)
+  thread.start()
+  return future
+
 def _grab_transport_from_wrapper(outer_transport):
   if isinstance(outer_transport, TBufferedTransport):
     return outer_transport._TBufferedTransport__trans
@@ -223,40 +440,43 @@ class PooledClient(object):
     if attr in self.__dict__:
       return self.__dict__[attr]
 
-    # Fetch the thrift client from the pool
-    superclient = _connection_pool.get_client(self.conf)
+    if not hasattr(getattr(self.conf.klass, attr, None), "__call__"):
+      superclient = _connection_pool.get_client(self.conf)
+      try:
+        return getattr(superclient, attr)
+      finally:
+        _connection_pool.return_client(self.conf.host, self.conf.port, superclient)
 
-    res = getattr(superclient, attr)
-    if hasattr(res,"__call__"):
-      def wrapper(*args, **kwargs):
+    # Fetch the thrift client from the pool only once the method is
+    # called, and for no longer than the call.
+    def wrapper(*args, **kwargs):
+      superclient = _connection_pool.get_client(self.conf)
+      try:
         try:
-          try:
-            # Poke it to see if it's closed on the other end. This can happen if a connection
-            # sits in the connection pool longer than the read timeout of the server.
-            sock = _grab_transport_from_wrapper(superclient.transport).handle
-            if sock:
-              rlist,wlist,xlist = select.select([sock], [], [], 0)
-              if rlist:
-                # the socket is readable, meaning there is either data from a previous call
-                # (i.e our protocol is out of sync), or the connection was shut down on the
-                # remote side. Either way, we need to reopen the connection
-                superclient.transport.close()
-                superclient.transport.open()
-
-            superclient.set_timeout(self.conf.timeout_seconds)
-            ret = res(*args, **kwargs)
-            return ret
-          except Exception, e:
-            # Stack tends to be only noisy here.
-            logging.info("Thrift saw exception: " + str(e), exc_info=False)
-            msg = "Exception communicating with %s at %s:%d: %s" % (
-              self.conf.service_name, self.conf.host, self.conf.port, str(e))
-            e.response_data = dict(code="THRIFT_EXCEPTION", message=msg, data="")
-            raise
-        finally:
-          _connection_pool.return_client(self.conf.host,self.conf.port,superclient)
-      return wrapper
-    return res
+          # Poke it to see if it's closed on the other end. This can happen if a connection
+          # sits in the connection pool longer than the read timeout of the server.
+          sock = _grab_transport_from_wrapper(superclient.transport).handle
+          if sock:
+            rlist,wlist,xlist = select.select([sock], [], [], 0)
+            if rlist:
+              # the socket is readable, meaning there is either data from a previous call
+              # (i.e our protocol is out of sync), or the connection was shut down on the
+              # remote side. Either way, we need to reopen the connection
+              superclient.transport.close()
+              superclient.transport.open()
+
+          superclient.set_timeout(self.conf.timeout_seconds)
+          return getattr(superclient, attr)(*args, **kwargs)
+        except Exception, e:
+          # Stack tends to be only noisy here.
+          logging.info("Thrift saw exception: " + str(e), exc_info=False)
+          msg = "Exception communicating with %s at %s:%d: %s" % (
+            self.conf.service_name, self.conf.host, self.conf.port, str(e))
+          e.response_data = dict(code="THRIFT_EXCEPTION", message=msg, data="")
+          raise
+      finally:
+        _connection_pool.return_client(self.conf.host,self.conf.port,superclient)
+    return wrapper
 
 
 
@@ -363,14 +583,14 @@ def from_bytes(klass, data):
   """Returns thrift object from a string, using standard binary representation."""
   obj = klass()
   b = TMemoryBuffer(data)
-  p = TBinaryProtocol(b)
+  p = PROTOCOL_CLASS(b)
   obj.read(p)
   return obj
 
 def to_bytes(obj):
   """Creates the standard binary representation of a thrift object."""
   b = TMemoryBuffer()
-  p = TBinaryProtocol(b)
+  p = PROTOCOL_CLASS(b)
   obj.write(p)
   return b.getvalue()
 
@@ -32,6 +32,8 @@ import thrift_util
 from thrift_util import jsonable2thrift, thrift2json
 
 from thrift.server import TServer
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
+from thrift.transport.TTransport import TMemoryBuffer
 from thrift.transport import TSocket
 
 from nose.tools import assert_equal
@@ -132,6 +134,17 @@ class ThriftUtilTest(unittest.TestCase):
     self.assertEquals(thrift_util.to_bytes(struct),
       thrift_util.to_bytes(thrift_util.from_bytes(TestStruct, thrift_util.to_bytes(struct))))
 
+  def test_accelerated_protocol(self):
+    if thrift_util.fastbinary is None:
+      raise SkipTest()
+    self.assertEquals(TBinaryProtocolAccelerated, thrift_util.PROTOCOL_CLASS)
+    # Same wire format as the pure Python protocol
+    struct = TestManyTypes(a_string="hello", a_i64=1 << 40, a_list=[ TestStruct(b=i) for i in range(3) ])
+    buf = TMemoryBuffer()
+    struct.write(TBinaryProtocol(buf))
+    self.assertEquals(buf.getvalue(), thrift_util.to_bytes(struct))
+    self.assertEquals(struct, thrift_util.from_bytes(TestManyTypes, buf.getvalue()))
+
   def test_empty_string_vs_none(self):
     struct1 = TestStruct()
     struct2 = TestStruct()
@@ -158,6 +171,69 @@ class ThriftUtilTest(unittest.TestCase):
     self.assertTrue(hasattr(struct1,"myenumAsString"))
     self.assertEquals(struct1.myenumAsString,'ENUM_ONE')
 
+class FakeClock(object):
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+class ConnectionPoolerTest(unittest.TestCase):
+  def setUp(self):
+    self.clock = FakeClock()
+    self.conf = thrift_util.ConnectionConfig(TestService.Client, "localhost", 1, "Test Service")
+
+  def test_grow_and_shrink(self):
+    pool = thrift_util.ConnectionPooler(min_size=1, max_size=2, idle_timeout=10, clock=self.clock)
+    a = pool.get_client(self.conf)
+    b = pool.get_client(self.conf)
+    self.assertNotEquals(a, b)
+    metrics = pool.metrics()["localhost:1"]
+    self.assertEquals(2, metrics["size"])
+    self.assertEquals(2, metrics["in_use"])
+    self.assertEquals("Test Service", metrics["service"])
+
+    # Full
+    self.assertRaises(socket.timeout, pool.get_client, self.conf, get_client_timeout=0)
+
+    pool.return_client("localhost", 1, a)
+    pool.return_client("localhost", 1, b)
+    # The most recently returned connection is reused.
+    self.assertEquals(b, pool.get_client(self.conf))
+    pool.return_client("localhost", 1, b)
+
+    # Idle connections are closed, down to min_size.
+    self.clock.now = 11
+    self.assertEquals(b, pool.get_client(self.conf))
+    metrics = pool.metrics()["localhost:1"]
+    self.assertEquals(1, metrics["size"])
+    self.assertEquals(0, metrics["idle"])
+    self.assertEquals(4, metrics["calls"])
+    self.assertEquals(4 / 11.0, metrics["calls_per_second"])
+
+  def test_wait_for_client(self):
+    pool = thrift_util.ConnectionPooler(min_size=0, max_size=1, idle_timeout=10)
+    a = pool.get_client(self.conf)
+    got = []
+    thread = threading.Thread(target=lambda: got.append(pool.get_client(self.conf)))
+    thread.start()
+    while not pool.metrics()["localhost:1"]["waiting"]:
+      time.sleep(0.01)
+    pool.return_client("localhost", 1, a)
+    thread.join()
+    self.assertEquals([a], got)
+    self.assertTrue(pool.metrics()["localhost:1"]["max_wait_seconds"] > 0)
+
+  def test_call_async(self):
+    def double(x):
+      return 2 * x
+    futures = [ thrift_util.call_async(double, i) for i in range(5) ]
+    self.assertEquals([0, 2, 4, 6, 8], [ f.result(timeout=10) for f in futures ])
+    self.assertTrue(futures[0].done())
+
+    future = thrift_util.call_async(double, None)
+    self.assertRaises(TypeError, future.result, 10)
+
 class TestJsonable2Thrift(unittest.TestCase):
   """
   Tests a handful of permutations of jsonable2thrift.
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the throughput (rows/sec) and output size of every download
+format in export_csvxls.FORMATS, on rows shaped like Hive results: tab
+separated utf-8 lines. Formats that accept raw rows are also timed on the
+pass-through path, which skips splitting rows into cells.
+"""
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from desktop.lib import export_csvxls
+
+
+def hive_rows(num_rows, num_columns=8):
+  """Tab separated utf-8 rows mixing numbers, short and longer strings."""
+  rows = []
+  for r in xrange(num_rows):
+    cells = []
+    for c in xrange(num_columns):
+      if c % 3 == 0:
+        cells.append(str(r * 7919 + c))
+      elif c % 3 == 1:
+        cells.append("user_%d" % (r % 1000,))
+      else:
+        cells.append("http://www.example.com/path/%d/page?q=caf\xc3\xa9&id=%d" % (r % 97, r))
+    rows.append("\t".join(cells))
+  return rows
+
+
+def _run(formatter, header, rows, raw):
+  """Formats every row; returns the number of bytes produced."""
+  size = len(formatter.init_doc())
+  size += len(formatter.format_header(header))
+  if raw:
+    for row in rows:
+      size += len(formatter.format_raw_row(row, 'utf-8'))
+  else:
+    for row in rows:
+      # As the spool hands rows out for the non-raw formats
+      size += len(formatter.format_row(row.decode('utf-8').split('\t')))
+  size += len(formatter.fini_doc())
+  return size
+
+
+class Command(BaseCommand):
+  """Benchmarks the result download formats."""
+
+  option_list = BaseCommand.option_list + (
+      make_option('-n', '--rows',
+        type=int,
+        default=100000,
+        help='Number of rows to format.'),
+  )
+
+  def handle(self, *args, **options):
+    num_rows = options['rows']
+    rows = hive_rows(num_rows)
+    header = [ "col_%d" % (i,) for i in xrange(8) ]
+
+    runs = []
+    for name in sorted(export_csvxls.FORMATS):
+      make_formatter = export_csvxls.FORMATS[name][0]
+      runs.append((name, make_formatter, False))
+      if make_formatter('utf-8').accepts_raw_rows:
+        runs.append((name + ' (raw)', make_formatter, True))
+
+    results = []
+    for name, make_formatter, raw in runs:
+      start = time.time()
+      size = _run(make_formatter('utf-8'), header, rows, raw)
+      results.append((name, num_rows / max(time.time() - start, 1e-9), size))
+
+    baseline = dict([ (name, (speed, size)) for name, speed, size in results ])['csv']
+    print "%-16s %12s %14s %10s %10s" % ("format", "rows/sec", "bytes", "vs csv", "size")
+    for name, speed, size in results:
+      print "%-16s %12.0f %14d %9.2fx %9.1f%%" % (
+        name, speed, size, speed / baseline[0], 100.0 * size / baseline[1])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the encode/decode throughput of the pure Python and the
+C-accelerated Thrift binary protocols, on payloads shaped like the large
+responses Hue deserializes: an HDFS `ls` of a big directory, a JobTracker
+task list, job counters and a page of Beeswax results.
+"""
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
+from thrift.transport.TTransport import TMemoryBuffer
+
+from desktop.lib import thrift_util
+from hadoop.api.hdfs.ttypes import Stat
+from hadoop.api.jobtracker.ttypes import ThriftJobID, ThriftTaskID, ThriftTaskAttemptID, \
+    ThriftTaskInProgress, ThriftTaskInProgressList, ThriftTaskStatus, ThriftCounter, \
+    ThriftCounterGroup, ThriftGroupList, ThriftJobCounterRollups
+
+try:
+  from beeswaxd.ttypes import Results
+except ImportError:
+  Results = None
+
+
+def _counters(num_groups=4, num_counters=12):
+  groups = []
+  for g in xrange(num_groups):
+    counters = {}
+    for c in xrange(num_counters):
+      name = "COUNTER_%d_%d" % (g, c)
+      counters[name] = ThriftCounter(name=name, displayName="Counter %d of group %d" % (c, g),
+                                     value=c * 123456789)
+    name = "org.apache.hadoop.mapred.Task$Counter%d" % g
+    groups.append(ThriftCounterGroup(name=name, displayName="Group %d" % g, counters=counters))
+  return ThriftGroupList(groups=groups)
+
+
+def ls_payload(num_files=5000):
+  return [ Stat(path="/user/hue/warehouse/big_table/part-%05d" % i, isDir=False,
+                atime=1300000000000 + i, mtime=1300000000000 + i, perms=0644,
+                owner="hue", group="supergroup", length=64 * 1024 * 1024 + i,
+                blockSize=64 * 1024 * 1024, replication=3)
+           for i in xrange(num_files) ]
+
+
+def task_list_payload(num_tasks=500):
+  job_id = ThriftJobID(jobTrackerID="201101010000", jobID=1, asString="job_201101010000_0001")
+  tasks = []
+  for i in xrange(num_tasks):
+    task_id = ThriftTaskID(jobID=job_id, taskType=0, taskID=i,
+                           asString="task_201101010000_0001_m_%06d" % i)
+    attempt_id = ThriftTaskAttemptID(taskID=task_id, attemptID=0,
+                                     asString="attempt_201101010000_0001_m_%06d_0" % i)
+    status = ThriftTaskStatus(taskID=attempt_id, progress=1.0, state=1, diagnosticInfo="",
+                              stateString="Records R/W=1234/1", taskTracker="tracker_host%d" % (i % 50),
+                              startTime=1300000000000, finishTime=1300000060000, outputSize=-1,
+                              phase=1, counters=_counters(2, 10))
+    tasks.append(ThriftTaskInProgress(execStartTime=1300000000000, execFinishTime=1300000060000,
+                                      progress=1.0, startTime=1300000000000, failed=False,
+                                      complete=True, taskID=task_id, tasks=[attempt_id],
+                                      taskStatuses={attempt_id.asString: status},
+                                      taskDiagnosticData={}, counters=_counters(2, 10),
+                                      mostRecentState="SUCCEEDED", runningAttempts=[],
+                                      successfulAttempt=attempt_id.asString))
+  return ThriftTaskInProgressList(tasks=tasks, numTotalTasks=num_tasks * 10)
+
+
+def counters_payload():
+  return ThriftJobCounterRollups(mapCounters=_counters(), reduceCounters=_counters(),
+                                 jobCounters=_counters())
+
+
+def results_payload(num_rows=1000):
+  columns = [ "col_%d" % i for i in xrange(10) ]
+  data = [ "\t".join([ "value %d-%d" % (r, c) for c in xrange(10) ]) for r in xrange(num_rows) ]
+  return Results(ready=True, columns=columns, data=data, start_row=0, has_more=True)
+
+
+def _encode(obj, protocol_class):
+  buf = TMemoryBuffer()
+  if isinstance(obj, list):
+    # Stands in for a list<Stat> response
+    for item in obj:
+      item.write(protocol_class(buf))
+  else:
+    obj.write(protocol_class(buf))
+  return buf.getvalue()
+
+
+def _decode(data, obj, protocol_class):
+  prot = protocol_class(TMemoryBuffer(data))
+  if isinstance(obj, list):
+    result = []
+    for item in obj:
+      decoded = item.__class__()
+      decoded.read(prot)
+      result.append(decoded)
+    return result
+  decoded = obj.__class__()
+  decoded.read(prot)
+  return decoded
+
+
+def _time(func, iterations):
+  start = time.time()
+  for i in xrange(iterations):
+    func()
+  return (time.time() - start) / iterations
+
+
+class Command(BaseCommand):
+  """Benchmarks the Thrift protocols on realistic payloads."""
+
+  option_list = BaseCommand.option_list + (
+      make_option('-n', '--iterations',
+        type=int,
+        default=10,
+        help='Number of times each payload is encoded and decoded.'),
+  )
+
+  def handle(self, *args, **options):
+    iterations = options['iterations']
+    payloads = [
+      ('ls (5000 files)', ls_payload()),
+      ('getTaskList (500 tasks)', task_list_payload()),
+      ('job counters', counters_payload()),
+    ]
+    if Results is not None:
+      payloads.append(('beeswax fetch (1000 rows)', results_payload()))
+
+    protocols = [ TBinaryProtocol ]
+    if thrift_util.fastbinary is not None:
+      protocols.append(TBinaryProtocolAccelerated)
+    else:
+      print "thrift.protocol.fastbinary is not available; only timing the pure Python protocol."
+
+    print "%-28s %-28s %10s %12s %12s" % ("payload", "protocol", "bytes", "encode MB/s", "decode MB/s")
+    for name, obj in payloads:
+      data = _encode(obj, TBinaryProtocol)
+      for protocol_class in protocols:
+        assert _encode(obj, protocol_class) == data
+        assert _decode(data, obj, protocol_class) == obj
+        encode = _time(lambda: _encode(obj, protocol_class), iterations)
+        decode = _time(lambda: _decode(data, obj, protocol_class), iterations)
+        print "%-28s %-28s %10d %12.1f %12.1f" % (
+          name, protocol_class.__name__, len(data),
+          len(data) / encode / 1024 / 1024, len(data) / decode / 1024 / 1024)
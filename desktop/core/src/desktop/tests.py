@@ -27,6 +27,7 @@ import desktop.urls
 import desktop.conf
 import logging
 import time
+import simplejson
 from desktop.lib.django_util import TruncatingModel
 import desktop.views as views
 
@@ -182,6 +183,11 @@ def test_thread_dump():
   response = c.get("/debug/threads")
   assert_true("test_thread_dump" in response.content)
 
+def test_thrift_pools():
+  c = make_logged_in_client()
+  response = c.get("/debug/thrift_pools")
+  assert_true(isinstance(simplejson.loads(response.content), dict))
+
 def test_truncating_model():
   class TinyModel(TruncatingModel):
     short_field = CharField(max_length=10)
@@ -30,6 +30,7 @@ import django.views.debug
 
 from desktop.lib.django_util import login_notrequired, render_json, render
 from desktop.lib.paths import get_desktop_root
+from desktop.lib import thrift_util
 from desktop.log.access import access_log_level, access_warn
 from desktop.models import UserPreferences
 from desktop import appmanager
@@ -198,6 +199,13 @@ def threads(request):
     out.append("")
   return HttpResponse("\n".join(out), content_type="text/plain")
 
+@access_log_level(logging.WARN)
+def thrift_pools(request):
+  """Dumps out the metrics of the Thrift connection pools, as JSON."""
+  if not request.user.is_superuser:
+    return HttpResponse("You must be a superuser.")
+  return render_json(thrift_util.pool_metrics())
+
 @login_notrequired
 def index(request):
   return render("index.mako", request, dict(
@@ -128,6 +128,28 @@ HDFS_CLUSTERS = UnspecifiedConfigSection(
                                    default="hdfs", type=str),
       SECURITY_ENABLED=Config("security_enabled", help="Is running with Kerberos authentication",
                               default=False, type=coerce_bool),
+      READ_AHEAD_THREADS=Config("read_ahead_threads",
+                                help="Number of concurrent datanode reads used when streaming a file",
+                                default=4, type=int),
+      READ_AHEAD_WINDOW=Config("read_ahead_window",
+                               help="Maximum number of bytes buffered ahead of the reader when streaming a file",
+                               default=16*1024*1024, type=int),
+      DN_HEDGED_READ_DELAY=Config("dn_hedged_read_delay",
+                                  help="If set, seconds after which a slow datanode read is also "
+                                       "issued to another replica",
+                                  default=None, type=float),
+      MAX_CONCURRENT_UPLOADS=Config("max_concurrent_uploads",
+                                    help="Number of file uploads that may be written at once; "
+                                         "further uploads wait",
+                                    default=4, type=int),
+      METADATA_CACHE_TTL=Config("metadata_cache_ttl",
+                                help="Seconds for which file and directory stats are shared between "
+                                     "requests. 0 caches them for a single request only; a negative "
+                                     "value disables caching.",
+                                default=0, type=int),
+      METADATA_CACHE_SIZE=Config("metadata_cache_size",
+                                 help="Maximum number of cached file and directory stats",
+                                 default=10000, type=int),
     )
   )
 )
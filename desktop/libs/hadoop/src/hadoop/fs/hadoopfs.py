@@ -18,10 +18,13 @@
 """
 Interfaces for Hadoop filesystem access via the HADOOP-4707 Thrift APIs.
 """
+import bisect
+import copy
 import errno
 import logging
 import os
 import posixpath
+import Queue
 import random
 import stat as statconsts
 import subprocess
@@ -30,6 +33,7 @@ import time
 import urlparse
 import tempfile
 import threading
+from array import array
 
 from thrift.transport import TTransport
 from thrift.transport import TSocket
@@ -38,12 +42,14 @@ from thrift.protocol import TBinaryProtocol
 from django.utils.encoding import smart_str, force_unicode
 from desktop.lib import thrift_util, i18n
 from desktop.lib.conf import validate_port
+from desktop.lib.lru_cache import LRUCache
 from hadoop.api.hdfs import Namenode, Datanode
 from hadoop.api.hdfs.constants import QUOTA_DONT_SET, QUOTA_RESET
 from hadoop.api.common.ttypes import RequestContext, IOException
 import hadoop.conf
 from hadoop.fs import normpath
 from hadoop.fs.exceptions import PermissionDeniedException
+from hadoop.fs.replicas import ReplicaChooser
 
 # SEEK_SET and family is found in posixfile or os, depending on the python version
 if sys.version_info[:2] < (2, 5):
@@ -61,9 +67,32 @@ DEFAULT_USER = "webui"
 # The number of bytes to read if not specified
 DEFAULT_READ_SIZE = 1024*1024 # 1MB
 
-# The buffer size of the pipe to hdfs -put during upload
+# The buffer size of the pipe to hdfs -put during upload, and the size
+# of the chunks FileUpload hands to its writer backend
 WRITE_BUFFER_SIZE = 128*1024 # 128K
 
+# The number of `hadoop -put` processes that may run at once per file system
+DEFAULT_MAX_CONCURRENT_UPLOADS = 4
+# How long (seconds) an upload waits for one of them to finish, when all
+# are running, before giving up
+UPLOAD_SLOT_WAIT = 5
+UPLOAD_SLOT_POLL_INTERVAL = 0.1
+
+# The maximum number of entries in a stat cache (see _metadata_cache)
+DEFAULT_METADATA_CACHE_SIZE = 10000
+# With a metadata_cache_ttl of 0, stats are cached for the duration of the
+# current request only, and never longer than this (seconds).
+REQUEST_METADATA_CACHE_TTL = 10
+
+# The number of concurrent NameNode calls made by the bulk operations
+# (stats_many, rename_many, remove_many)
+DEFAULT_BULK_OP_THREADS = 8
+
+# Defaults for parallel read-ahead (see File.read_ahead). The window bounds
+# the number of bytes that are in flight or waiting to be consumed.
+DEFAULT_READ_AHEAD_THREADS = 4
+DEFAULT_READ_AHEAD_WINDOW = 16*1024*1024 # 16MB
+
 # Class that we translate into PermissionDeniedException
 HADOOP_ACCESSCONTROLEXCEPTION = "org.apache.hadoop.security.AccessControlException"
 
@@ -71,6 +100,16 @@ HADOOP_ACCESSCONTROLEXCEPTION = "org.apache.hadoop.security.AccessControlExcepti
 NN_THRIFT_TIMEOUT = 15
 DN_THRIFT_TIMEOUT = 3
 
+# Per-datanode read statistics, shared by all file systems in the process
+_replica_chooser = ReplicaChooser()
+
+# The number of blocks whose locations are remembered across File handles
+BLOCK_LOCATION_CACHE_SIZE = 10000
+
+# Block locations of recently opened files, shared by all file systems in
+# the process. Keyed by (host, thrift_port, user, path); see File._get_block.
+_block_locations = LRUCache(BLOCK_LOCATION_CACHE_SIZE, sizeof=len)
+
 # Encoding used by HDFS namespace
 HDFS_ENCODING = 'utf-8'
 
@@ -180,7 +219,14 @@ class HadoopFileSystem(object):
                nn_kerberos_principal="hdfs",
                dn_kerberos_principal="hdfs",
                security_enabled=False,
-               hadoop_bin_path="hadoop"):
+               hadoop_bin_path="hadoop",
+               read_ahead_threads=DEFAULT_READ_AHEAD_THREADS,
+               read_ahead_window=DEFAULT_READ_AHEAD_WINDOW,
+               dn_hedged_read_delay=None,
+               max_concurrent_uploads=DEFAULT_MAX_CONCURRENT_UPLOADS,
+               upload_writer=None,
+               metadata_cache_ttl=0,
+               metadata_cache_size=DEFAULT_METADATA_CACHE_SIZE):
     """
     @param host hostname or IP of the namenode
     @param thrift_port port on which the Thrift plugin is listening
@@ -188,6 +234,21 @@ class HadoopFileSystem(object):
     @param hadoop_bin_path path to find the hadoop wrapper script on the
                            installed system - default is fine if it is in
                            the user's PATH env
+    @param read_ahead_threads number of concurrent block reads issued by
+                              File.read_ahead
+    @param read_ahead_window maximum number of bytes File.read_ahead keeps
+                             buffered ahead of the reader
+    @param dn_hedged_read_delay if set, seconds after which a block read
+                                that hasn't returned is also issued to
+                                the next replica
+    @param max_concurrent_uploads number of uploads that may be written at
+                                  once; further uploads wait for a slot
+    @param upload_writer the writer backend class used by FileUpload
+                         (defaults to SubprocessWriter)
+    @param metadata_cache_ttl seconds for which file stats are shared between
+                              requests; 0 caches them for the current
+                              request only, a negative value disables caching
+    @param metadata_cache_size maximum number of cached stats
     """
     self.host = host
     self.thrift_port = thrift_port
@@ -198,6 +259,18 @@ class HadoopFileSystem(object):
     self.hadoop_bin_path = hadoop_bin_path
     self._resolve_hadoop_path()
     self.security_enabled = security_enabled
+    self.read_ahead_threads = read_ahead_threads
+    self.read_ahead_window = read_ahead_window
+    self.dn_hedged_read_delay = dn_hedged_read_delay
+    self.replica_chooser = _replica_chooser
+    self.upload_writer = upload_writer or SubprocessWriter
+    self.upload_slots = threading.BoundedSemaphore(max_concurrent_uploads)
+    self.metadata_cache_ttl = metadata_cache_ttl
+    self.metadata_cache_size = metadata_cache_size
+    if metadata_cache_ttl > 0:
+      self._shared_metadata_cache = LRUCache(metadata_cache_size, ttl=metadata_cache_ttl)
+    else:
+      self._shared_metadata_cache = None
 
     self.nn_client = thrift_util.get_client(
       Namenode.Client, host, thrift_port,
@@ -221,7 +294,13 @@ class HadoopFileSystem(object):
                security_enabled=fs_config.SECURITY_ENABLED.get(),
                nn_kerberos_principal=fs_config.NN_KERBEROS_PRINCIPAL.get(),
                dn_kerberos_principal=fs_config.DN_KERBEROS_PRINCIPAL.get(),
-               hadoop_bin_path=hadoop_bin_path)
+               hadoop_bin_path=hadoop_bin_path,
+               read_ahead_threads=fs_config.READ_AHEAD_THREADS.get(),
+               read_ahead_window=fs_config.READ_AHEAD_WINDOW.get(),
+               dn_hedged_read_delay=fs_config.DN_HEDGED_READ_DELAY.get(),
+               max_concurrent_uploads=fs_config.MAX_CONCURRENT_UPLOADS.get(),
+               metadata_cache_ttl=fs_config.METADATA_CACHE_TTL.get(),
+               metadata_cache_size=fs_config.METADATA_CACHE_SIZE.get())
 
 
   def _get_hdfs_base(self):
@@ -260,6 +339,11 @@ class HadoopFileSystem(object):
       self.request_context.confOptions = {}
     self.thread_local.request_context.confOptions['effective_user'] = user
     self.thread_local.user = user
+    # setuser() is called at the start of every request, which starts a
+    # fresh request-scoped stat cache.
+    if self.metadata_cache_ttl == 0:
+      self.thread_local.metadata_cache = LRUCache(self.metadata_cache_size,
+                                                  ttl=REQUEST_METADATA_CACHE_TTL)
 
   @property
   def user(self):
@@ -273,6 +357,74 @@ class HadoopFileSystem(object):
   def request_context(self):
     return self.thread_local.request_context
 
+  @property
+  def _metadata_cache(self):
+    """
+    The cache of thrift Stat objects, keyed by (user, encoded path), that
+    applies to the current thread, or None if caching is disabled.
+    Only existing paths are cached.
+    """
+    if self._shared_metadata_cache is not None:
+      return self._shared_metadata_cache
+    return getattr(self.thread_local, 'metadata_cache', None)
+
+  def _cache_stat(self, path, stat):
+    cache = self._metadata_cache
+    if cache is not None:
+      cache.put((self.user, path), stat)
+
+  def _cache_ls(self, stats):
+    """Populates the stat cache from the (undecoded) results of an ls."""
+    if self._metadata_cache is None:
+      return
+    for stat in stats:
+      cached = copy.copy(stat)
+      cached.path = decode_fs_path(stat.path)
+      self._cache_stat(normpath(stat.path), cached)
+
+  def _invalidate_metadata(self, path, structural=True):
+    """
+    Forgets cached stats of path, for all users. If the change is
+    structural (the path was created, removed or renamed), its descendants
+    and ancestors are forgotten too.
+
+    Call this once the change is made (even if it failed): stats taken by
+    other threads before then would otherwise be kept.
+
+    Note that request-scoped caches of other threads are not affected.
+    """
+    path = normpath(encode_fs_path(path))
+    if structural:
+      self._invalidate_block_locations(path)
+
+    cache = self._metadata_cache
+    if cache is None:
+      return
+    if not structural:
+      cache.remove_if(lambda key: key[1] == path)
+      return
+
+    prefix = path.rstrip(posixpath.sep) + posixpath.sep
+    ancestors = set()
+    parent = posixpath.dirname(path)
+    while parent not in ancestors:
+      ancestors.add(parent)
+      parent = posixpath.dirname(parent)
+    def affected(key):
+      return key[1] == path or key[1] in ancestors or key[1].startswith(prefix)
+    cache.remove_if(affected)
+
+  def _invalidate_block_locations(self, path):
+    """
+    Forgets the cached block locations of path and its descendants, for all
+    users. (Files that change in place are caught by File's mtime check.)
+    """
+    prefix = path.rstrip(posixpath.sep) + posixpath.sep
+    def affected(key):
+      return key[:2] == (self.host, self.thrift_port) and \
+          (key[3] == path or key[3].startswith(prefix))
+    _block_locations.remove_if(affected)
+
   @_coerce_exceptions
   def open(self, path, mode="r", *args, **kwargs):
     if mode == "w":
@@ -288,8 +440,11 @@ class HadoopFileSystem(object):
     if stat.isDir:
       raise IOError(errno.EISDIR, "Is a directory: %s" % path)
 
-    success = self.nn_client.unlink(
-      self.request_context, normpath(path), recursive=False)
+    try:
+      success = self.nn_client.unlink(
+        self.request_context, normpath(path), recursive=False)
+    finally:
+      self._invalidate_metadata(path)
     if not success:
       raise IOError("Unlink failed")
 
@@ -298,7 +453,10 @@ class HadoopFileSystem(object):
     # TODO(todd) there should be a mkdir that isn't mkdirHIER
     # (this is mkdir -p I think)
     path = encode_fs_path(path)
-    success = self.nn_client.mkdirhier(self.request_context, normpath(path), mode)
+    try:
+      success = self.nn_client.mkdirhier(self.request_context, normpath(path), mode)
+    finally:
+      self._invalidate_metadata(path)
     if not success:
       raise IOError("mkdir failed")
 
@@ -310,8 +468,11 @@ class HadoopFileSystem(object):
     if not stat.isDir:
       raise IOError(errno.EISDIR, "Is not a directory: %s" % (path,))
 
-    success = self.nn_client.unlink(
-      self.request_context, normpath(path), recursive=recursive)
+    try:
+      success = self.nn_client.unlink(
+        self.request_context, normpath(path), recursive=recursive)
+    finally:
+      self._invalidate_metadata(path)
     if not success:
       raise IOError("Unlink failed")
 
@@ -327,12 +488,14 @@ class HadoopFileSystem(object):
   def listdir(self, path):
     path = encode_fs_path(path)
     stats = self.nn_client.ls(self.request_context, normpath(path))
+    self._cache_ls(stats)
     return [self.basename(decode_fs_path(stat.path)) for stat in stats]
 
   @_coerce_exceptions
   def listdir_stats(self, path):
     path = encode_fs_path(path)
     stats = self.nn_client.ls(self.request_context, normpath(path))
+    self._cache_ls(stats)
     return [self._unpack_stat(s) for s in stats]
 
   @_coerce_exceptions
@@ -348,8 +511,12 @@ class HadoopFileSystem(object):
   def rename(self, old, new):
     old = encode_fs_path(old)
     new = encode_fs_path(new)
-    success = self.nn_client.rename(
-      self.request_context, normpath(old), normpath(new))
+    try:
+      success = self.nn_client.rename(
+        self.request_context, normpath(old), normpath(new))
+    finally:
+      self._invalidate_metadata(old)
+      self._invalidate_metadata(new)
     if not success: #TODO(todd) these functions should just throw if failed
       raise IOError("Rename failed")
 
@@ -363,9 +530,106 @@ class HadoopFileSystem(object):
     elif not self.isdir(new_dir):
       raise IOError(errno.ENOTDIR, "'%s' is not a directory" % (new_dir,))
     ls = self.listdir(old_dir)
-    for dirent in ls:
-      self.rename(HadoopFileSystem.join(old_dir, dirent),
-                  HadoopFileSystem.join(new_dir, dirent))
+    pairs = [ (HadoopFileSystem.join(old_dir, dirent), HadoopFileSystem.join(new_dir, dirent))
+              for dirent in ls ]
+    for result, error in self.rename_many(pairs):
+      if error is not None:
+        raise error
+
+  def _map_concurrently(self, func, items, max_threads=DEFAULT_BULK_OP_THREADS):
+    """
+    Calls func(item) for every item, from up to max_threads threads acting
+    as the current user. The calls may run in any order.
+
+    Returns a list of (result, exception) pairs in the order of items;
+    exception is None for the calls that succeeded.
+    """
+    items = list(items)
+    results = [ None ] * len(items)
+
+    def run(i):
+      try:
+        results[i] = (func(items[i]), None)
+      except Exception, e:
+        results[i] = (None, e)
+
+    if len(items) <= 1 or max_threads <= 1:
+      for i in xrange(len(items)):
+        run(i)
+      return results
+
+    work_queue = Queue.Queue()
+    for i in xrange(len(items)):
+      work_queue.put(i)
+    user = self.user
+    def worker():
+      self.setuser(user)
+      while True:
+        try:
+          i = work_queue.get_nowait()
+        except Queue.Empty:
+          return
+        run(i)
+
+    workers = [ threading.Thread(target=worker, name="hdfs-bulk-%d" % (i,))
+                for i in xrange(min(max_threads, len(items))) ]
+    for t in workers:
+      t.start()
+    for t in workers:
+      t.join()
+    return results
+
+  def stats_many(self, paths, max_threads=DEFAULT_BULK_OP_THREADS):
+    """
+    Stats several paths concurrently.
+
+    Returns a list of (stats, exception) pairs in the order of paths, where
+    stats is what stats() returns for the path, or None if it does not exist.
+    """
+    results = self._map_concurrently(self._hadoop_stat, paths, max_threads)
+    ret = []
+    for path, (stat, error) in zip(paths, results):
+      if stat is not None:
+        self._cache_stat(normpath(encode_fs_path(path)), stat)
+        ret.append((self._unpack_stat(stat), None))
+      else:
+        ret.append((None, error))
+    return ret
+
+  def rename_many(self, pairs, max_threads=DEFAULT_BULK_OP_THREADS):
+    """
+    Renames several (old, new) pairs concurrently. The renames may happen
+    in any order, so none of them should depend on another.
+
+    Returns a list of (None, exception) pairs in the order of pairs.
+    """
+    pairs = list(pairs)
+    try:
+      return self._map_concurrently(lambda pair: self.rename(*pair), pairs, max_threads)
+    finally:
+      # The renames ran in other threads, with their own request caches.
+      for old, new in pairs:
+        self._invalidate_metadata(old)
+        self._invalidate_metadata(new)
+
+  def remove_many(self, paths, recursive=False, max_threads=DEFAULT_BULK_OP_THREADS):
+    """
+    Removes several files (or, if recursive, files and directory trees)
+    concurrently.
+
+    Returns a list of (None, exception) pairs in the order of paths.
+    """
+    paths = list(paths)
+    def op(path):
+      if recursive and self.isdir(path):
+        self.rmtree(path)
+      else:
+        self.remove(path)
+    try:
+      return self._map_concurrently(op, paths, max_threads)
+    finally:
+      for path in paths:
+        self._invalidate_metadata(path)
 
   @_coerce_exceptions
   def exists(self, path):
@@ -400,12 +664,18 @@ class HadoopFileSystem(object):
   @_coerce_exceptions
   def chmod(self, path, mode):
     path = encode_fs_path(path)
-    self.nn_client.chmod(self.request_context, normpath(path), mode)
+    try:
+      self.nn_client.chmod(self.request_context, normpath(path), mode)
+    finally:
+      self._invalidate_metadata(path, structural=False)
 
   @_coerce_exceptions
   def chown(self, path, user, group):
     path = encode_fs_path(path)
-    self.nn_client.chown(self.request_context, normpath(path), user, group)
+    try:
+      self.nn_client.chown(self.request_context, normpath(path), user, group)
+    finally:
+      self._invalidate_metadata(path, structural=False)
 
   @_coerce_exceptions
   def get_namenode_info(self):
@@ -435,46 +705,112 @@ class HadoopFileSystem(object):
 
 
   def _hadoop_stat(self, path):
-    """Returns None if file does not exist."""
-    path = encode_fs_path(path)
+    """
+    Returns None if file does not exist. The result may come from the
+    metadata cache, and must not be modified.
+    """
+    path = normpath(encode_fs_path(path))
+    cache = self._metadata_cache
+    if cache is not None:
+      stat = cache.get((self.user, path))
+      if stat is not None:
+        return stat
     try:
-      stat = self.nn_client.stat(self.request_context, normpath(path))
+      stat = self.nn_client.stat(self.request_context, path)
       stat.path = decode_fs_path(stat.path)
-      return stat
     except IOException, ioe:
       if ioe.clazz == 'java.io.FileNotFoundException':
         return None
       raise
+    self._cache_stat(path, stat)
+    return stat
 
   @_coerce_exceptions
-  def _read_block(self, block, offset, len):
+  def _read_block(self, block, offset, length, nodes=None):
     """
-    Reads a chunk of data from the given block from the first available
-    datanode that serves it.
+    Reads a chunk of data from the given block from the best available
+    datanode that serves it, as ranked by the replica chooser.
 
     @param block a thrift Block object
     @param offset offset from the beginning of the block (not file)
-    @param len the number of bytes to read
+    @param length the number of bytes to read
+    @param nodes the replicas to consider (defaults to block.nodes); their
+                 order breaks ties between equally good replicas
     """
-    errs = []
-    unipath = block.path
+    if nodes is None:
+      nodes = block.nodes
+    nodes = self.replica_chooser.order(nodes)
+    # Don't touch the caller's block: it may be shared with other readers.
+    block = copy.copy(block)
     block.path = encode_fs_path(block.path)
-    try:
-      for node in block.nodes:
-        dn_conn = self._connect_dn(node)
-        try:
-          try:
-            data = dn_conn.readBlock(self.request_context, block, offset, len)
-            return data.data
-          except Exception, e:
-            errs.append(e)
-        finally:
-          dn_conn.close()
-    finally:
-      block.path = unipath
+
+    if self.dn_hedged_read_delay is not None and len(nodes) > 1:
+      return self._hedged_read_block(block, offset, length, nodes)
+
+    errs = []
+    for node in nodes:
+      try:
+        return self._read_from_node(node, self.request_context, block, offset, length)
+      except Exception, e:
+        errs.append(e)
 
     raise IOError("Could not read block %s from any replicas: %s" % (block, repr(errs)))
 
+  def _hedged_read_block(self, block, offset, length, nodes):
+    """
+    Like _read_block, but if a replica takes longer than
+    dn_hedged_read_delay, the read is also issued to the next replica.
+    The first successful response wins.
+    """
+    request_context = self.request_context
+    results = Queue.Queue()
+    def attempt(node):
+      try:
+        data = self._read_from_node(node, request_context, block, offset, length)
+        results.put((data, None))
+      except Exception, e:
+        results.put((None, e))
+
+    errs = []
+    remaining = list(nodes)
+    pending = 0
+    while remaining or pending:
+      if remaining:
+        t = threading.Thread(target=attempt, args=(remaining.pop(0),))
+        t.setDaemon(True)
+        t.start()
+        pending += 1
+      try:
+        if remaining:
+          data, err = results.get(timeout=self.dn_hedged_read_delay)
+        else:
+          data, err = results.get()
+      except Queue.Empty:
+        # Slow replica: hedge with the next one.
+        continue
+      pending -= 1
+      if err is None:
+        return data
+      errs.append(err)
+
+    raise IOError("Could not read block %s from any replicas: %s" % (block, repr(errs)))
+
+  def _read_from_node(self, node, request_context, block, offset, length):
+    """Reads from a single datanode, recording the outcome for replica choice."""
+    start = time.time()
+    try:
+      data = self._get_dn_client(node).readBlock(request_context, block, offset, length)
+    except IOException, e:
+      # Permission problems say nothing about the health of the datanode.
+      if e.clazz != HADOOP_ACCESSCONTROLEXCEPTION:
+        self.replica_chooser.record_failure(node)
+      raise
+    except Exception:
+      self.replica_chooser.record_failure(node)
+      raise
+    self.replica_chooser.record_success(node, time.time() - start)
+    return data.data
+
   @_coerce_exceptions
   def set_diskspace_quota(self, path, size):
     """
@@ -578,22 +914,21 @@ class HadoopFileSystem(object):
     # principal, which doesn't exist yet. Todd's working on that.
     return self.nn_client.getDelegationToken(self.request_context, 'hadoop')
 
-  def _connect_dn(self, node):
-    dn_conf = thrift_util.ConnectionConfig(
+  def _get_dn_client(self, node):
+    """
+    Returns a client for the given datanode. Connections come from the
+    shared thrift_util pool, so they (and any SASL handshake) are reused
+    across requests and threads.
+    """
+    return thrift_util.get_client(
       Datanode.Client,
       node.host,
       node.thriftPort,
-      "HDFS Datanode Thrift",
+      service_name="HDFS Datanode Thrift",
       use_sasl=self.security_enabled,
       kerberos_principal=self.dn_kerberos_principal,
       timeout_seconds=DN_THRIFT_TIMEOUT)
 
-    service, protocol, transport = \
-        thrift_util.connect_to_thrift(dn_conf)
-    transport.open()
-    service.close = lambda: transport.close()
-    return service
-
   @staticmethod
   def _unpack_stat(stat):
     """Unpack a Thrift "Stat" object into a dictionary that looks like fs.stat"""
@@ -674,7 +1009,7 @@ class File(object):
     self.path = normpath(path)
     self.pos = 0
     self.closed = False
-    self._block_cache = BlockCache()
+    self._block_cache = None
 
     if buffering or mode != "r":
       raise Exception("buffering and write support not yet implemented") # NYI
@@ -713,16 +1048,38 @@ class File(object):
     return self.pos
 
 
+  def _get_block_cache(self):
+    """
+    Return the BlockCache of this file.
+
+    Block locations are shared with earlier File handles on the same path
+    (opened by the same user), as long as the file has the same
+    modification time and length as it had then.
+    """
+    if self._block_cache is None:
+      stat = self._stat()
+      self._block_cache_key = (self.fs.host, self.fs.thrift_port, self.fs.user,
+                               normpath(encode_fs_path(self.path)))
+      cache = _block_locations.get(self._block_cache_key)
+      if cache is None or not cache.is_valid_for(stat):
+        cache = BlockCache(stat.mtime, stat.length)
+        _block_locations.put(self._block_cache_key, cache)
+      self._block_cache = cache
+    return self._block_cache
+
   def _get_block(self, pos):
     """Return the Block instance that contains the given offset"""
-    cached_block = self._block_cache.find_block(pos)
+    block_cache = self._get_block_cache()
+    cached_block = block_cache.find_block(pos)
     if cached_block:
       return cached_block
 
     # Cache "miss" - fetch ahead 500MB worth of blocks
     new_blocks = self.fs._get_blocks(self.path, pos, 500*1024*1024)
-    self._block_cache.insert_new_blocks(new_blocks)
-    result = self._block_cache.find_block(pos)
+    block_cache.insert_new_blocks(new_blocks)
+    # Put it back so the shared cache accounts for the new blocks.
+    _block_locations.put(self._block_cache_key, block_cache)
+    result = block_cache.find_block(pos)
     if not result:
       raise IOError("No block for position %d in file %s" % (pos, self.path))
 
@@ -750,6 +1107,26 @@ class File(object):
     assert self.pos <= end_pos
     return result
 
+  @require_open
+  def read_ahead(self, length=None, chunk_size=DEFAULT_READ_SIZE):
+    """
+    Generator that reads up to length bytes (or up to EOF) from the current
+    position, yielding the data in order, chunk_size bytes at a time.
+
+    Chunks are fetched concurrently from the datanodes, staying at most
+    fs.read_ahead_window bytes ahead of the consumer.
+    """
+    end_pos = self._stat().length
+    if length is not None:
+      end_pos = min(end_pos, self.pos + length)
+
+    reader = ReadAheadReader(self, self.pos, end_pos, chunk_size,
+                             self.fs.read_ahead_threads,
+                             self.fs.read_ahead_window)
+    for data in reader:
+      self.pos += len(data)
+      yield data
+
   @require_open
   def read(self, length=DEFAULT_READ_SIZE):
     """
@@ -780,11 +1157,97 @@ class File(object):
 class FileUpload(object):
   """A write-only file that supports no seeking and cannot exist prior to
   opening.
+
+  Writes are buffered up to WRITE_BUFFER_SIZE and streamed to a writer
+  backend (fs.upload_writer). bytes_written and throughput() report the
+  progress of the upload, and progress_callback, if given, is called with
+  the FileUpload after every chunk handed to the backend.
   """
-  def __init__(self, fs, path, mode="w", block_size=None):
+  def __init__(self, fs, path, mode="w", block_size=None, progress_callback=None):
+    assert mode == "w"
     self.fs = fs
+    self.path = path
     self.closed = False
-    assert mode == "w"
+    self.bytes_written = 0
+    self.start_time = time.time()
+    self.progress_callback = progress_callback
+    self._buffer = []
+    self._buffered = 0
+    self.writer = fs.upload_writer(fs, path, block_size=block_size)
+
+  def _write_buffer(self):
+    if not self._buffer:
+      return
+    data = "".join(self._buffer)
+    self._buffer = []
+    self._buffered = 0
+    self.writer.write(data)
+    self.bytes_written += len(data)
+    if self.progress_callback is not None:
+      self.progress_callback(self)
+
+  def throughput(self):
+    """Bytes per second handed to the backend so far."""
+    elapsed = time.time() - self.start_time
+    if elapsed <= 0:
+      return 0
+    return self.bytes_written / elapsed
+
+  @require_open
+  def write(self, data):
+    self._buffer.append(data)
+    self._buffered += len(data)
+    if self._buffered >= WRITE_BUFFER_SIZE:
+      self._write_buffer()
+
+  @require_open
+  def close(self):
+    try:
+      try:
+        self._write_buffer()
+      finally:
+        self.closed = True
+        self.writer.close()
+    finally:
+      self.fs._invalidate_metadata(self.path)
+    LOG.info("Completed upload of %s: %d bytes in %.1fs (%d bytes/s)" %
+             (self.path, self.bytes_written, time.time() - self.start_time,
+              self.throughput()))
+
+  @require_open
+  def flush(self):
+    self._write_buffer()
+    self.writer.flush()
+
+
+def _acquire_within(lock, timeout):
+  """
+  Acquires lock (or semaphore), waiting at most timeout seconds.
+  Returns whether it was acquired.
+  """
+  deadline = time.time() + timeout
+  while not lock.acquire(False):
+    if time.time() >= deadline:
+      return False
+    time.sleep(UPLOAD_SLOT_POLL_INTERVAL)
+  return True
+
+
+class SubprocessWriter(object):
+  """
+  Upload backend that pipes the data into `hadoop jar <sudo shell> -put -`.
+
+  Each upload runs a JVM, so at most fs.upload_slots of them run at a
+  time. Further uploads wait up to UPLOAD_SLOT_WAIT for a slot to free up,
+  then raise IOError(EAGAIN).
+
+  Writer backends are constructed with (fs, path, block_size=None) and
+  implement write(data), flush() and close(). close() must raise IOError
+  if the data did not make it to HDFS.
+  """
+  def __init__(self, fs, path, block_size=None):
+    self.fs = fs
+    self.path = path
     extra_confs = []
     if block_size:
       extra_confs.append("-Ddfs.block.size=%d" % block_size)
@@ -806,28 +1269,51 @@ class FileUpload(object):
     if hadoop.conf.HADOOP_CONF_DIR.get():
       self.subprocess_env['HADOOP_CONF_DIR'] = hadoop.conf.HADOOP_CONF_DIR.get()
 
-    self.path = path
-    self.putter = subprocess.Popen(self.subprocess_cmd,
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   close_fds=True,
-                                   env=self.subprocess_env,
-                                   bufsize=WRITE_BUFFER_SIZE)
-  @require_open
+    self._slots = fs.upload_slots
+    if not _acquire_within(self._slots, UPLOAD_SLOT_WAIT):
+      raise IOError(errno.EAGAIN, "Too many concurrent uploads, retry later")
+    self._has_slot = True
+    try:
+      self.putter = subprocess.Popen(self.subprocess_cmd,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     close_fds=True,
+                                     env=self.subprocess_env,
+                                     bufsize=WRITE_BUFFER_SIZE)
+    except:
+      self._release_slot()
+      raise
+
+  def _release_slot(self):
+    if self._has_slot:
+      self._has_slot = False
+      self._slots.release()
+
+  def __del__(self):
+    # Don't leak the slot if the upload is abandoned without close().
+    if getattr(self, '_has_slot', False):
+      self._release_slot()
+
   def write(self, data):
     self.putter.stdin.write(data)
 
-  @require_open
+  def flush(self):
+    self.putter.stdin.flush()
+
   def close(self):
     try:
-      (stdout, stderr) = self.putter.communicate()
-    except IOError, ioe:
-      logging.debug("Saw IOError writing %r" % self.path, exc_info=1)
-      if ioe.errno == errno.EPIPE:
-        stdout, stderr = self.putter.communicate()
+      try:
+        (stdout, stderr) = self.putter.communicate()
+      except IOError, ioe:
+        logging.debug("Saw IOError writing %r" % self.path, exc_info=1)
+        if ioe.errno == errno.EPIPE:
+          stdout, stderr = self.putter.communicate()
+        else:
+          raise
+    finally:
+      self._release_slot()
 
-    self.closed = True
     if stderr:
       LOG.warn("HDFS FileUpload (cmd='%s', env='%s') outputted stderr:\n%s" %
                    (repr(self.subprocess_cmd), repr(self.subprocess_env), stderr))
@@ -837,11 +1323,143 @@ class FileUpload(object):
     if self.putter.returncode != 0:
       raise IOError("hdfs put returned bad code: %d\nstderr: %s" %
                     (self.putter.returncode, stderr))
-    LOG.info("Completed upload: %s" % repr(self.subprocess_cmd))
+    LOG.debug("Completed upload: %s" % repr(self.subprocess_cmd))
 
-  @require_open
-  def flush(self):
-    self.putter.stdin.flush()
+
+class ReadAheadReader(object):
+  """
+  Iterates over the bytes [start, end) of an open File, issuing readBlock
+  calls from a bounded pool of worker threads.
+
+  The range is cut into slices that never cross a block boundary. Slices
+  are spread across the replicas of each block and handed back in file
+  order. No more than `window` bytes are ever in flight or waiting to be
+  consumed, regardless of the length of the range.
+  """
+
+  def __init__(self, file, start, end, chunk_size=DEFAULT_READ_SIZE,
+               num_threads=DEFAULT_READ_AHEAD_THREADS,
+               window=DEFAULT_READ_AHEAD_WINDOW):
+    self.file = file
+    self.fs = file.fs
+    self.start = start
+    self.end = end
+    self.chunk_size = max(chunk_size, 1)
+    self.num_threads = max(num_threads, 1)
+    self.window = window
+
+  def _slices(self):
+    """Generates (block, in_block_offset, length) tuples covering the range."""
+    pos = self.start
+    while pos < self.end:
+      block = self.file._get_block(pos)
+      in_block_pos = pos - block.startOffset
+      length = min(self.chunk_size,
+                   block.numBytes - in_block_pos,
+                   self.end - pos)
+      yield block, in_block_pos, length
+      pos += length
+
+  def _worker(self, user, work_queue, result_queue):
+    # The request context is thread-local, so adopt the reader's user.
+    self.fs.setuser(user)
+    while True:
+      item = work_queue.get()
+      if item is None:
+        return
+      idx, block, offset, length = item
+      try:
+        # Rotate the replicas so that consecutive slices of one block are
+        # served by different datanodes.
+        nodes = block.nodes[idx % len(block.nodes):] + block.nodes[:idx % len(block.nodes)]
+        parts = []
+        read_so_far = 0
+        while read_so_far < length:
+          data = self.fs._read_block(block, offset + read_so_far,
+                                     length - read_so_far, nodes=nodes)
+          if not data:
+            raise IOError("Unexpected end of block %s at offset %d" %
+                          (block.blockId, offset + read_so_far))
+          parts.append(data)
+          read_so_far += len(data)
+        result_queue.put((idx, "".join(parts), None))
+      except Exception:
+        result_queue.put((idx, None, sys.exc_info()))
+
+  def __iter__(self):
+    if self.start >= self.end:
+      return
+
+    work_queue = Queue.Queue()
+    result_queue = Queue.Queue()
+    workers = _WorkerStopper(work_queue)
+    for i in xrange(self.num_threads):
+      t = threading.Thread(target=self._worker,
+                           args=(self.fs.user, work_queue, result_queue),
+                           name="hdfs-read-ahead-%d" % (i,))
+      t.setDaemon(True)
+      t.start()
+      workers.append(t)
+
+    slices = self._slices()
+    lengths = {}    # idx -> length of slices submitted but not yet yielded
+    finished = {}   # idx -> data of slices read but not yet yielded
+    buffered = 0
+    next_submit = 0
+    next_yield = 0
+    exhausted = False
+    while True:
+      try:
+        # Keep the window full, but always allow at least one slice.
+        while not exhausted and (not lengths or buffered < self.window):
+          try:
+            block, offset, length = slices.next()
+          except StopIteration:
+            exhausted = True
+            break
+          work_queue.put((next_submit, block, offset, length))
+          lengths[next_submit] = length
+          buffered += length
+          next_submit += 1
+
+        if next_yield == next_submit:
+          break
+
+        while next_yield not in finished:
+          idx, data, exc_info = result_queue.get()
+          if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+          finished[idx] = data
+      except:
+        workers.stop()
+        raise
+
+      data = finished.pop(next_yield)
+      buffered -= lengths.pop(next_yield)
+      next_yield += 1
+      yield data
+    workers.stop()
+
+
+class _WorkerStopper(list):
+  """
+  The worker threads of a ReadAheadReader iteration. They are told to exit
+  when stop() is called, or when the iteration is abandoned and this list
+  is garbage collected.
+  """
+  def __init__(self, work_queue):
+    list.__init__(self)
+    self.work_queue = work_queue
+    self.stopped = False
+
+  def stop(self):
+    if not self.stopped:
+      self.stopped = True
+      for t in self:
+        self.work_queue.put(None)
+
+  def __del__(self):
+    self.stop()
 
 
 def _block_contains_pos(block, pos):
@@ -850,35 +1468,49 @@ def _block_contains_pos(block, pos):
 
 class BlockCache(object):
   """
-  A cache of block locations used by a single HDFS input file.
-  Essentially this keeps the blocks in sorted order and does
-  binary search to find the block that contains a given offset.
+  A cache of block locations of a single HDFS file.
+  Essentially this keeps the blocks in sorted order, along with a compact
+  array of their start offsets, and bisects the array to find the block
+  that contains a given offset.
   It also provides the ability to merge in the response of a NN
   getBlocks response to the cache.
+
+  mtime and length are those of the file the blocks belong to, if known.
+  The cache may be shared between threads.
   """
 
-  def __init__(self):
-    self.blocks = []
+  def __init__(self, mtime=None, length=None):
+    self.mtime = mtime
+    self.length = length
+    # (offsets, blocks), replaced as a whole so readers never see the two
+    # out of step. Offsets are doubles, which hold any file offset exactly
+    # whatever the size of the platform's long.
+    self._index = (array('d'), [])
+
+  @property
+  def blocks(self):
+    return self._index[1]
+
+  def __len__(self):
+    return len(self._index[1])
 
-  def find_block(self, pos, _min_idx=0, _max_idx=None):
+  def is_valid_for(self, stat):
+    """True if the cached blocks belong to the file described by stat."""
+    return self.mtime == stat.mtime and self.length == stat.length
+
+  def find_block(self, pos):
     """
     Return the Block object that contains the specified
     position pos, or None if it is not in the cache.
     """
-    if _max_idx is None:
-      _max_idx = len(self.blocks) - 1
-
-    if _max_idx < _min_idx:
+    offsets, blocks = self._index
+    idx = bisect.bisect_right(offsets, pos) - 1
+    if idx < 0:
       return None
-
-    pivot_idx = (_max_idx + _min_idx) / 2
-    pivot_block = self.blocks[pivot_idx]
-    if pos < pivot_block.startOffset:
-      return self.find_block(pos, _min_idx, pivot_idx - 1)
-    elif pos >= pivot_block.startOffset + pivot_block.numBytes:
-      return self.find_block(pos, pivot_idx + 1, _max_idx)
-    else:
-      return pivot_block
+    block = blocks[idx]
+    if pos < block.startOffset + block.numBytes:
+      return block
+    return None
 
   def insert_new_blocks(self, new_blocks):
     """
@@ -899,7 +1531,7 @@ class BlockCache(object):
 
     # Convert back to sorted list
     block_list = blocks_dict.values()
-    block_list.sort(cmp=lambda a,b: cmp(a.startOffset, b.startOffset))
+    block_list.sort(key=lambda b: b.startOffset)
 
     # Update cache with new data
-    self.blocks = block_list
+    self._index = (array('d', [ b.startOffset for b in block_list ]), block_list)
@@ -20,14 +20,22 @@ Tests for Hadoop FS.
 """
 from nose.tools import assert_false, assert_true, assert_equals, assert_raises
 from nose.plugins.attrib import attr
+import errno
 import logging
 import posixfile
 import random
+import sys
+import threading
 from threading import Thread
 
+from desktop.lib import thrift_util
 from hadoop import mini_cluster
+from hadoop.api.common.ttypes import IOException
+from hadoop.api.hdfs.ttypes import Block, Stat
 from hadoop.fs.exceptions import PermissionDeniedException
-from hadoop.fs.hadoopfs import HadoopFileSystem
+from hadoop.fs import hadoopfs
+from hadoop.fs.hadoopfs import HadoopFileSystem, ReadAheadReader, BlockCache, SubprocessWriter, \
+    WRITE_BUFFER_SIZE
 
 LOG = logging.getLogger(__name__)
 
@@ -109,6 +117,367 @@ def test_seek_across_blocks():
   finally:
     cluster.shutdown()
 
+@attr('requires_hadoop')
+def test_read_ahead_across_blocks():
+  """Streams a file with many blocks through the parallel reader"""
+  cluster = mini_cluster.shared_cluster()
+  try:
+    fs = cluster.fs
+    fs.setuser(cluster.superuser)
+    f = fs.open("/fortest-readahead.txt", "w", block_size=1024)
+    try:
+      data = "abcdefghijklmnopqrstuvwxyz" * 3000
+      f.write(data)
+      f.close()
+
+      f = fs.open("/fortest-readahead.txt", "r")
+      assert_equals(data, "".join(f.read_ahead(chunk_size=300)))
+      assert_equals(len(data), f.tell())
+
+      f.seek(5000)
+      assert_equals(data[5000:7000], "".join(f.read_ahead(2000, chunk_size=700)))
+      assert_equals(data[7000:7010], f.read(10))
+      f.close()
+    finally:
+      fs.remove("/fortest-readahead.txt")
+  finally:
+    cluster.shutdown()
+
+@attr('requires_hadoop')
+def test_datanode_connections_are_pooled():
+  cluster = mini_cluster.shared_cluster()
+  try:
+    fs = cluster.fs
+    fs.setuser(cluster.superuser)
+    f = fs.open("/fortest-dnpool.txt", "w")
+    try:
+      f.write("hello")
+      f.close()
+
+      assert_equals("hello", fs.open("/fortest-dnpool.txt").read())
+      block = fs._get_blocks("/fortest-dnpool.txt", 0, 5)[0]
+      endpoints = [ (node.host, node.thriftPort) for node in block.nodes ]
+      assert_true([ e for e in endpoints if e in thrift_util._connection_pool.pooldict ])
+      # Reads keep working over the reused connections
+      for i in xrange(3):
+        assert_equals("ell", fs.open("/fortest-dnpool.txt").read()[1:4])
+    finally:
+      fs.remove("/fortest-dnpool.txt")
+  finally:
+    cluster.shutdown()
+
+
+class _FakeBlock(object):
+  def __init__(self, blockId, startOffset, numBytes, nodes):
+    self.blockId = blockId
+    self.startOffset = startOffset
+    self.numBytes = numBytes
+    self.nodes = nodes
+
+
+class _FakeReadAheadFs(object):
+  """Serves blocks of `data` and records the peak number of buffered bytes"""
+  def __init__(self, data, block_size):
+    self.data = data
+    self.user = "test"
+    self.blocks = [ _FakeBlock(i, off, min(block_size, len(data) - off), ["dn1", "dn2"])
+                    for i, off in enumerate(xrange(0, len(data), block_size)) ]
+
+  def setuser(self, user):
+    assert_equals("test", user)
+
+  def _read_block(self, block, offset, length, nodes=None):
+    assert_true(offset + length <= block.numBytes)
+    start = block.startOffset + offset
+    # Short reads must be retried by the reader.
+    return self.data[start:start + min(length, 100)]
+
+
+class _FakeReadAheadFile(object):
+  def __init__(self, fs):
+    self.fs = fs
+
+  def _get_block(self, pos):
+    for block in self.fs.blocks:
+      if block.startOffset <= pos < block.startOffset + block.numBytes:
+        return block
+
+
+def test_read_ahead_reader():
+  data = "".join(chr(i % 256) for i in xrange(10000))
+  f = _FakeReadAheadFile(_FakeReadAheadFs(data, 1024))
+  for window in (1, 500, 4096, 1 << 20):
+    chunks = list(ReadAheadReader(f, 0, len(data), chunk_size=300,
+                                  num_threads=3, window=window))
+    assert_equals(data, "".join(chunks))
+    assert_true(max(len(c) for c in chunks) <= 300)
+  assert_equals(data[1000:3050], "".join(ReadAheadReader(f, 1000, 3050, chunk_size=4096)))
+  assert_equals([], list(ReadAheadReader(f, 10, 10)))
+
+  # Abandoning an iteration stops its workers.
+  it = iter(ReadAheadReader(f, 0, len(data), chunk_size=300, num_threads=3))
+  it.next()
+  workers = [ t for t in threading.enumerate() if t.getName().startswith("hdfs-read-ahead") ]
+  assert_equals(3, len(workers))
+  del it
+  for t in workers:
+    t.join(10)
+    assert_false(t.isAlive())
+
+
+class _FakeWriter(object):
+  written = {}
+
+  def __init__(self, fs, path, block_size=None):
+    self.path = path
+    self.chunks = []
+    fs.upload_slots.acquire()
+    self.fs = fs
+
+  def write(self, data):
+    self.chunks.append(data)
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.fs.upload_slots.release()
+    _FakeWriter.written[self.path] = self.chunks
+
+
+def test_file_upload_buffering():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable,
+                        max_concurrent_uploads=1, upload_writer=_FakeWriter)
+  progress = []
+  f = fs.open("/upload.txt", "w", progress_callback=lambda u: progress.append(u.bytes_written))
+  for i in xrange(10):
+    f.write("a" * (WRITE_BUFFER_SIZE / 4))
+  assert_equals([WRITE_BUFFER_SIZE, 2 * WRITE_BUFFER_SIZE], progress)
+  # The single upload slot is taken until the upload is closed.
+  assert_false(fs.upload_slots.acquire(False))
+  f.close()
+  assert_true(fs.upload_slots.acquire(False))
+  fs.upload_slots.release()
+
+  chunks = _FakeWriter.written["/upload.txt"]
+  assert_equals(3, len(chunks))
+  assert_equals("a" * (10 * (WRITE_BUFFER_SIZE / 4)), "".join(chunks))
+  assert_equals(10 * (WRITE_BUFFER_SIZE / 4), f.bytes_written)
+  assert_raises(IOError, f.write, "more")
+
+
+def test_upload_slots_exhausted():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable, max_concurrent_uploads=1)
+  fs.setuser("test")
+  fs.upload_slots.acquire()
+  wait = hadoopfs.UPLOAD_SLOT_WAIT
+  hadoopfs.UPLOAD_SLOT_WAIT = 0.2
+  try:
+    # Uploads don't wait for long for a JVM to finish
+    try:
+      SubprocessWriter(fs, "/upload.txt")
+      assert_true(False)
+    except IOError, e:
+      assert_equals(errno.EAGAIN, e.errno)
+  finally:
+    hadoopfs.UPLOAD_SLOT_WAIT = wait
+    fs.upload_slots.release()
+
+
+class _FakeNamenode(object):
+  """Counts stat/ls calls against a flat namespace of path -> isDir"""
+  def __init__(self, paths):
+    self.paths = paths
+    self.calls = []
+
+  def _stat(self, path):
+    return Stat(path=path, isDir=self.paths[path], atime=0, mtime=0, perms=0755,
+                owner="test", group="test", length=0)
+
+  def stat(self, ctx, path):
+    self.calls.append(("stat", path))
+    if path not in self.paths:
+      raise IOException(clazz='java.io.FileNotFoundException')
+    return self._stat(path)
+
+  def ls(self, ctx, path):
+    self.calls.append(("ls", path))
+    return [ self._stat(p) for p in sorted(self.paths) if p != path and p.startswith(path) ]
+
+  def rename(self, ctx, old, new):
+    self.paths[new] = self.paths.pop(old)
+    return True
+
+  def chmod(self, ctx, path, mode):
+    pass
+
+  def unlink(self, ctx, path, recursive):
+    del self.paths[path]
+    return True
+
+
+def test_metadata_cache():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable)
+  nn = fs.nn_client = _FakeNamenode({"/d": True, "/d/a": False, "/d/b": False})
+  fs.setuser("test")
+
+  assert_true(fs.isdir("/d"))
+  assert_true(fs.exists("/d/"))
+  assert_equals([("stat", "/d")], nn.calls)
+
+  # ls populates the stats of the children
+  assert_equals(2, len(fs.listdir_stats("/d")))
+  assert_true(fs.isfile("/d/a"))
+  assert_equals(0755, fs.stats("/d/b")["mode"] & 0777)
+  assert_equals([("stat", "/d"), ("ls", "/d")], nn.calls)
+
+  # Missing files are not cached
+  assert_false(fs.exists("/d/c"))
+  assert_false(fs.exists("/d/c"))
+  assert_equals(2, len([ c for c in nn.calls if c == ("stat", "/d/c") ]))
+
+  # Changes forget the affected paths and their parents
+  fs.rename("/d/a", "/d/c")
+  del nn.calls[:]
+  assert_false(fs.exists("/d/a"))
+  assert_true(fs.isfile("/d/c"))
+  assert_true(fs.isfile("/d/b"))
+  assert_true(fs.isdir("/d"))
+  assert_equals([("stat", "/d/a"), ("stat", "/d/c"), ("stat", "/d")], nn.calls)
+
+  fs.chmod("/d/b", 0700)
+  del nn.calls[:]
+  fs.stats("/d/b")
+  fs.stats("/d")
+  assert_equals([("stat", "/d/b")], nn.calls)
+
+  # Each request starts afresh
+  fs.setuser("test")
+  del nn.calls[:]
+  fs.stats("/d")
+  assert_equals([("stat", "/d")], nn.calls)
+
+
+def test_metadata_cache_stat_during_change():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable)
+  nn = fs.nn_client = _FakeNamenode({"/d": True, "/d/a": False})
+  fs.setuser("test")
+
+  # A stat taken while the NameNode is being changed isn't kept
+  rename = nn.rename
+  def racing_rename(ctx, old, new):
+    assert_true(fs.exists(old))
+    return rename(ctx, old, new)
+  nn.rename = racing_rename
+  fs.rename("/d/a", "/d/b")
+  assert_false(fs.exists("/d/a"))
+  fs.setuser("test")
+  assert_false(fs.exists("/d/a"))
+
+
+def test_bulk_operations():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable)
+  files = dict(("/src/f%d" % i, False) for i in xrange(50))
+  files.update({"/src": True, "/dst": True})
+  nn = fs.nn_client = _FakeNamenode(files)
+  fs.setuser("test")
+
+  paths = [ "/src/f%d" % i for i in xrange(50) ] + [ "/src/missing" ]
+  results = fs.stats_many(paths, max_threads=4)
+  assert_equals(paths[:-1], [ stats["path"] for stats, error in results[:-1] ])
+  assert_equals((None, None), results[-1])
+  # Results are cached for the calling thread
+  del nn.calls[:]
+  fs.stats("/src/f7")
+  assert_equals([], nn.calls)
+
+  pairs = [ ("/src/f%d" % i, "/dst/f%d" % i) for i in xrange(40) ] + [ ("/src/missing", "/dst/x") ]
+  results = fs.rename_many(pairs)
+  assert_equals([(None, None)] * 40, results[:-1])
+  assert_true(isinstance(results[-1][1], KeyError))
+  assert_false(fs.exists("/src/f7"))
+  assert_true(fs.isfile("/dst/f7"))
+
+  fs.rename_star("/src", "/dst")
+  assert_equals(sorted("/dst/f%d" % i for i in xrange(50)), sorted(p for p in nn.paths if p.startswith("/dst/")))
+
+  results = fs.remove_many(["/dst/f1", "/dst/f2", "/dst/nope"])
+  assert_equals([(None, None), (None, None)], results[:2])
+  assert_true(isinstance(results[2][1], IOError))
+  assert_false(fs.exists("/dst/f1"))
+
+
+def test_metadata_cache_disabled():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable, metadata_cache_ttl=-1)
+  nn = fs.nn_client = _FakeNamenode({"/d": True})
+  fs.setuser("test")
+  fs.isdir("/d")
+  fs.isdir("/d")
+  assert_equals(2, len(nn.calls))
+
+
+def test_block_cache():
+  cache = BlockCache(mtime=1, length=300)
+  assert_equals(None, cache.find_block(0))
+  cache.insert_new_blocks([ Block(blockId=i, startOffset=i * 100, numBytes=100) for i in (2, 0) ])
+  assert_equals(0, cache.find_block(0).blockId)
+  assert_equals(0, cache.find_block(99).blockId)
+  assert_equals(None, cache.find_block(100))
+  assert_equals(2, cache.find_block(299).blockId)
+  assert_equals(None, cache.find_block(300))
+  cache.insert_new_blocks([ Block(blockId=1, startOffset=100, numBytes=100) ])
+  assert_equals([0, 1, 2], [ b.blockId for b in cache.blocks ])
+  assert_equals(1, cache.find_block(150).blockId)
+  assert_true(cache.is_valid_for(Stat(mtime=1, length=300)))
+  assert_false(cache.is_valid_for(Stat(mtime=2, length=300)))
+
+
+class _FakeBlockNamenode(_FakeNamenode):
+  """A namenode whose files are 3 blocks of 100 bytes, counting getBlocks calls"""
+  def __init__(self, paths):
+    _FakeNamenode.__init__(self, paths)
+    self.mtime = 0
+
+  def _stat(self, path):
+    stat = _FakeNamenode._stat(self, path)
+    stat.mtime = self.mtime
+    stat.length = 300
+    return stat
+
+  def getBlocks(self, ctx, path, offset, length):
+    self.calls.append(("getBlocks", path))
+    return [ Block(path=path, blockId=i, startOffset=i * 100, numBytes=100) for i in range(3) ]
+
+
+def test_block_locations_shared():
+  fs = HadoopFileSystem("localhost", 1, hadoop_bin_path=sys.executable, metadata_cache_ttl=-1)
+  nn = fs.nn_client = _FakeBlockNamenode({"/d": True, "/d/blocks": False})
+  fs.setuser("test")
+
+  def get_blocks_calls():
+    return len([ c for c in nn.calls if c[0] == "getBlocks" ])
+
+  assert_equals(1, fs.open("/d/blocks")._get_block(150).blockId)
+  assert_equals(2, fs.open("/d/blocks")._get_block(250).blockId)
+  assert_equals(1, get_blocks_calls())
+
+  # Another user does not get to see them.
+  fs.setuser("other")
+  fs.open("/d/blocks")._get_block(0)
+  assert_equals(2, get_blocks_calls())
+
+  # The file changed
+  fs.setuser("test")
+  nn.mtime = 1
+  fs.open("/d/blocks")._get_block(0)
+  assert_equals(3, get_blocks_calls())
+
+  # The file (or its directory) moved
+  fs.rename("/d", "/e")
+  fs.rename("/e", "/d")
+  fs.open("/d/blocks")._get_block(0)
+  assert_equals(4, get_blocks_calls())
+
 
 @attr('requires_hadoop')
 def test_exceptions():
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Adaptive choice of the datanode replica to read a block from.
+
+Datanodes are scored by the latency and failures of the reads issued to
+them. The scores live in a process-wide table, so what one request learns
+about a slow or dead datanode benefits every other request.
+"""
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# Weight of the newest sample in the moving average of read latencies
+LATENCY_DECAY = 0.3
+
+# Replicas within this factor of the fastest one are considered equally
+# good, and keep the order the caller gave them in.
+LATENCY_TOLERANCE = 1.5
+
+# Consecutive failures after which a datanode is blacklisted
+MAX_CONSECUTIVE_FAILURES = 2
+
+# How long (seconds) a failing datanode is avoided
+BLACKLIST_SECONDS = 60
+
+
+class _NodeStats(object):
+  """Struct-like record of what we know about one datanode."""
+  def __init__(self):
+    self.latency = None
+    self.successes = 0
+    self.failures = 0
+    self.consecutive_failures = 0
+    self.blacklisted_until = 0
+
+
+class ReplicaChooser(object):
+  """
+  Thread-safe table of per-datanode read statistics.
+
+  order() sorts the replicas of a block so that the fastest healthy ones
+  come first and blacklisted ones come last. Blacklisted datanodes are
+  still tried as a last resort, so a read never fails just because
+  every replica has been misbehaving.
+  """
+
+  def __init__(self, latency_decay=LATENCY_DECAY,
+               latency_tolerance=LATENCY_TOLERANCE,
+               max_consecutive_failures=MAX_CONSECUTIVE_FAILURES,
+               blacklist_seconds=BLACKLIST_SECONDS,
+               clock=time.time):
+    self.latency_decay = latency_decay
+    self.latency_tolerance = latency_tolerance
+    self.max_consecutive_failures = max_consecutive_failures
+    self.blacklist_seconds = blacklist_seconds
+    self.clock = clock
+    self._stats = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def node_key(node):
+    return (node.host, node.thriftPort)
+
+  def _get_stats(self, node):
+    key = self.node_key(node)
+    stats = self._stats.get(key)
+    if stats is None:
+      stats = self._stats[key] = _NodeStats()
+    return stats
+
+  def record_success(self, node, seconds):
+    self._lock.acquire()
+    try:
+      stats = self._get_stats(node)
+      if stats.latency is None:
+        stats.latency = seconds
+      else:
+        stats.latency += self.latency_decay * (seconds - stats.latency)
+      stats.successes += 1
+      stats.consecutive_failures = 0
+      stats.blacklisted_until = 0
+    finally:
+      self._lock.release()
+
+  def record_failure(self, node):
+    self._lock.acquire()
+    try:
+      stats = self._get_stats(node)
+      stats.failures += 1
+      stats.consecutive_failures += 1
+      if stats.consecutive_failures >= self.max_consecutive_failures:
+        if not self.is_blacklisted(node, _stats=stats):
+          LOG.warn("Avoiding datanode %s:%s for %d seconds after %d failures" %
+                   (node.host, node.thriftPort, self.blacklist_seconds,
+                    stats.consecutive_failures))
+        stats.blacklisted_until = self.clock() + self.blacklist_seconds
+    finally:
+      self._lock.release()
+
+  def is_blacklisted(self, node, _stats=None):
+    stats = _stats or self._stats.get(self.node_key(node))
+    return stats is not None and stats.blacklisted_until > self.clock()
+
+  def latency(self, node):
+    """Average read latency (seconds) of the node, or None if unknown."""
+    stats = self._stats.get(self.node_key(node))
+    return stats and stats.latency
+
+  def order(self, nodes):
+    """
+    Returns the given replicas, best first.
+
+    Healthy nodes within latency_tolerance of the fastest node come first,
+    in the order they were given; then nodes we know nothing about yet;
+    then slower nodes, fastest first; blacklisted nodes come last.
+    """
+    healthy = [ n for n in nodes if not self.is_blacklisted(n) ]
+    blacklisted = [ n for n in nodes if self.is_blacklisted(n) ]
+
+    unknown = [ n for n in healthy if self.latency(n) is None ]
+    known = [ n for n in healthy if self.latency(n) is not None ]
+    if not known:
+      return unknown + blacklisted
+    cutoff = min([ self.latency(n) for n in known ]) * self.latency_tolerance
+
+    good = [ n for n in known if self.latency(n) <= cutoff ]
+    slow = [ n for n in known if self.latency(n) > cutoff ]
+    slow.sort(key=self.latency)
+    return good + unknown + slow + blacklisted
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._stats.clear()
+    finally:
+      self._lock.release()
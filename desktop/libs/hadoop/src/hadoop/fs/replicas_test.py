@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Tests for datanode replica choice.
+"""
+from nose.tools import assert_equals, assert_true, assert_false
+
+from hadoop.api.hdfs.ttypes import DatanodeInfo
+from hadoop.fs.replicas import ReplicaChooser
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+def _nodes(*names):
+  return [ DatanodeInfo(name=n, host=n, thriftPort=1234) for n in names ]
+
+
+def _names(nodes):
+  return [ n.host for n in nodes ]
+
+
+def test_order_prefers_fast_nodes():
+  chooser = ReplicaChooser(clock=FakeClock())
+  a, b, c = _nodes("a", "b", "c")
+  # Unknown nodes keep their order
+  assert_equals(["a", "b", "c"], _names(chooser.order([a, b, c])))
+
+  chooser.record_success(a, 2.0)
+  chooser.record_success(b, 0.1)
+  chooser.record_success(c, 0.12)
+  # b and c are about as fast, so the caller's order is kept between them.
+  assert_equals(["c", "b", "a"], _names(chooser.order([c, a, b])))
+  assert_equals(["b", "c", "a"], _names(chooser.order([a, b, c])))
+
+  # Nodes we know nothing about rank after the fast ones.
+  d, = _nodes("d")
+  assert_equals(["b", "c", "d", "a"], _names(chooser.order([d, a, b, c])))
+
+
+def test_blacklist():
+  clock = FakeClock()
+  chooser = ReplicaChooser(clock=clock, max_consecutive_failures=2, blacklist_seconds=60)
+  a, b = _nodes("a", "b")
+  chooser.record_success(a, 0.1)
+  chooser.record_success(b, 1.0)
+
+  chooser.record_failure(a)
+  assert_false(chooser.is_blacklisted(a))
+  chooser.record_failure(a)
+  assert_true(chooser.is_blacklisted(a))
+  assert_equals(["b", "a"], _names(chooser.order([a, b])))
+
+  clock.now += 61
+  assert_false(chooser.is_blacklisted(a))
+  assert_equals(["a", "b"], _names(chooser.order([a, b])))
+
+  # A success clears the failure count.
+  chooser.record_failure(a)
+  chooser.record_success(a, 0.1)
+  chooser.record_failure(a)
+  assert_false(chooser.is_blacklisted(a))
@@ -25,11 +25,15 @@ from hadoop.api.jobtracker import Jobtracker
 from hadoop.api.jobtracker.ttypes import ThriftJobID, ThriftTaskAttemptID, \
     ThriftTaskType, ThriftTaskPhase, ThriftTaskID, \
     ThriftTaskState, ThriftJobState, ThriftJobPriority, TaskNotFoundException, \
-    JobTrackerState, JobNotFoundException, ThriftTaskQueryState
+    TaskTrackerNotFoundException, JobTrackerState, JobNotFoundException, ThriftTaskQueryState
 from hadoop.api.common.ttypes import RequestContext
 from thrift.transport import TTransport
 
+import logging
 import threading
+import time
+
+LOG = logging.getLogger(__name__)
 
 VALID_TASK_STATES = set(["succeeded", "failed", "running", "pending", "killed"])
 VALID_TASK_TYPES = set(["map", "reduce", "job_cleanup", "job_setup"])
@@ -39,6 +43,14 @@ JT_THRIFT_TIMEOUT = 15
 
 DEFAULT_USER = "webui"
 
+# How often (seconds) the cluster topology (the task trackers) is refreshed
+# in the background. A topology older than TOPOLOGY_MAX_STALENESS is
+# refreshed before being read, and the refresh thread exits once the
+# topology hasn't been read for TOPOLOGY_IDLE_TIMEOUT.
+TOPOLOGY_REFRESH_INTERVAL = 30
+TOPOLOGY_MAX_STALENESS = 2 * 60
+TOPOLOGY_IDLE_TIMEOUT = 5 * 60
+
 def test_jt_configuration(cluster):
   """Test FS configuration. Returns list of (confvar, error)."""
   err = validate_port(cluster.JT_THRIFT_PORT)
@@ -55,6 +67,38 @@ def test_jt_configuration(cluster):
   return []
 
 
+class ClusterTopology(object):
+  """
+  The task trackers of a cluster, active and blacklisted, by name and by
+  host, as fetched at `refreshed` (seconds since the epoch).
+  """
+  def __init__(self, active, blacklisted, refreshed):
+    self.active = active
+    self.blacklisted = blacklisted
+    self.refreshed = refreshed
+    self._by_name = {}
+    self._by_host = {}
+    for tracker in active + blacklisted:
+      self._by_name[tracker.trackerName] = tracker
+      self._by_host.setdefault(tracker.host, []).append(tracker)
+    self._blacklisted_names = set([ tracker.trackerName for tracker in blacklisted ])
+
+  def trackers(self):
+    """The ThriftTaskTrackerStatus of every tracker, active ones first."""
+    return self.active + self.blacklisted
+
+  def get(self, name):
+    """The ThriftTaskTrackerStatus of the named tracker, or None."""
+    return self._by_name.get(name)
+
+  def on_host(self, host):
+    """The trackers running on host."""
+    return list(self._by_host.get(host, ()))
+
+  def is_blacklisted(self, name):
+    return name in self._blacklisted_names
+
+
 class LiveJobTracker(object):
   """
   Connects to a JobTracker over our Thrift interface.
@@ -80,6 +124,15 @@ class LiveJobTracker(object):
     # thread-local.
     self.thread_local = threading.local()
     self.setuser(DEFAULT_USER)
+    # The cluster topology, kept up to date by a background thread while
+    # it is being read (unless topology_in_background is turned off).
+    # The condition guards the attributes below.
+    self.topology_in_background = True
+    self._topology = None
+    self._topology_cond = threading.Condition()
+    self._topology_refresh_lock = threading.Lock()
+    self._topology_thread = None
+    self._topology_last_access = None
 
   @classmethod
   def from_conf(cls, conf):
@@ -241,6 +294,76 @@ class LiveJobTracker(object):
     self._fixup_tasktracker(tracker)
     return tracker
 
+  def refresh_topology(self):
+    """
+    Fetches the active and blacklisted trackers, and returns the new
+    ClusterTopology.
+    """
+    self._topology_refresh_lock.acquire()
+    try:
+      topology = ClusterTopology(self.active_trackers().trackers,
+                                 self.blacklisted_trackers().trackers,
+                                 time.time())
+      self._topology_cond.acquire()
+      try:
+        self._topology = topology
+      finally:
+        self._topology_cond.release()
+      return topology
+    finally:
+      self._topology_refresh_lock.release()
+
+  def _run_topology_refresh(self):
+    # The user is thread-local
+    self.setuser(DEFAULT_USER)
+    while True:
+      self._topology_cond.acquire()
+      try:
+        self._topology_cond.wait(TOPOLOGY_REFRESH_INTERVAL)
+        if time.time() - self._topology_last_access > TOPOLOGY_IDLE_TIMEOUT:
+          self._topology_thread = None
+          return
+      finally:
+        self._topology_cond.release()
+      try:
+        self.refresh_topology()
+      except Exception:
+        LOG.exception('Failed to refresh the task trackers of %s:%s' % (self.host, self.thrift_port))
+
+  def topology(self):
+    """
+    Returns the ClusterTopology, as of at most TOPOLOGY_MAX_STALENESS ago,
+    and has a thread keep it up to date for a while.
+    """
+    self._topology_cond.acquire()
+    try:
+      now = time.time()
+      self._topology_last_access = now
+      topology = self._topology
+      if self.topology_in_background and self._topology_thread is None:
+        self._topology_thread = threading.Thread(target=self._run_topology_refresh,
+                                                 name='jobtracker-topology')
+        self._topology_thread.setDaemon(True)
+        self._topology_thread.start()
+    finally:
+      self._topology_cond.release()
+    if topology is None or now - topology.refreshed > TOPOLOGY_MAX_STALENESS:
+      topology = self.refresh_topology()
+    return topology
+
+  def find_task_tracker(self, name):
+    """
+    Returns the ThriftTaskTrackerStatus of the named tracker, from the
+    topology. Trackers that joined since it was fetched are asked about.
+    Raises TaskTrackerNotFoundException.
+    """
+    tracker = self.topology().get(name)
+    if tracker is None:
+      tracker = self.task_tracker(name)
+      if tracker is None:
+        raise TaskTrackerNotFoundException("Cannot find TaskTracker '%s'" % (name,))
+    return tracker
+
   def get_job(self, jobid):
     """
     Returns a ThriftJobInProgress (including task info)
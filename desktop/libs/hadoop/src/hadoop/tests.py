@@ -28,7 +28,10 @@ import desktop.views
 from desktop.lib.django_test_util import make_logged_in_client
 from hadoop import conf
 from hadoop import confparse
+from hadoop import job_tracker
 from hadoop import mini_cluster
+from hadoop.api.jobtracker.ttypes import ThriftTaskTrackerStatus, ThriftTaskTrackerStatusList, \
+    TaskTrackerNotFoundException
 
 @attr('requires_hadoop')
 def test_live_jobtracker():
@@ -46,6 +49,7 @@ def test_live_jobtracker():
     assert_true(jt.all_task_trackers())
     assert_true(jt.active_trackers())
     assert_true(jt.blacklisted_trackers())
+    assert_true(jt.topology().trackers())
     # not tested: task_tracker
     assert_true(jt.running_jobs())
     assert_true(jt.completed_jobs())
@@ -58,6 +62,69 @@ def test_live_jobtracker():
     cluster.shutdown()
 
 
+class FakeJobtrackerClient(object):
+  """Answers the tracker calls of the Jobtracker Thrift client."""
+  def __init__(self):
+    self.calls = []
+    self.active = []
+    self.blacklisted = []
+
+  def _list(self, trackers):
+    return ThriftTaskTrackerStatusList(trackers=list(trackers))
+
+  def getActiveTrackers(self, ctx):
+    self.calls.append('getActiveTrackers')
+    return self._list(self.active)
+
+  def getBlacklistedTrackers(self, ctx):
+    self.calls.append('getBlacklistedTrackers')
+    return self._list(self.blacklisted)
+
+  def getTracker(self, ctx, name):
+    self.calls.append('getTracker')
+    for tracker in self.active + self.blacklisted:
+      if tracker.trackerName == name:
+        return tracker
+    raise TaskTrackerNotFoundException()
+
+
+def test_cluster_topology():
+  def tracker(name, host):
+    return ThriftTaskTrackerStatus(trackerName=name, host=host, taskReports=[])
+  jt = job_tracker.LiveJobTracker('localhost', 0)
+  jt.client = client = FakeJobtrackerClient()
+  jt.topology_in_background = False
+  client.active = [ tracker('tracker_a:1', 'a'), tracker('tracker_a:2', 'a') ]
+  client.blacklisted = [ tracker('tracker_b:1', 'b') ]
+
+  # Trackers are looked up in the topology, fetched once
+  topology = jt.topology()
+  assert_equal(['tracker_a:1', 'tracker_a:2', 'tracker_b:1'],
+               [ t.trackerName for t in topology.trackers() ])
+  assert_equal(['tracker_a:1', 'tracker_a:2'], [ t.trackerName for t in topology.on_host('a') ])
+  assert_equal([], topology.on_host('c'))
+  assert_true(topology.is_blacklisted('tracker_b:1'))
+  assert_false(topology.is_blacklisted('tracker_a:1'))
+  assert_equal('b', jt.find_task_tracker('tracker_b:1').host)
+  assert_true(jt.topology() is topology)
+  assert_equal(['getActiveTrackers', 'getBlacklistedTrackers'], client.calls)
+
+  # Trackers that joined since are asked about, unknown ones aren't found
+  del client.calls[:]
+  client.active.append(tracker('tracker_c:1', 'c'))
+  assert_equal('c', jt.find_task_tracker('tracker_c:1').host)
+  assert_equal(['getTracker'], client.calls)
+  try:
+    jt.find_task_tracker('tracker_d:1')
+    assert_true(False)
+  except TaskTrackerNotFoundException:
+    pass
+
+  # A stale topology is refreshed before being read
+  topology.refreshed -= job_tracker.TOPOLOGY_MAX_STALENESS + 1
+  assert_equal('c', jt.topology().get('tracker_c:1').host)
+
+
 def test_confparse():
   """Test configuration parsing"""
   data = """